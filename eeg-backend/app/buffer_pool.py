@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from config import BUFFER_POOL_BYTES
+from metrics import REGISTRY, CACHE_HITS, CACHE_MISSES
+
+POOL_BYTES = REGISTRY.gauge(
+    'brainwave_buffer_pool_bytes', 'Bytes held by the buffer pool, lent out or idle.', labelnames=('state',))
+POOL_HIGH_WATER = REGISTRY.gauge(
+    'brainwave_buffer_pool_high_water_bytes', 'Most bytes the buffer pool has held at once.')
+
+
+def _capacity(rows):
+    """Rounds a row count up to 1/8 of its power of two, so recordings of similar length share buffers."""
+    if rows <= 8:
+        return rows
+    step = 1 << (rows.bit_length() - 4)
+    return -(-rows // step) * step
+
+
+class BufferPool:
+    """Reusable numpy buffers keyed by shape and dtype, for the large per-recording arrays.
+
+    acquire() hands out an uninitialized array (a view of the leading rows of a slightly larger buffer) and release()
+    takes it, or any view of it, back. Idle buffers beyond max_idle_bytes are dropped, oldest first, so a worker's
+    footprint settles at what its concurrent recordings need.
+    """
+
+    def __init__(self, max_idle_bytes):
+        self.max_idle_bytes = max_idle_bytes
+        self.in_use_bytes = 0
+        self.idle_bytes = 0
+        self.high_water_bytes = 0
+        self._in_use = {}
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.float32):
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype)
+        key = (_capacity(shape[0]),) + shape[1:] + (dtype.str,)
+        with self._lock:
+            buffer = None
+            for buffer_id in reversed(self._idle):
+                if self._idle[buffer_id][0] == key:
+                    buffer = self._idle.pop(buffer_id)[1]
+                    self.idle_bytes -= buffer.nbytes
+                    break
+            if buffer is None:
+                CACHE_MISSES.inc(cache='buffer_pool')
+                buffer = np.empty((key[0],) + shape[1:], dtype=dtype)
+            else:
+                CACHE_HITS.inc(cache='buffer_pool')
+            self._in_use[id(buffer)] = (key, buffer)
+            self.in_use_bytes += buffer.nbytes
+            self._update_metrics()
+        return buffer if buffer.shape[0] == shape[0] else buffer[:shape[0]]
+
+    def release(self, array):
+        with self._lock:
+            while id(array) not in self._in_use:
+                if array.base is None or not isinstance(array.base, np.ndarray):
+                    raise ValueError('Array was not acquired from this buffer pool')
+                array = array.base
+            key, buffer = self._in_use.pop(id(array))
+            self.in_use_bytes -= buffer.nbytes
+            self._idle[id(buffer)] = (key, buffer)
+            self.idle_bytes += buffer.nbytes
+            while self.idle_bytes > self.max_idle_bytes:
+                _, (_, evicted) = self._idle.popitem(last=False)
+                self.idle_bytes -= evicted.nbytes
+            self._update_metrics()
+
+    @contextmanager
+    def borrow(self, shape, dtype=np.float32):
+        array = self.acquire(shape, dtype)
+        try:
+            yield array
+        finally:
+            self.release(array)
+
+    def clear(self):
+        """Drops all idle buffers."""
+        with self._lock:
+            self._idle.clear()
+            self.idle_bytes = 0
+            self._update_metrics()
+
+    def _update_metrics(self):
+        self.high_water_bytes = max(self.high_water_bytes, self.in_use_bytes + self.idle_bytes)
+        POOL_BYTES.set(self.in_use_bytes, state='in_use')
+        POOL_BYTES.set(self.idle_bytes, state='idle')
+        POOL_HIGH_WATER.set(self.high_water_bytes)
+
+
+POOL = BufferPool(BUFFER_POOL_BYTES)
@@ -0,0 +1,274 @@
+import os
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import time
+from config import CATALOG_FOLDER, CATALOG_REFRESH_SECONDS
+from raw_reader import read_header
+from metrics import CACHE_HITS, CACHE_MISSES
+
+# Bump when the table layout changes; older catalogs are dropped and rebuilt on open.
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    dir_mtime INTEGER,
+    metadata_mtime INTEGER,
+    metadata TEXT,
+    records_mtime INTEGER,
+    records TEXT
+);
+CREATE TABLE IF NOT EXISTS recordings (
+    patient_id TEXT,
+    record_name TEXT,
+    header_mtime INTEGER,
+    fs REAL,
+    num_samples INTEGER,
+    num_signals INTEGER,
+    channels TEXT,
+    PRIMARY KEY (patient_id, record_name)
+);
+"""
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+class Catalog:
+    """Index of an I-CARE style data folder: patients, their metadata, RECORDS entries and recording headers.
+
+    The index lives in memory for lookups and is persisted to SQLite so a new process starts from the previous scan.
+    A refresh stats each patient folder and only rescans folders whose mtime changed; within a rescanned folder,
+    files whose mtime is unchanged are not reopened. Files rewritten in place leave the folder mtime alone, so they are
+    only picked up by refresh(deep=True), which rescans every folder and stats each of its files.
+    """
+
+    def __init__(self, root_folder, db_path=None):
+        self.root_folder = os.path.realpath(root_folder)
+        self.db_path = db_path
+        self.patients = {}
+        self.recordings = {}
+        self.last_refresh = None
+        self._lock = threading.Lock()
+        if self.db_path is not None:
+            self._load()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            conn.executescript('DROP TABLE IF EXISTS patients; DROP TABLE IF EXISTS recordings;')
+            conn.executescript(_SCHEMA)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+        return conn
+
+    def _load(self):
+        conn = self._connect()
+        try:
+            for pid, dir_mtime, metadata_mtime, metadata, records_mtime, records in conn.execute(
+                    'SELECT patient_id, dir_mtime, metadata_mtime, metadata, records_mtime, records FROM patients'):
+                self.patients[pid] = {
+                    'dir_mtime': dir_mtime,
+                    'metadata_mtime': metadata_mtime,
+                    'metadata': metadata,
+                    'records_mtime': records_mtime,
+                    'records': records.split('\n') if records is not None else None,
+                }
+                self.recordings.setdefault(pid, {})
+            for pid, record_name, header_mtime, fs, num_samples, num_signals, channels in conn.execute(
+                    'SELECT patient_id, record_name, header_mtime, fs, num_samples, num_signals, channels FROM recordings'):
+                self.recordings.setdefault(pid, {})[record_name] = {
+                    'header_mtime': header_mtime,
+                    'fs': fs,
+                    'num_samples': num_samples,
+                    'num_signals': num_signals,
+                    'channels': channels.split('\n') if channels else [],
+                }
+        finally:
+            conn.close()
+
+    def _save(self, changed, removed):
+        conn = self._connect()
+        try:
+            with conn:
+                for pid in list(changed) + list(removed):
+                    conn.execute('DELETE FROM patients WHERE patient_id = ?', (pid,))
+                    conn.execute('DELETE FROM recordings WHERE patient_id = ?', (pid,))
+                for pid in changed:
+                    patient = self.patients[pid]
+                    records = '\n'.join(patient['records']) if patient['records'] is not None else None
+                    conn.execute('INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?)', (
+                        pid, patient['dir_mtime'], patient['metadata_mtime'], patient['metadata'],
+                        patient['records_mtime'], records))
+                    conn.executemany('INSERT INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                        (pid, name, rec['header_mtime'], rec['fs'], rec['num_samples'], rec['num_signals'],
+                         '\n'.join(rec['channels']))
+                        for name, rec in self.recordings[pid].items()])
+        finally:
+            conn.close()
+
+    def refresh(self, deep=False):
+        """Brings the catalog up to date with the folder; returns the number of patients rescanned."""
+        with self._lock:
+            seen = set()
+            changed = []
+            with os.scandir(self.root_folder) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+                    seen.add(entry.name)
+                    dir_mtime = entry.stat().st_mtime_ns
+                    cached = self.patients.get(entry.name)
+                    if not deep and cached is not None and cached['dir_mtime'] == dir_mtime:
+                        CACHE_HITS.inc(cache='catalog')
+                        continue
+                    CACHE_MISSES.inc(cache='catalog')
+                    if self._scan_patient(entry.name, entry.path, dir_mtime):
+                        changed.append(entry.name)
+            removed = [pid for pid in self.patients if pid not in seen]
+            for pid in removed:
+                del self.patients[pid]
+                self.recordings.pop(pid, None)
+            if self.db_path is not None and (changed or removed):
+                self._save(changed, removed)
+            self.last_refresh = time.monotonic()
+            return len(changed)
+
+    def _scan_patient(self, patient_id, patient_folder, dir_mtime):
+        cached = self.patients.get(patient_id) or {}
+        cached_recordings = self.recordings.get(patient_id, {})
+        files = {}
+        with os.scandir(patient_folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[entry.name] = entry.stat().st_mtime_ns
+
+        metadata_mtime = files.get(patient_id + '.txt')
+        if metadata_mtime is None:
+            metadata = None
+        elif metadata_mtime == cached.get('metadata_mtime'):
+            metadata = cached['metadata']
+        else:
+            with open(os.path.join(patient_folder, patient_id + '.txt'), 'r') as f:
+                metadata = f.read()
+
+        records_mtime = files.get('RECORDS')
+        if records_mtime is None:
+            records = None
+        elif records_mtime == cached.get('records_mtime'):
+            records = cached['records']
+        else:
+            with open(os.path.join(patient_folder, 'RECORDS'), 'r') as f:
+                records = [line.strip() for line in f if line.strip()]
+
+        recordings = {}
+        for file_name, header_mtime in files.items():
+            if file_name.startswith('.') or not file_name.endswith('.hea'):
+                continue
+            record_name = file_name[:-len('.hea')]
+            previous = cached_recordings.get(record_name)
+            if previous is not None and previous['header_mtime'] == header_mtime:
+                recordings[record_name] = previous
+                continue
+            try:
+                header = read_header(os.path.join(patient_folder, file_name))
+                recordings[record_name] = {
+                    'header_mtime': header_mtime,
+                    'fs': header['fs'],
+                    'num_samples': header['num_samples'],
+                    'num_signals': header['num_signals'],
+                    'channels': header['channels'],
+                }
+            except Exception as e:
+                print(f"Error reading header file {file_name}: {e}")
+                recordings[record_name] = {
+                    'header_mtime': header_mtime, 'fs': None, 'num_samples': None, 'num_signals': None, 'channels': []}
+
+        patient = {
+            'dir_mtime': dir_mtime,
+            'metadata_mtime': metadata_mtime,
+            'metadata': metadata,
+            'records_mtime': records_mtime,
+            'records': records,
+        }
+        if patient == cached and recordings == cached_recordings:
+            return False
+        self.patients[patient_id] = patient
+        self.recordings[patient_id] = recordings
+        return True
+
+    def patient_ids(self):
+        """Patients with a metadata file, sorted; same result as scanning for <patient>/<patient>.txt."""
+        return sorted(pid for pid, patient in self.patients.items() if patient['metadata'] is not None)
+
+    def metadata(self, patient_id):
+        patient = self.patients.get(patient_id)
+        return patient['metadata'] if patient is not None else None
+
+    def outcome(self, patient_id):
+        """The raw Outcome string ('Good'/'Poor') from the patient metadata, or None."""
+        metadata = self.metadata(patient_id)
+        if metadata is None:
+            return None
+        outcomes = [line.split(':')[-1].strip() for line in metadata.split('\n') if 'Outcome' in line]
+        return outcomes[0] if outcomes else None
+
+    def records(self, patient_id, suffix=None):
+        """Entries of the patient's RECORDS file, optionally only those ending in _<suffix>; None without RECORDS."""
+        patient = self.patients.get(patient_id)
+        if patient is None or patient['records'] is None:
+            return None
+        if suffix is None:
+            return list(patient['records'])
+        return [record for record in patient['records'] if record.split('_')[-1] == suffix]
+
+    def recording_names(self, patient_id, suffix='EEG'):
+        """Sorted names of the patient's recordings with a header file, optionally filtered by suffix."""
+        recordings = self.recordings.get(patient_id, {})
+        return sorted(name for name in recordings if suffix is None or name.split('_')[-1] == suffix)
+
+    def recording(self, patient_id, record_name):
+        return self.recordings.get(patient_id, {}).get(record_name)
+
+    def duration(self, patient_id, record_name):
+        """Recording length in seconds from its header, or None if it has no readable header."""
+        recording = self.recording(patient_id, record_name)
+        if recording is None or not recording['fs'] or recording['num_samples'] is None:
+            return None
+        return recording['num_samples'] / recording['fs']
+
+
+def catalog_path(root_folder):
+    key = hashlib.sha1(os.path.realpath(root_folder).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CATALOG_FOLDER, f'{key}.sqlite')
+
+
+def open_catalog(root_folder, persist=None, max_age=None):
+    """Returns the process-wide catalog for root_folder, refreshed if it is older than max_age seconds.
+
+    Catalogs are persisted unless the folder lives under the system temp directory (e.g. extracted uploads).
+    """
+    if max_age is None:
+        max_age = CATALOG_REFRESH_SECONDS
+    key = os.path.realpath(root_folder)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            if persist is None:
+                persist = not key.startswith(os.path.realpath(tempfile.gettempdir()) + os.sep)
+            catalog = Catalog(key, catalog_path(key) if persist else None)
+            _catalogs[key] = catalog
+    if catalog.last_refresh is None or time.monotonic() - catalog.last_refresh > max_age:
+        catalog.refresh()
+    return catalog
+
+
+def forget_catalog(root_folder):
+    """Drops cached catalogs for root_folder and any folder below it, e.g. once a temporary upload is deleted."""
+    key = os.path.realpath(root_folder)
+    with _catalogs_lock:
+        for path in [path for path in _catalogs if path == key or path.startswith(key + os.sep)]:
+            del _catalogs[path]
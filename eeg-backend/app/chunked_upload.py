@@ -0,0 +1,357 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from config import UPLOAD_FOLDER, UPLOAD_CHUNK_BYTES, UPLOAD_MAX_CHUNK_BYTES, UPLOAD_TTL_SECONDS
+from catalog import open_catalog, forget_catalog
+from metrics import time_stage, FAILURES
+
+# Resumable uploads of cohort ZIPs. The client declares the file size and chunk size, then PUTs chunks in any order,
+# each with its SHA-256; a chunk can be re-sent until it is accepted. Chunks are written at their offset in the file,
+# and upload state is saved next to it so an interrupted upload resumes from the chunks already stored.
+#
+# While chunks arrive, a job thread extracts the ZIP entries covered by the contiguous prefix received so far, using
+# their local headers, and scores each patient as soon as the archive moves on to the next patient's folder. Once the
+# upload is complete, the central directory is checked: entries that could not be streamed (data descriptors,
+# encryption) are extracted then, and patients whose files turned up after they were scored are scored again.
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+COPY_BLOCK_BYTES = 1 << 20
+
+
+def _safe_member_path(folder, name):
+    """Destination of a ZIP member inside folder, or None for absolute or escaping names."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or ':' in parts[0]:
+        return None
+    return os.path.join(folder, *parts)
+
+
+def _patient_of(name):
+    """(relative data root, patient id) for a file directly inside an I-CARE patient folder, else None."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part]
+    if len(parts) < 2 or not parts[-1].startswith(parts[-2]):
+        return None
+    return '/'.join(parts[:-2]), parts[-2]
+
+
+class ZipStreamExtractor:
+    """Extracts ZIP members from the front of a file that is still being written, using local file headers."""
+
+    def __init__(self, zip_path, folder):
+        self.zip_path = zip_path
+        self.folder = folder
+        self.offset = 0
+        self.extracted = []  # member names, in archive order
+        self.stopped = False  # reached the central directory or a member that cannot be streamed
+
+    def extract_available(self, available):
+        """Extracts every member that lies entirely below byte `available`; returns the names extracted."""
+        names = []
+        with open(self.zip_path, 'rb') as f:
+            while not self.stopped and available - self.offset >= LOCAL_HEADER.size:
+                f.seek(self.offset)
+                (signature, _, flags, method, _, _, crc, compressed_size, _, name_length,
+                 extra_length) = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+                if signature != LOCAL_HEADER_SIGNATURE or flags & 0x9 or method not in (0, 8) \
+                        or compressed_size == 0xFFFFFFFF:
+                    # Central directory, or sizes only known after the data (bit 3), encryption (bit 0) or ZIP64.
+                    self.stopped = True
+                    break
+                data_start = self.offset + LOCAL_HEADER.size + name_length + extra_length
+                if data_start + compressed_size > available:
+                    break
+                name = f.read(name_length).decode('cp437' if not flags & 0x800 else 'utf-8')
+                f.seek(data_start)
+                self._extract_member(f, name, method, compressed_size, crc)
+                self.offset = data_start + compressed_size
+                self.extracted.append(name)
+                names.append(name)
+        return names
+
+    def _extract_member(self, f, name, method, compressed_size, crc):
+        path = _safe_member_path(self.folder, name)
+        if path is None:
+            return
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        decompressor = zlib.decompressobj(-15) if method == 8 else None
+        checksum = 0
+        remaining = compressed_size
+        with open(path, 'wb') as out:
+            while remaining:
+                block = f.read(min(COPY_BLOCK_BYTES, remaining))
+                remaining -= len(block)
+                if decompressor is not None:
+                    block = decompressor.decompress(block)
+                checksum = zlib.crc32(block, checksum)
+                out.write(block)
+            if decompressor is not None:
+                tail = decompressor.flush()
+                checksum = zlib.crc32(tail, checksum)
+                out.write(tail)
+        if checksum != crc:
+            raise zipfile.BadZipFile(f"CRC mismatch for {name}")
+
+
+class ChunkedUpload:
+    """One resumable upload and the job that extracts and scores it."""
+
+    def __init__(self, folder, state, idle_timeout=UPLOAD_TTL_SECONDS):
+        self.folder = folder
+        self.state = state
+        self.zip_path = os.path.join(folder, 'upload.zip')
+        self.data_folder = os.path.join(folder, 'extracted')
+        self.condition = threading.Condition()
+        self.job = None
+        self.last_activity = time.monotonic()
+        self.idle_timeout = idle_timeout  # the job stops waiting for chunks after this long without activity
+
+    @property
+    def upload_id(self):
+        return self.state['upload_id']
+
+    def num_chunks(self):
+        return max(1, -(-self.state['size'] // self.state['chunk_size']))
+
+    def chunk_length(self, index):
+        return min(self.state['chunk_size'], self.state['size'] - index * self.state['chunk_size'])
+
+    def contiguous_bytes(self):
+        """Length of the prefix of the file whose chunks have all been received."""
+        received = set(self.state['received'])
+        index = 0
+        while index in received:
+            index += 1
+        return min(self.state['size'], index * self.state['chunk_size'])
+
+    def complete(self):
+        return len(self.state['received']) == self.num_chunks()
+
+    def touch(self):
+        with self.condition:
+            self.last_activity = time.monotonic()
+
+    def busy(self):
+        """Whether the job is still running, so the upload must not be reaped from under it."""
+        job = self.job
+        return job is not None and job.is_alive()
+
+    def save_state(self):
+        tmp_path = os.path.join(self.folder, 'state.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, os.path.join(self.folder, 'state.json'))
+
+    def write_chunk(self, index, data, checksum):
+        if not 0 <= index < self.num_chunks():
+            raise ValueError(f"Chunk index {index} out of range (0-{self.num_chunks() - 1})")
+        if len(data) != self.chunk_length(index):
+            raise ValueError(f"Chunk {index} has {len(data)} bytes, expected {self.chunk_length(index)}")
+        if hashlib.sha256(data).hexdigest() != (checksum or '').lower():
+            raise ValueError(f"SHA-256 mismatch for chunk {index}")
+        with self.condition:
+            self.last_activity = time.monotonic()
+            if index not in self.state['received']:
+                with open(self.zip_path, 'r+b') as f:
+                    f.seek(index * self.state['chunk_size'])
+                    f.write(data)
+                self.state['received'].append(index)
+                self.save_state()
+            self.condition.notify_all()
+
+    def status(self):
+        with self.condition:
+            received = set(self.state['received'])
+            return {
+                'upload_id': self.upload_id,
+                'filename': self.state['filename'],
+                'size': self.state['size'],
+                'chunk_size': self.state['chunk_size'],
+                'num_chunks': self.num_chunks(),
+                'received_chunks': len(received),
+                'missing_chunks': [i for i in range(self.num_chunks()) if i not in received],
+                'status': self.state['status'],
+                'error': self.state.get('error'),
+                'patients': sorted(self.state['results'].values(), key=lambda r: r['patient_id']),
+            }
+
+    def start_job(self, score_patient):
+        with self.condition:
+            if self.job is None and self.state['status'] in ('receiving', 'processing'):
+                self.job = threading.Thread(target=self._run_job, args=(score_patient,), daemon=True)
+                self.job.start()
+
+    def _set_status(self, status, error=None):
+        with self.condition:
+            self.state['status'] = status
+            if error is not None:
+                self.state['error'] = error
+            self.save_state()
+            self.condition.notify_all()
+
+    def _run_job(self, score_patient):
+        extractor = ZipStreamExtractor(self.zip_path, self.data_folder)
+        scored_at = {}  # patient -> number of members extracted when it was scored
+        member_counts = {}  # patient -> number of members seen so far
+        current = None
+        abandoned = False
+
+        def score(patient):
+            data_root = os.path.join(self.data_folder, patient[0])
+            if not os.path.isfile(os.path.join(data_root, patient[1], patient[1] + '.txt')):
+                return
+            open_catalog(data_root, max_age=0)
+            result = score_patient(data_root, patient[1])
+            with self.condition:
+                self.state['results'][patient[1]] = result
+                self.save_state()
+            scored_at[patient] = member_counts.get(patient, 0)
+
+        try:
+            while True:
+                with self.condition:
+                    available = self.contiguous_bytes()
+                    complete = self.complete()
+                with time_stage('zip_extraction'):
+                    names = extractor.extract_available(available)
+                for name in names:
+                    patient = _patient_of(name)
+                    if patient is None:
+                        continue
+                    member_counts[patient] = member_counts.get(patient, 0) + 1
+                    if current is not None and patient != current and current not in scored_at:
+                        score(current)
+                    current = patient
+                if complete:
+                    break
+                if not names:
+                    with self.condition:
+                        if self.contiguous_bytes() == available and not self.complete():
+                            if time.monotonic() - self.last_activity > self.idle_timeout:
+                                # Abandoned: stop so reap() can drop the upload. A late chunk restarts the job,
+                                # which extracts again from the start of the file.
+                                abandoned = True
+                                return
+                            self.condition.wait(timeout=min(5, self.idle_timeout))
+
+            self._set_status('processing')
+            with time_stage('zip_extraction'), zipfile.ZipFile(self.zip_path) as zip_ref:
+                streamed = set(extractor.extracted)
+                for info in zip_ref.infolist():
+                    if info.filename in streamed or _safe_member_path(self.data_folder, info.filename) is None:
+                        continue
+                    zip_ref.extract(info, self.data_folder)
+                    patient = _patient_of(info.filename)
+                    if patient is not None:
+                        member_counts[patient] = member_counts.get(patient, 0) + 1
+            for patient in sorted(member_counts):
+                if scored_at.get(patient) != member_counts[patient]:
+                    score(patient)
+            if not self.state['results']:
+                self._set_status('failed', 'No valid patient data found in ZIP structure')
+            else:
+                self._set_status('done')
+        except zipfile.BadZipFile as e:
+            FAILURES.inc(stage='chunked_upload')
+            self._set_status('failed', f'Invalid ZIP file: {e}')
+        except Exception as e:
+            print(f"Error processing chunked upload {self.upload_id}: {e}")
+            FAILURES.inc(stage='chunked_upload')
+            self._set_status('failed', str(e))
+        finally:
+            forget_catalog(self.data_folder)
+            shutil.rmtree(self.data_folder, ignore_errors=True)
+            if self.state['status'] in ('done', 'failed') and os.path.exists(self.zip_path):
+                os.remove(self.zip_path)
+            if abandoned:
+                with self.condition:
+                    self.job = None
+
+
+class ChunkedUploads:
+    """Uploads by id, kept in memory and on disk under folder/<upload id>."""
+
+    def __init__(self, folder, score_patient, ttl=UPLOAD_TTL_SECONDS):
+        self.folder = os.path.abspath(folder)
+        self.score_patient = score_patient
+        self.ttl = ttl
+        self.uploads = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename, size, chunk_size=None):
+        chunk_size = int(chunk_size or UPLOAD_CHUNK_BYTES)
+        if size <= 0 or not 0 < chunk_size <= UPLOAD_MAX_CHUNK_BYTES:
+            raise ValueError(f"size must be positive and chunk_size between 1 and {UPLOAD_MAX_CHUNK_BYTES} bytes")
+        self.reap()
+        upload_id = uuid.uuid4().hex
+        folder = os.path.join(self.folder, upload_id)
+        os.makedirs(folder)
+        state = {'upload_id': upload_id, 'filename': filename, 'size': size, 'chunk_size': chunk_size,
+                 'received': [], 'status': 'receiving', 'results': {}}
+        upload = ChunkedUpload(folder, state, self.ttl)
+        with open(upload.zip_path, 'wb') as f:
+            f.truncate(size)
+        upload.save_state()
+        with self._lock:
+            self.uploads[upload_id] = upload
+        upload.start_job(self.score_patient)
+        return upload
+
+    def get(self, upload_id):
+        """The upload, reloaded from disk after a restart (its job restarts from the stored chunks).
+
+        Counts as activity, so clients polling the status keep the upload from being reaped.
+        """
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None and all(c in '0123456789abcdef' for c in upload_id):
+                folder = os.path.join(self.folder, upload_id)
+                try:
+                    with open(os.path.join(folder, 'state.json'), 'r') as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                upload = self.uploads[upload_id] = ChunkedUpload(folder, state, self.ttl)
+                if state['status'] == 'processing':
+                    state['status'] = 'receiving'
+        if upload is None:
+            return None
+        upload.touch()
+        if os.path.exists(upload.zip_path):
+            upload.start_job(self.score_patient)
+        return upload
+
+    def delete(self, upload_id):
+        with self._lock:
+            upload = self.uploads.pop(upload_id, None)
+        shutil.rmtree(os.path.join(self.folder, upload_id), ignore_errors=True)
+        return upload
+
+    def reap(self):
+        """Drops uploads without activity for longer than the TTL, unless their job is still extracting or scoring."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [uid for uid, upload in self.uploads.items()
+                     if now - upload.last_activity > self.ttl and not upload.busy()]
+        for upload_id in stale:
+            self.delete(upload_id)
+        if not os.path.isdir(self.folder):
+            return
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name not in self.uploads and entry.stat().st_mtime < time.time() - self.ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def chunked_upload_folder():
+    return os.path.join(UPLOAD_FOLDER, 'chunked')
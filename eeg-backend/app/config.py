@@ -1,6 +1,85 @@
 import os
 
 # Configuration for the Flask app
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "..", "uploads")
-DEBUG = True
-PORT = 5001
\ No newline at end of file
+UPLOAD_FOLDER = os.environ.get("BRAINWAVE_UPLOAD_FOLDER", os.path.join(os.path.dirname(__file__), "..", "uploads"))
+DEBUG = os.environ.get("BRAINWAVE_DEBUG", "1") == "1"
+PORT = int(os.environ.get("BRAINWAVE_PORT", 5001))
+MODEL_FOLDER = os.environ.get("BRAINWAVE_MODEL_FOLDER", "./model")
+
+# Dataset catalog (see catalog.py): where the SQLite indexes live and how often an open catalog is re-checked
+CATALOG_FOLDER = os.environ.get("BRAINWAVE_CATALOG_FOLDER", os.path.join(os.path.dirname(__file__), "..", "catalog"))
+CATALOG_REFRESH_SECONDS = float(os.environ.get("BRAINWAVE_CATALOG_REFRESH_SECONDS", 2.0))
+
+# Numeric precision for CombinedModel inference: "fp32" (default) or "bf16" (CPU/GPU autocast, see precision.py)
+INFERENCE_PRECISION = os.environ.get("BRAINWAVE_INFERENCE_PRECISION", "fp32")
+
+# Request tracing (see tracing.py): where Chrome-trace JSON files go, and the fraction of /predict calls traced even
+# without the debug flag
+TRACE_FOLDER = os.environ.get("BRAINWAVE_TRACE_FOLDER", os.path.join(os.path.dirname(__file__), "..", "traces"))
+TRACE_SAMPLE_RATE = float(os.environ.get("BRAINWAVE_TRACE_SAMPLE_RATE", 0.0))
+
+# Preprocessing precision: "float32" runs the in-place float32 path, "float64" the original float64 path
+PREPROCESS_DTYPE = os.environ.get("BRAINWAVE_PREPROCESS_DTYPE", "float32")
+
+# Run the DL forward passes of a patient concurrently with feature extraction and the random forests ("1"), on a
+# shared pool of this many threads
+PARALLEL_BRANCHES = os.environ.get("BRAINWAVE_PARALLEL_BRANCHES", "1") == "1"
+BRANCH_THREADS = int(os.environ.get("BRAINWAVE_BRANCH_THREADS", 2))
+
+# Confidence cascade: when set, the random forests run first and the DL model only scores recordings whose ML
+# confidence abs(p - 0.5) is below this threshold (0 to 0.5; unset runs both models on every recording)
+CASCADE_THRESHOLD = os.environ.get("BRAINWAVE_CASCADE_THRESHOLD")
+CASCADE_THRESHOLD = float(CASCADE_THRESHOLD) if CASCADE_THRESHOLD else None
+
+# Adaptive scoring: when a tolerance is set, a patient's recordings are scored in batches of ADAPTIVE_BATCH (most
+# recent first) and scoring stops once the Student t confidence interval of the mean fused probability is narrower
+# than +/- the tolerance or clears 0.5 by at least the tolerance, after at least ADAPTIVE_MIN_WINDOWS (unset or 0
+# scores every recording). The interval is checked after every batch, so its confidence level is set above the overall
+# confidence wanted.
+ADAPTIVE_TOLERANCE = os.environ.get("BRAINWAVE_ADAPTIVE_TOLERANCE")
+ADAPTIVE_TOLERANCE = float(ADAPTIVE_TOLERANCE) if ADAPTIVE_TOLERANCE else None
+ADAPTIVE_BATCH = int(os.environ.get("BRAINWAVE_ADAPTIVE_BATCH", 4))
+ADAPTIVE_MIN_WINDOWS = int(os.environ.get("BRAINWAVE_ADAPTIVE_MIN_WINDOWS", 4))
+ADAPTIVE_CONFIDENCE = float(os.environ.get("BRAINWAVE_ADAPTIVE_CONFIDENCE", 0.99))
+
+# Recordings of a patient read and decoded ahead of the one being processed (0 reads each one when it is needed)
+PREFETCH_RECORDINGS = int(os.environ.get("BRAINWAVE_PREFETCH_RECORDINGS", 2))
+
+# Idle bytes the per-worker buffer pool keeps for reuse across recordings
+BUFFER_POOL_BYTES = int(os.environ.get("BRAINWAVE_BUFFER_POOL_BYTES", 512 * 2**20))
+
+# Raw sample store (see raw_store.py): where records that cannot be memory-mapped in place are ingested as int16, and
+# how many mapped records each process keeps open
+RAW_STORE_FOLDER = os.environ.get("BRAINWAVE_RAW_STORE_FOLDER", os.path.join(os.path.dirname(__file__), "..", "raw_store"))
+RAW_STORE_OPEN_RECORDS = int(os.environ.get("BRAINWAVE_RAW_STORE_OPEN_RECORDS", 64))
+
+# Live EEG sessions (/live/...): session limit, idle timeout in seconds, windows per forward pass, windows in the
+# rolling probability and scored windows kept per session
+LIVE_MAX_SESSIONS = int(os.environ.get("BRAINWAVE_LIVE_MAX_SESSIONS", 64))
+LIVE_SESSION_TIMEOUT = float(os.environ.get("BRAINWAVE_LIVE_SESSION_TIMEOUT", 300))
+LIVE_MAX_BATCH = int(os.environ.get("BRAINWAVE_LIVE_MAX_BATCH", 32))
+LIVE_ROLLING_WINDOWS = int(os.environ.get("BRAINWAVE_LIVE_ROLLING_WINDOWS", 9))
+LIVE_HISTORY = int(os.environ.get("BRAINWAVE_LIVE_HISTORY", 180))
+
+# Per-patient /predict results kept for identical re-uploads (0 disables), and how often to check the model folder
+# for replaced models, in seconds
+RESULT_CACHE_SIZE = int(os.environ.get("BRAINWAVE_RESULT_CACHE_SIZE", 1024))
+MODEL_CHECK_SECONDS = float(os.environ.get("BRAINWAVE_MODEL_CHECK_SECONDS", 5.0))
+
+# Upload store (see upload_store.py): unreferenced uploads are kept this many seconds for reuse, and the store is
+# trimmed to the quota
+UPLOAD_TTL_SECONDS = float(os.environ.get("BRAINWAVE_UPLOAD_TTL_SECONDS", 3600))
+UPLOAD_QUOTA_BYTES = int(os.environ.get("BRAINWAVE_UPLOAD_QUOTA_BYTES", 2 * 2**30))
+
+# Resumable /predict uploads: default and largest accepted chunk size in bytes
+UPLOAD_CHUNK_BYTES = int(os.environ.get("BRAINWAVE_UPLOAD_CHUNK_BYTES", 8 * 2**20))
+UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get("BRAINWAVE_UPLOAD_MAX_CHUNK_BYTES", 64 * 2**20))
+
+# /infer pipelines (see inference_utils.py): DataLoader worker processes kept alive per directory, and how many
+# directories keep a warm pipeline
+INFER_WORKERS = int(os.environ.get("BRAINWAVE_INFER_WORKERS", 4))
+INFER_MAX_PIPELINES = int(os.environ.get("BRAINWAVE_INFER_MAX_PIPELINES", 4))
+
+# Admin endpoints (/admin/...): token expected in the X-Admin-Token header; without one, the endpoints are disabled
+ADMIN_TOKEN = os.environ.get("BRAINWAVE_ADMIN_TOKEN")
+PROFILE_FOLDER = os.environ.get("BRAINWAVE_PROFILE_FOLDER", os.path.join(os.path.dirname(__file__), "..", "profiles"))
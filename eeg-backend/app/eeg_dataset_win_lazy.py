@@ -1,45 +1,45 @@
 import os
 import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader, random_split
+from torch.utils.data import Dataset, IterableDataset, DataLoader, random_split, get_worker_info
 from scipy import signal
 import wfdb
 import random
 import mne
 mne.set_log_level(verbose='WARNING')
 from mne.filter import filter_data, notch_filter
+from raw_store import open_record
+from catalog import open_catalog
 
 
 class EEGDatasetWinLazy(Dataset):
-    def __init__(self, patients_data, root_dir, records_per_patient=1, fs=100, window_size=10, predict='outcome'):
+    def __init__(self, patients_data, root_dir, records_per_patient=1, fs=100, window_size=10, predict='outcome',
+                 random_access=False, margin_seconds=10):
         self.patients_data = patients_data
         self.root_dir = root_dir
         self.records_per_patient = records_per_patient
         self.fs = fs
         self.window_size = window_size
         self.predict = predict
+        # With random_access, only the sampled window plus a filter margin is read from the signal file instead of
+        # decoding the whole recording. Normalization then uses the window's own min/max rather than the record's.
+        self.random_access = random_access
+        self.margin_seconds = margin_seconds
         self.data_index = self._create_index()
     
     def _create_index(self):
+        catalog = open_catalog(self.root_dir)
         index = []
+        outcomes = [0, 0]
+        label_mapping = {"Good": 0, "Poor": 1}
         for patient_id, records in self.patients_data.items():
             if self.records_per_patient != -1:
                 records = records[:self.records_per_patient]
             for record in records:
-                record = os.path.join(self.root_dir, patient_id, record)
-                record_path = record + '.hea'
-                if self.is_valid_recording(record_path):
-                    index.append((patient_id, record))
-        outcomes = [0, 0]
-        for p_tuple in index:
-            pid, rec = p_tuple
-            metadata_path = os.path.join(self.root_dir, pid, f"{pid}.txt")
-            with open(metadata_path, 'r') as file:
-                metadata = file.readlines()
-                label = [line.split(":")[-1].strip() for line in metadata if "Outcome" in line][0]
-                label_mapping = {"Good": 0, "Poor": 1}
-                label = label_mapping.get(label)  # Default to -1 if outcome is unrecognized  
-                outcomes[label] += 1          
+                duration = catalog.duration(patient_id, record)
+                if duration is not None and duration >= 20:
+                    index.append((patient_id, os.path.join(self.root_dir, patient_id, record)))
+                    outcomes[label_mapping[catalog.outcome(patient_id)]] += 1
         print(f'Good: {outcomes[0]} Poor:{outcomes[1]}')
         return index
 
@@ -48,14 +48,23 @@ class EEGDatasetWinLazy(Dataset):
 
     def __getitem__(self, idx):
         patient_id, record_path = self.data_index[idx]
-        eeg_signal, sampling_rate, _, label = self.read_eeg_data(record_path, patient_id)
-        eeg_signal = self.preprocess_eeg_signal(eeg_signal, sampling_rate)
-        windows, _ = self.create_windows(eeg_signal, label)
+        if self.random_access:
+            window, label = self.read_random_window(record_path, patient_id)
+            return torch.FloatTensor(window)[np.newaxis, :, :], label
+        windows, label = self.load_windows(idx)
         wind, _, _ = windows.shape
         start_idx = self.sample_indices(wind)
         end_idx = start_idx + 1
         return torch.FloatTensor(windows)[start_idx:end_idx, :, :], label
 
+    def load_windows(self, idx):
+        """Decodes and preprocesses a whole record and returns all of its windows with the record's label."""
+        patient_id, record_path = self.data_index[idx]
+        eeg_signal, sampling_rate, _, label = self.read_eeg_data(record_path, patient_id)
+        eeg_signal = self.preprocess_eeg_signal(eeg_signal, sampling_rate)
+        windows, _ = self.create_windows(eeg_signal, label)
+        return windows, label
+
     def sample_indices(self, max_len):
         random_uniform = random.uniform(0,1)
         index = int(random_uniform*max_len)
@@ -63,25 +72,49 @@ class EEGDatasetWinLazy(Dataset):
             index = max_len - 1
         return index
 
+    def read_random_window(self, record_name, patient_id):
+        """Reads and preprocesses one randomly chosen window, decoding only its samples plus the filter margin."""
+        # The record's int16 samples are memory-mapped (see raw_store.py), so the pages are shared between DataLoader
+        # workers and only the window plus margin is rescaled.
+        record = open_record(record_name)
+        sampling_rate = record.fs
+        num_time_samples = self.window_size * self.fs
+        num_windows = int(record.num_samples * self.fs / sampling_rate) // num_time_samples
+        raw_window = int(round(self.window_size * sampling_rate))
+        start = self.sample_indices(max(num_windows, 1)) * raw_window
+        margin = int(round(self.margin_seconds * sampling_rate))
+
+        read_start = max(0, start - margin)
+        eeg_signal = record.read(read_start, start + raw_window + margin, dtype=np.float64)
+        offset = start - read_start
+        eeg_signal = self.preprocess_eeg_signal(eeg_signal, sampling_rate)
+
+        offset = int(round(offset * self.fs / sampling_rate))
+        window = eeg_signal[offset:offset + num_time_samples]
+        if window.shape[0] < num_time_samples:
+            padding = np.zeros((num_time_samples - window.shape[0], window.shape[1]))
+            window = np.vstack((window, padding))
+        return window, self.read_label(patient_id)
+
     def read_eeg_data(self, record_name, patient_id):
         record = wfdb.rdrecord(record_name)
         sampling_rate = record.fs
         channels = record.p_signal.shape[1]
+        label = self.read_label(patient_id)
+        return record.p_signal, sampling_rate, channels, label
 
-        metadata_path = os.path.join(self.root_dir, patient_id, f"{patient_id}.txt")
+    def read_label(self, patient_id):
+        catalog = open_catalog(self.root_dir)
         label_mapping = {"Good": 0, "Poor": 1}
 
-        with open(metadata_path, "r") as file:
-            metadata = file.readlines()
-            if self.predict == "outcome":
-                label = [line.split(":")[-1].strip() for line in metadata if "Outcome" in line][0]
-                label = label_mapping.get(label, -1)  # Default to -1 if outcome is unrecognized
-            elif self.predict == "cpc":
-                label = [int(line.split(":")[-1].strip()) for line in metadata if "CPC" in line][0]
-            else:
-                raise ValueError("Invalid 'predict' value. Must be 'outcome' or 'cpc'.")
-        
-        return record.p_signal, sampling_rate, channels, label
+        if self.predict == "outcome":
+            label = label_mapping.get(catalog.outcome(patient_id), -1)  # Default to -1 if outcome is unrecognized
+        elif self.predict == "cpc":
+            metadata = catalog.metadata(patient_id).split("\n")
+            label = [int(line.split(":")[-1].strip()) for line in metadata if "CPC" in line][0]
+        else:
+            raise ValueError("Invalid 'predict' value. Must be 'outcome' or 'cpc'.")
+        return label
 
     def preprocess_eeg_signal(self, eeg_signal, sampling_rate):
         # Resample to target frequency
@@ -176,8 +209,84 @@ class EEGDatasetWinLazy(Dataset):
         return eeg_windows, labels
 
 
-def create_dataloader(patients_data, root_dir, batch_size=32, records_per_patient=1, val_split=0.2, predict='outcome'):
+class RecordGroupedSampler:
+    """Yields record indices in random order; inside DataLoader workers each worker takes a disjoint share."""
+    def __init__(self, indices, shuffle=True):
+        self.indices = list(indices)
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        indices = self.indices
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            indices = indices[worker_info.id::worker_info.num_workers]
+        indices = list(indices)
+        if self.shuffle:
+            random.shuffle(indices)
+        return iter(indices)
+
+
+class EEGDatasetRecordWindows(IterableDataset):
+    """Yields windows_per_record random windows from each record while decoding and filtering it only once.
+
+    Windows pass through a shuffle buffer so consecutive samples (and therefore batches) mix windows from many
+    records instead of K windows of the same record in a row.
+    """
+    def __init__(self, dataset, sampler, windows_per_record=8, shuffle_buffer=256):
+        self.dataset = dataset
+        self.sampler = sampler
+        self.windows_per_record = windows_per_record
+        self.shuffle_buffer = shuffle_buffer
+
+    def __len__(self):
+        return len(self.sampler) * self.windows_per_record
+
+    def __iter__(self):
+        buffer = []
+        for idx in self.sampler:
+            windows, label = self.dataset.load_windows(idx)
+            num_windows = windows.shape[0]
+            if num_windows == 0:
+                continue
+            picks = random.sample(range(num_windows), min(self.windows_per_record, num_windows))
+            for pick in picks:
+                item = (torch.FloatTensor(windows[pick:pick + 1]), label)
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(item)
+                else:
+                    slot = random.randrange(len(buffer))
+                    yield buffer[slot]
+                    buffer[slot] = item
+        random.shuffle(buffer)
+        yield from buffer
+
+
+def create_grouped_dataloader(patients_data, root_dir, batch_size=32, records_per_patient=1, val_split=0.2, predict='outcome',
+                              windows_per_record=8, shuffle_buffer=256, num_workers=4):
+    """Like create_dataloader, but each record is decoded once per epoch and contributes windows_per_record windows."""
     dataset = EEGDatasetWinLazy(patients_data, root_dir, window_size=20, records_per_patient=records_per_patient, predict=predict)
+
+    indices = list(range(len(dataset)))
+    random.shuffle(indices)
+    val_size = int(len(dataset) * val_split)
+    train_sampler = RecordGroupedSampler(indices[val_size:])
+    val_sampler = RecordGroupedSampler(indices[:val_size])
+
+    train_dataset = EEGDatasetRecordWindows(dataset, train_sampler, windows_per_record, shuffle_buffer)
+    val_dataset = EEGDatasetRecordWindows(dataset, val_sampler, windows_per_record, shuffle_buffer)
+
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, drop_last=False, num_workers=num_workers, pin_memory=True)
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, drop_last=False, num_workers=num_workers, pin_memory=True)
+
+    return train_loader, val_loader
+
+
+def create_dataloader(patients_data, root_dir, batch_size=32, records_per_patient=1, val_split=0.2, predict='outcome', random_access=False):
+    dataset = EEGDatasetWinLazy(patients_data, root_dir, window_size=20, records_per_patient=records_per_patient, predict=predict,
+                                random_access=random_access)
     
     val_size = int(len(dataset) * val_split)
     train_size = len(dataset) - val_size
@@ -2,10 +2,11 @@ import os
 import random
 import matplotlib.pyplot as plt
 from sklearn.model_selection import train_test_split
+from catalog import open_catalog
 
 def get_patients(root_path, prototype=False, val_split=0.2, per_class=15, max_num_patients=None, plot_data_distribution=False):
     """Retrieves patient directories from the root path and splits data into training and validation sets."""
-    patient_ids = [name for name in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, name))]
+    catalog = open_catalog(root_path)
     patients_data = {}
     val_data = {}
 
@@ -17,53 +18,43 @@ def get_patients(root_path, prototype=False, val_split=0.2, per_class=15, max_nu
 
     max_val_per_class = int(per_class * val_split)
 
-    for patient_id in patient_ids:
-        records_file = os.path.join(root_path, patient_id, 'RECORDS')
-        metadata_path = os.path.join(root_path, patient_id, f'{patient_id}.txt')
-
-        if not os.path.isfile(records_file):
+    for patient_id in sorted(catalog.patients):
+        records = catalog.records(patient_id, suffix='EEG')
+        if records is None:
             continue
 
         if (max_num_patients != None and total_patient_count >= max_num_patients):
             break
 
-        try:
-            with open(records_file, 'r') as f:
-                records = [line.strip() for line in f if line.strip().split("_")[-1] == 'EEG']
-            if(not os.path.exists(metadata_path)): 
-                continue
-            with open(metadata_path, 'r') as file:
-                metadata = file.readlines()
-                outcome = [line.split(':')[-1].strip() for line in metadata if 'Outcome' in line][0]
-                if outcome == 'Good':
-                    if(prototype and per_class > len(good_patients)):
-                        outcomes_count[0] += 1
-                        good_patients.append(patient_id)
-                        patients_data[patient_id] = records
-                    elif(prototype and max_val_per_class > val_outcomes_count[0]):
-                        val_data[patient_id] = records
-                        val_outcomes_count[0] += 1
-                    elif not prototype:
-                        outcomes_count[0] += 1
-                        good_patients.append(patient_id)
-                        patients_data[patient_id] = records
-                        
-                else:
-                    if(prototype and per_class > len(poor_patients)):
-                        outcomes_count[1] += 1
-                        poor_patients.append(patient_id)
-                        patients_data[patient_id] = records
-                    elif(prototype and max_val_per_class > val_outcomes_count[1]):
-                        val_data[patient_id] = records
-                        val_outcomes_count[1] += 1
-                    elif not prototype:
-                        outcomes_count[1] += 1
-                        poor_patients.append(patient_id)
-                        patients_data[patient_id] = records
-                total_patient_count += 1
-
-        except FileNotFoundError:
+        outcome = catalog.outcome(patient_id)
+        if outcome is None:
             continue
+        if outcome == 'Good':
+            if(prototype and per_class > len(good_patients)):
+                outcomes_count[0] += 1
+                good_patients.append(patient_id)
+                patients_data[patient_id] = records
+            elif(prototype and max_val_per_class > val_outcomes_count[0]):
+                val_data[patient_id] = records
+                val_outcomes_count[0] += 1
+            elif not prototype:
+                outcomes_count[0] += 1
+                good_patients.append(patient_id)
+                patients_data[patient_id] = records
+                
+        else:
+            if(prototype and per_class > len(poor_patients)):
+                outcomes_count[1] += 1
+                poor_patients.append(patient_id)
+                patients_data[patient_id] = records
+            elif(prototype and max_val_per_class > val_outcomes_count[1]):
+                val_data[patient_id] = records
+                val_outcomes_count[1] += 1
+            elif not prototype:
+                outcomes_count[1] += 1
+                poor_patients.append(patient_id)
+                patients_data[patient_id] = records
+        total_patient_count += 1
         
     
     print(f'Total Patients: {len(patients_data.keys())}')
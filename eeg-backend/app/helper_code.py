@@ -4,60 +4,40 @@
 # These are helper functions that you can use with your code.
 # Check the example code to see how to import these functions to your code.
 
-import os, numpy as np, scipy as sp, scipy.io
+import os, functools, numpy as np, scipy as sp, scipy.io
+from catalog import open_catalog
 
 ### Challenge data I/O functions
 
-# Find the folders with data files.
+# Find the folders with data files. Served from the dataset catalog, brought up to date with a shallow refresh (one stat
+# per patient folder) so added and removed patients show up immediately.
 def find_data_folders(root_folder):
-    data_folders = list()
-    for x in sorted(os.listdir(root_folder)):
-        data_folder = os.path.join(root_folder, x)
-        if os.path.isdir(data_folder):
-            data_file = os.path.join(data_folder, x + '.txt')
-            if os.path.isfile(data_file):
-                data_folders.append(x)
-    return sorted(data_folders)
+    return open_catalog(root_folder, max_age=0).patient_ids()
 
 # Load the patient metadata: age, sex, etc.
 def load_challenge_data(data_folder, patient_id):
-    patient_metadata_file = os.path.join(data_folder, patient_id, patient_id + '.txt')
-    patient_metadata = load_text_file(patient_metadata_file)
+    patient_metadata = open_catalog(data_folder).metadata(patient_id)
+    if patient_metadata is None:
+        patient_metadata_file = os.path.join(data_folder, patient_id, patient_id + '.txt')
+        patient_metadata = load_text_file(patient_metadata_file)
     return patient_metadata
 
 # Find the record names.
 def find_recording_files(data_folder, patient_id):
-    record_names = set()
-    patient_folder = os.path.join(data_folder, patient_id)
-    for file_name in sorted(os.listdir(patient_folder)):
-        if not file_name.startswith('.') and file_name.endswith('.hea'):
-            root, ext = os.path.splitext(file_name)
-            if( root.split('_')[-1] == 'EEG' ):
-                record_names.add(root)
-    return sorted(record_names)
-
-# Load the WFDB data for the Challenge (but not all possible WFDB files).
-def load_recording_data(record_name, check_values=False):
-    # Allow either the record name or the header filename.
-    root, ext = os.path.splitext(record_name)
-    if ext=='':
-        header_file = record_name + '.hea'
-    else:
-        header_file = record_name
-
-    # Load the header file.
-    if not os.path.isfile(header_file):
-        raise FileNotFoundError('{} recording not found.'.format(record_name))
-
+    catalog = open_catalog(data_folder)
+    if patient_id not in catalog.patients:
+        raise FileNotFoundError('{} patient folder not found.'.format(os.path.join(data_folder, patient_id)))
+    return catalog.recording_names(patient_id, suffix='EEG')
+
+# Parse a WFDB header into the fields load_recording_data needs, with the per-channel values as arrays. Parsed headers
+# are cached by path, modification time and size.
+@functools.lru_cache(maxsize=1024)
+def _parse_header(header_file, mtime_ns, size):
     with open(header_file, 'r') as f:
         header = [l.strip() for l in f.readlines() if l.strip()]
 
-    # Parse the header file.
-    record_name = None
-    num_signals = None
-    sampling_frequency = None
-    num_samples = None
     signal_files = list()
+    formats = list()
     gains = list()
     baselines = list()
     adc_zeros = list()
@@ -65,71 +45,157 @@ def load_recording_data(record_name, check_values=False):
     initial_values = list()
     checksums = list()
 
-    for i, l in enumerate(header):
+    arrs = header[0].split(' ')
+    record_name = arrs[0]
+    num_signals = int(arrs[1])
+    sampling_frequency = float(arrs[2])
+    num_samples = int(arrs[3])
+
+    for l in header[1:]:
+        if l.startswith('#'):
+            continue
         arrs = [arr.strip() for arr in l.split(' ')]
-        # Parse the record line.
-        if i==0:
-            record_name = arrs[0]
-            num_signals = int(arrs[1])
-            sampling_frequency = float(arrs[2])
-            num_samples = int(arrs[3])
-        # Parse the signal specification lines.
-        elif not l.startswith('#') or len(l.strip()) == 0:
-            signal_file = arrs[0]
-            if '(' in arrs[2] and ')' in arrs[2]:
-                gain = float(arrs[2].split('/')[0].split('(')[0])
-                baseline = float(arrs[2].split('/')[0].split('(')[1].split(')')[0])
-            else:                
-                gain = float(arrs[2].split('/')[0])
-                baseline = 0.0
-            adc_zero = int(arrs[4])
-            initial_value = int(arrs[5])
-            checksum = int(arrs[6])
-            channel = arrs[8]
-            signal_files.append(signal_file)
-            gains.append(gain)
-            baselines.append(baseline)
-            adc_zeros.append(adc_zero)
-            initial_values.append(initial_value)
-            checksums.append(checksum)
-            channels.append(channel)
+        gain_field = arrs[2].split('/')[0]
+        if '(' in gain_field and ')' in arrs[2]:
+            gain, baseline = gain_field.split('(')
+            gains.append(float(gain))
+            baselines.append(float(baseline.split(')')[0]))
+        else:
+            gains.append(float(gain_field))
+            baselines.append(0.0)
+        signal_files.append(arrs[0])
+        formats.append(arrs[1])
+        adc_zeros.append(int(arrs[4]))
+        initial_values.append(int(arrs[5]))
+        checksums.append(int(arrs[6]))
+        channels.append(arrs[8])
+
+    return {
+        'record_name': record_name,
+        'num_signals': num_signals,
+        'sampling_frequency': sampling_frequency,
+        'num_samples': num_samples,
+        'signal_files': tuple(signal_files),
+        'formats': tuple(formats),
+        'gains': np.asarray(gains, dtype=np.float64),
+        'offsets': np.asarray(baselines, dtype=np.float64) + np.asarray(adc_zeros, dtype=np.float64),
+        'initial_values': np.asarray(initial_values, dtype=np.int64),
+        'checksums': np.asarray(checksums, dtype=np.int64),
+        'channels': tuple(channels),
+    }
+
+# Read the int16 samples of a MATLAB v4 signal file as a (num_samples, num_channels) array without scipy.io.loadmat, or
+# return None if the file is not the little-endian int16 'val' matrix the header describes.
+def _read_int16_mat(signal_file, signal_format, num_channels, num_samples):
+    if signal_format != '16+24' or not signal_file.endswith('.mat'):
+        return None
+    with open(signal_file, 'rb') as f:
+        mat_header = np.fromfile(f, dtype='<i4', count=5)
+        if len(mat_header) != 5 or f.read(4) != b'val\x00':
+            return None
+        if tuple(mat_header) != (30, num_channels, num_samples, 0, 4):
+            return None
+        data = np.fromfile(f, dtype='<i2', count=num_channels * num_samples)
+    if data.size != num_channels * num_samples:
+        return None
+    return data.reshape(num_samples, num_channels)
+
+# Map a channel layout onto a requested montage: the positions in current_channels of the requested channels that are
+# present (in requested order, as reduce_channels selects them), and for expand_channels the rows of the requested
+# montage that those channels fill. Cached per pair of layouts, which repeat across the recordings of a dataset.
+@functools.lru_cache(maxsize=256)
+def _channel_map(current_channels, requested_channels):
+    positions = dict()
+    for i, channel in enumerate(current_channels):
+        positions.setdefault(channel, i)
+    targets = [i for i, channel in enumerate(requested_channels) if channel in positions]
+    sources = [positions[requested_channels[i]] for i in targets]
+    return np.asarray(sources, dtype=np.intp), np.asarray(targets, dtype=np.intp)
+
+# Load the WFDB data for the Challenge (but not all possible WFDB files). With channels, only the requested channels
+# that the recording has are checked and rescaled, and returned in requested order, as reduce_channels would.
+def load_recording_data(record_name, check_values=False, channels=None):
+    # Allow either the record name or the header filename.
+    root, ext = os.path.splitext(record_name)
+    if ext=='':
+        header_file = record_name + '.hea'
+    else:
+        header_file = record_name
+
+    # Load the header file.
+    if not os.path.isfile(header_file):
+        raise FileNotFoundError('{} recording not found.'.format(record_name))
+
+    stat = os.stat(header_file)
+    header = _parse_header(os.path.abspath(header_file), stat.st_mtime_ns, stat.st_size)
+    num_channels = len(header['channels'])
+    num_samples = header['num_samples']
+    if channels is None or tuple(channels) == header['channels']:
+        selected = None
+        channels = list(header['channels'])
+    else:
+        selected, _ = _channel_map(header['channels'], tuple(channels))
+        channels = [header['channels'][i] for i in selected]
 
     # Check that the header file only references one signal file. WFDB format allows for multiple signal files, but, for
     # simplicity, we have not done that here.
-    num_signal_files = len(set(signal_files))
+    num_signal_files = len(set(header['signal_files']))
     if num_signal_files!=1:
         raise NotImplementedError('The header file {}'.format(header_file) \
             + ' references {} signal files; one signal file expected.'.format(num_signal_files))
 
-    # Load the signal file.
+    # Load the signal file as (num_samples, num_channels): the int16 samples are read directly when the file is the
+    # Challenge's MATLAB v4 layout, and through scipy otherwise.
     head, tail = os.path.split(header_file)
-    signal_file = os.path.join(head, list(signal_files)[0])
-    data = np.asarray(sp.io.loadmat(signal_file)['val'])
-
-    # Check that the dimensions of the signal data in the signal file is consistent with the dimensions for the signal data given
-    # in the header file.
-    num_channels = len(channels)
-    if np.shape(data)!=(num_channels, num_samples):
-        raise ValueError('The header file {}'.format(header_file) \
-            + ' is inconsistent with the dimensions of the signal file.')
+    signal_file = os.path.join(head, header['signal_files'][0])
+    data = None
+    if len(set(header['formats'])) == 1:
+        data = _read_int16_mat(signal_file, header['formats'][0], num_channels, num_samples)
+    if data is None:
+        data = np.asarray(sp.io.loadmat(signal_file)['val'])
+
+        # Check that the dimensions of the signal data in the signal file is consistent with the dimensions for the
+        # signal data given in the header file.
+        if np.shape(data)!=(num_channels, num_samples):
+            raise ValueError('The header file {}'.format(header_file) \
+                + ' is inconsistent with the dimensions of the signal file.')
+        data = data.T
 
     # Check that the initial value and checksums in the signal file are consistent with the initial value and checksums in the
     # header file.
-    if check_values:
-        for i in range(num_channels):
-            if data[i, 0]!=initial_values[i]:
+    initial_values = header['initial_values']
+    checksums = header['checksums']
+    offsets = header['offsets']
+    gains = header['gains']
+    if selected is not None:
+        initial_values, checksums, offsets, gains = \
+            initial_values[selected], checksums[selected], offsets[selected], gains[selected]
+    if check_values and num_samples > 0:
+        checked = data if selected is None else data[:, selected]
+        initial_mismatch = checked[0, :] != initial_values
+        checksum_mismatch = np.sum(checked, axis=0, dtype=np.int16) != checksums
+        for i in np.flatnonzero(initial_mismatch | checksum_mismatch)[:1]:
+            if initial_mismatch[i]:
                 raise ValueError('The initial value in header file {}'.format(header_file) \
                     + ' is inconsistent with the initial value for channel {} in the signal data'.format(channels[i]))
-            if np.sum(data[i, :], dtype=np.int16)!=checksums[i]:
-                raise ValueError('The checksum in header file {}'.format(header_file) \
-                    + ' is inconsistent with the checksum value for channel {} in the signal data'.format(channels[i]))
-
-    # Rescale the signal data using the gains and offsets.
-    rescaled_data = np.zeros(np.shape(data), dtype=np.float32)
-    for i in range(num_channels):
-        rescaled_data[i, :] = (np.asarray(data[i, :], dtype=np.float64) - baselines[i] - adc_zeros[i]) / gains[i]
-
-    return rescaled_data, channels, sampling_frequency
+            raise ValueError('The checksum in header file {}'.format(header_file) \
+                + ' is inconsistent with the checksum value for channel {} in the signal data'.format(channels[i]))
+
+    # Rescale the signal data using the gains and offsets. The arithmetic stays in float64, as before, but runs over
+    # cache-sized blocks of samples with one reused intermediate, broadcasting the selected channels' offsets and gains
+    # over each block; unselected channels are never rescaled.
+    rescaled_data = np.empty((len(channels), num_samples), dtype=np.float32)
+    offsets, gains = offsets[:, None], gains[:, None]
+    block = np.empty((len(channels), max(1, min(num_samples, (1 << 16) // max(1, len(channels))))), dtype=np.float64)
+    for start in range(0, num_samples, block.shape[1]):
+        stop = min(start + block.shape[1], num_samples)
+        samples = data[start:stop] if selected is None else data[start:stop][:, selected]
+        current = block[:, :stop - start]
+        np.subtract(samples.T, offsets, out=current)
+        # Divided in float64 and rounded to float32 on the way out, like the reference's assignment
+        np.divide(current, gains, out=rescaled_data[:, start:stop])
+
+    return rescaled_data, channels, header['sampling_frequency']
 
 # Choose the channels.
 def reduce_channels(current_data, current_channels, requested_channels):
@@ -137,7 +203,7 @@ def reduce_channels(current_data, current_channels, requested_channels):
         reduced_data = current_data
         reduced_channels = current_channels
     else:
-        reduced_indices = [current_channels.index(channel) for channel in requested_channels if channel in current_channels]
+        reduced_indices, _ = _channel_map(tuple(current_channels), tuple(requested_channels))
         reduced_channels = [current_channels[i] for i in reduced_indices]
         reduced_data = current_data[reduced_indices, :]
     return reduced_data, reduced_channels
@@ -149,13 +215,11 @@ def expand_channels(current_data, current_channels, requested_channels):
     else:
         num_current_channels, num_samples = np.shape(current_data)
         num_requested_channels = len(requested_channels)
-        expanded_data = np.zeros((num_requested_channels, num_samples))
-        for i, channel in enumerate(requested_channels):
-            if channel in current_channels:
-                j = current_channels.index(channel)
-                expanded_data[i, :] = current_data[j, :]
-            else:
-                expanded_data[i, :] = float('nan')
+        sources, targets = _channel_map(tuple(current_channels), tuple(requested_channels))
+        expanded_data = np.empty((num_requested_channels, num_samples))
+        expanded_data[np.setdiff1d(np.arange(num_requested_channels), targets), :] = float('nan')
+        for i, j in zip(targets, sources):
+            expanded_data[i, :] = current_data[j, :]
     return expanded_data
 
 ### Helper Challenge data I/O functions
@@ -1,9 +1,16 @@
 import torch
 import numpy as np
 import os
+import threading
+from collections import OrderedDict
+from torch.utils.data import DataLoader
 from resnet_trans import CombinedModel
-from eeg_dataset_win_lazy import create_test_loader
+from eeg_dataset_win_lazy import EEGDatasetWinLazy
 import get_patients
+from catalog import open_catalog
+from config import INFER_WORKERS, INFER_MAX_PIPELINES
+from metrics import CACHE_HITS, CACHE_MISSES, time_stage
+from precision import inference_context
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -35,18 +42,96 @@ def load_model(model_path):
     model.eval()
     return model
 
+class InferencePipeline:
+    """Long-lived /infer input pipeline for one directory.
+
+    The patient selection and dataset index are rebuilt only when a file in a patient folder changed since the last
+    call, and the DataLoader keeps its worker processes between calls. Workers hold a copy of the dataset, so they are
+    restarted only when the index changes.
+    """
+    def __init__(self, root_dir, batch_size=32, num_workers=INFER_WORKERS):
+        self.root_dir = root_dir
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.signature = None
+        self.loader = None
+        self.lock = threading.Lock()
+
+    def _signature(self):
+        """(patient, file, size, mtime) of every file in the patient folders: metadata, RECORDS, headers and signals.
+
+        The files are stat-ed here rather than taken from the catalog, whose shallow refresh only notices files added
+        or removed: a metadata file or recording rewritten in place must rebuild the pipeline too.
+        """
+        entries = []
+        with os.scandir(self.root_dir) as patients:
+            for patient in patients:
+                if not patient.is_dir() or patient.name.startswith('.'):
+                    continue
+                with os.scandir(patient.path) as files:
+                    for entry in files:
+                        if entry.is_file() and not entry.name.startswith('.'):
+                            stat = entry.stat()
+                            entries.append((patient.name, entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(entries))
+
+    def refresh(self):
+        """Rebuilds the index and loader if the directory changed; returns the loader."""
+        signature = self._signature()
+        if self.loader is not None and signature == self.signature:
+            CACHE_HITS.inc(cache='infer_pipeline')
+            return self.loader
+        CACHE_MISSES.inc(cache='infer_pipeline')
+        self.close()
+        # Rebuilt from a deep refresh, so the index sees the in-place edits that changed the signature
+        open_catalog(self.root_dir).refresh(deep=True)
+        patients_data, _ = get_patients.get_patients(root_path=self.root_dir, prototype=True, per_class=50)
+        dataset = EEGDatasetWinLazy(patients_data, self.root_dir, window_size=20, records_per_patient=1, predict='outcome')
+        self.loader = DataLoader(dataset, batch_size=self.batch_size, drop_last=False, shuffle=False,
+                                 num_workers=self.num_workers, pin_memory=torch.cuda.is_available(),
+                                 persistent_workers=self.num_workers > 0)
+        self.signature = signature
+        return self.loader
+
+    def close(self):
+        # Dropping the loader lets its persistent iterator shut the worker processes down.
+        self.loader = None
+        self.signature = None
+
+
+_pipelines = OrderedDict()
+_pipelines_lock = threading.Lock()
+
+
+def get_pipeline(root_dir):
+    """Returns the warm pipeline for root_dir, evicting the least recently used one beyond INFER_MAX_PIPELINES."""
+    key = os.path.realpath(root_dir)
+    with _pipelines_lock:
+        pipeline = _pipelines.pop(key, None)
+        if pipeline is None:
+            pipeline = InferencePipeline(root_dir)
+        _pipelines[key] = pipeline
+        while len(_pipelines) > max(INFER_MAX_PIPELINES, 1):
+            _, evicted = _pipelines.popitem(last=False)
+            with evicted.lock:
+                evicted.close()
+    return pipeline
+
+
 def run_inference(model, root_dir):
     if not root_dir or not os.path.exists(root_dir):
         raise ValueError("Invalid directory path")
 
-    patients_data, _ = get_patients.get_patients(root_path=root_dir, prototype=True, per_class=50)
-    test_loader = create_test_loader(patients_data, root_dir, batch_size=32, records_per_patient=1, predict='outcome')
-
+    pipeline = get_pipeline(root_dir)
     test_preds = []
-    with torch.no_grad():
+    # One call at a time per directory: a persistent DataLoader iterator cannot be shared.
+    with pipeline.lock, torch.no_grad():
+        with time_stage('infer_index'):
+            test_loader = pipeline.refresh()
         for inputs, _ in test_loader:
             inputs = inputs.to(device)
-            outputs = model(inputs)
-            test_preds.append(outputs.cpu().numpy())
+            with inference_context(device.type):
+                outputs = model(inputs)
+            test_preds.append(outputs.float().cpu().numpy())
 
     return np.concatenate(test_preds).tolist()
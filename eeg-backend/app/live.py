@@ -0,0 +1,240 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+import numpy as np
+import torch
+from streaming import StreamingPreprocessor
+from precision import inference_context
+from config import LIVE_MAX_SESSIONS, LIVE_SESSION_TIMEOUT, LIVE_MAX_BATCH, LIVE_ROLLING_WINDOWS, LIVE_HISTORY
+from metrics import REGISTRY, time_stage, FAILURES
+
+# Live EEG sessions: samples arrive in chunks, are preprocessed incrementally and every completed 20 s window is
+# scored by the DL model. Windows from all sessions go through one scorer thread that batches whatever is queued into
+# a single forward pass, so dozens of sessions share the model without one forward call per window.
+
+WINDOW_SECONDS = 20
+TARGET_FS = 100
+TARGET_CHANNELS = 19
+
+LIVE_SESSIONS = REGISTRY.gauge('brainwave_live_sessions', 'Open live EEG sessions.')
+LIVE_WINDOWS = REGISTRY.counter('brainwave_live_windows_total', 'Live EEG windows scored.')
+
+
+class LiveSession:
+    """State of one patient's live stream. Memory is bounded: preprocessor state, one window and LIVE_HISTORY events."""
+
+    def __init__(self, sampling_rate, num_channels, patient_id=None):
+        self.session_id = uuid.uuid4().hex
+        self.patient_id = patient_id
+        self.sampling_rate = sampling_rate
+        self.num_channels = num_channels
+        self.preprocessor = StreamingPreprocessor(sampling_rate, num_channels, TARGET_FS, TARGET_CHANNELS)
+        self.window = np.empty((WINDOW_SECONDS * TARGET_FS, TARGET_CHANNELS), dtype=np.float32)
+        self.filled = 0
+        self.samples_received = 0
+        self.windows_submitted = 0
+        self.windows_scored = 0
+        self.events = deque(maxlen=LIVE_HISTORY)
+        self.probabilities = deque(maxlen=LIVE_ROLLING_WINDOWS)
+        self.closed = False
+        self.last_activity = time.monotonic()
+        self.condition = threading.Condition()
+        self._feed_lock = threading.Lock()
+
+    def feed(self, samples, scorer):
+        """Preprocesses (n_samples, num_channels) samples and submits every window they complete; returns that count."""
+        with self._feed_lock:
+            self.last_activity = time.monotonic()
+            self.samples_received += len(samples)
+            with time_stage('live_preprocess'):
+                processed = self.preprocessor.process(samples)
+            return self._collect(processed, scorer)
+
+    def finish(self, scorer):
+        """Flushes the preprocessor at the end of the stream; a trailing partial window is not scored."""
+        with self._feed_lock:
+            submitted = self._collect(self.preprocessor.flush(), scorer)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        return submitted
+
+    def _collect(self, processed, scorer):
+        submitted = 0
+        while len(processed):
+            take = min(len(processed), len(self.window) - self.filled)
+            self.window[self.filled:self.filled + take] = processed[:take]
+            self.filled += take
+            processed = processed[take:]
+            if self.filled == len(self.window):
+                scorer.submit(self, self.windows_submitted, self.window.T.copy())
+                self.windows_submitted += 1
+                self.filled = 0
+                submitted += 1
+        return submitted
+
+    def add_result(self, index, probability, error=None):
+        with self.condition:
+            if probability is not None:
+                self.probabilities.append(probability)
+            self.windows_scored += 1
+            event = {
+                'sequence': self.windows_scored,
+                'window': index,
+                'start_seconds': index * WINDOW_SECONDS,
+                'probability': probability,
+                'rolling_probability': float(np.mean(self.probabilities)) if self.probabilities else None,
+            }
+            if error is not None:
+                event['error'] = error
+            self.events.append(event)
+            self.condition.notify_all()
+
+    @property
+    def done(self):
+        """Closed and every submitted window scored."""
+        return self.closed and self.windows_scored >= self.windows_submitted
+
+    def events_after(self, sequence, timeout):
+        """Events with a sequence number above `sequence`, waiting up to timeout seconds for one to arrive."""
+        with self.condition:
+            if not self.done and (not self.events or self.events[-1]['sequence'] <= sequence):
+                self.condition.wait(timeout)
+            return [event for event in self.events if event['sequence'] > sequence]
+
+    def status(self):
+        with self.condition:
+            return {
+                'session_id': self.session_id,
+                'patient_id': self.patient_id,
+                'sampling_rate': self.sampling_rate,
+                'num_channels': self.num_channels,
+                'samples_received': self.samples_received,
+                'seconds_received': self.samples_received / self.sampling_rate,
+                'windows_submitted': self.windows_submitted,
+                'windows_scored': self.windows_scored,
+                'rolling_probability': float(np.mean(self.probabilities)) if self.probabilities else None,
+                'recent': list(self.events)[-LIVE_ROLLING_WINDOWS:],
+                'closed': self.closed,
+            }
+
+
+class LiveScorer(threading.Thread):
+    """Scores queued windows in batches of up to max_batch with the model returned by get_model()."""
+
+    def __init__(self, get_model, max_batch=LIVE_MAX_BATCH):
+        super().__init__(daemon=True)
+        self.get_model = get_model
+        self.max_batch = max_batch
+        # Bounded so that sessions feeding faster than the model scores block in submit() instead of queueing memory.
+        self.queue = queue.Queue(maxsize=4 * max_batch)
+
+    def submit(self, session, index, window):
+        self.queue.put((session, index, window))
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.score(batch)
+
+    def score(self, batch):
+        model = self.get_model()
+        if model is None:
+            for session, index, _ in batch:
+                session.add_result(index, None, error='DL model not loaded')
+            return
+        try:
+            model.eval()
+            with torch.no_grad(), time_stage('live_forward'), inference_context():
+                output = model(torch.from_numpy(np.stack([window for _, _, window in batch])))
+            probabilities = torch.sigmoid(output.float()).reshape(len(batch), -1)[:, 0].numpy()
+        except Exception as e:
+            print(f"Error in live DL prediction: {e}")
+            FAILURES.inc(stage='live_forward')
+            for session, index, _ in batch:
+                session.add_result(index, None, error=str(e))
+            return
+        LIVE_WINDOWS.inc(len(batch))
+        for (session, index, _), probability in zip(batch, probabilities):
+            session.add_result(index, float(probability))
+
+
+class LiveSessions:
+    """Open sessions by id; sessions idle for longer than timeout seconds are closed and dropped."""
+
+    def __init__(self, get_model, max_sessions=LIVE_MAX_SESSIONS, timeout=LIVE_SESSION_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        self.sessions = {}
+        self.scorer = LiveScorer(get_model)
+        self._lock = threading.Lock()
+
+    def create(self, sampling_rate, num_channels, patient_id=None):
+        self.reap()
+        session = LiveSession(sampling_rate, num_channels, patient_id)
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise RuntimeError(f"Too many live sessions (limit {self.max_sessions})")
+            if not self.scorer.is_alive():
+                self.scorer.start()
+            self.sessions[session.session_id] = session
+            LIVE_SESSIONS.set(len(self.sessions))
+        return session
+
+    def get(self, session_id):
+        """The open session, or None; idle sessions are reaped first, so they expire even when nothing is created."""
+        self.reap()
+        return self.sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            LIVE_SESSIONS.set(len(self.sessions))
+        if session is not None:
+            session.finish(self.scorer)
+        return session
+
+    def reap(self):
+        """Closes sessions idle for longer than the timeout."""
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_activity > self.timeout:
+                print(f"Closing idle live session {session_id}")
+                self.close(session_id)
+
+
+def parse_samples(data, content_type, num_channels):
+    """Decodes a chunk body: raw little-endian float32 frames, or JSON {"samples": [[...], ...]}."""
+    if content_type.startswith('application/json'):
+        samples = np.asarray(json.loads(data)['samples'], dtype=np.float64)
+    else:
+        if len(data) % (4 * num_channels):
+            raise ValueError(f"Chunk of {len(data)} bytes is not a whole number of {num_channels}-channel float32 frames")
+        samples = np.frombuffer(data, dtype='<f4').astype(np.float64)
+    samples = samples.reshape(-1, num_channels) if samples.ndim == 1 else samples
+    if samples.ndim != 2 or samples.shape[1] != num_channels:
+        raise ValueError(f"Expected samples with {num_channels} channels, got shape {samples.shape}")
+    return samples
+
+
+def event_stream(session, after=0, keepalive=15.0):
+    """Server-sent events for a session's scored windows until it is closed."""
+    sequence = after
+    while True:
+        events = session.events_after(sequence, keepalive)
+        if not events:
+            if session.done:
+                return
+            yield ': keepalive\n\n'
+            continue
+        for event in events:
+            sequence = event['sequence']
+            yield f"id: {sequence}\ndata: {json.dumps(event)}\n\n"
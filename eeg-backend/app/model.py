@@ -227,13 +227,18 @@ class EEGTransformer(nn.Module):
         self.sigmoid = nn.Sigmoid()
 
     def forward(self, X):
-        # Input standardization
-        mean = X.mean(dim=2, keepdim=True)
-        std = X.std(dim=2, keepdim=True)
-        X_hat = (X - mean) / (std + 1e-5)
-        
-        # Add positional encoding
-        X_tilde = X_hat + self.positional_encoding.to(X.device)
+        # Standardization, positional encoding and the layer norms stay in float32 under reduced-precision autocast:
+        # the encoding reaches 1e4-scale timestep arguments and the variance terms lose too much in bfloat16.
+        with torch.autocast(device_type=X.device.type, enabled=False):
+            X = X.float()
+
+            # Input standardization
+            mean = X.mean(dim=2, keepdim=True)
+            std = X.std(dim=2, keepdim=True)
+            X_hat = (X - mean) / (std + 1e-5)
+
+            # Add positional encoding
+            X_tilde = X_hat + self.positional_encoding.to(X.device)
         
         # Permute for multihead attention: (seq_len, batch_size, embed_dim)
         X_tilde = X_tilde.permute(2, 0, 1)
@@ -242,11 +247,13 @@ class EEGTransformer(nn.Module):
         attn_output, _ = self.multihead_attn(X_tilde, X_tilde, X_tilde)
         
         # Apply layer norm
-        attn_output = self.norm1(attn_output)
+        with torch.autocast(device_type=X.device.type, enabled=False):
+            attn_output = self.norm1(attn_output.float())
         
         # FFN
         ff_output = self.ffn(attn_output)
-        ff_output = self.norm2(ff_output + attn_output)  # Residual connection
+        with torch.autocast(device_type=X.device.type, enabled=False):
+            ff_output = self.norm2(ff_output.float() + attn_output)  # Residual connection
         
         # Reshape back: (batch_size, num_channels, num_timepoints)
         ff_output = ff_output.permute(1, 2, 0)
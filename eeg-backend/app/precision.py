@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Reduced-precision inference for CombinedModel. The precision is chosen per deployment with
+# BRAINWAVE_INFERENCE_PRECISION (see config.py). Run this file to measure the probability drift of bf16 against fp32:
+#
+#   python precision.py model/dl_model.pth [data_folder] [--samples N]
+#
+# Without a data folder, random windows are used; with one, the first 20 s window of every recording is scored.
+
+import argparse
+import contextlib
+import json
+import os
+import numpy as np
+import torch
+from config import INFERENCE_PRECISION
+
+PRECISIONS = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+}
+
+
+def inference_context(device_type='cpu', precision=None):
+    """Autocast context for the configured precision; a no-op for fp32."""
+    if precision is None:
+        precision = INFERENCE_PRECISION
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported inference precision '{precision}'. Must be one of {list(PRECISIONS)}.")
+    if PRECISIONS[precision] is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device_type, dtype=PRECISIONS[precision])
+
+
+def predict_probabilities(model, inputs, precision, batch_size=32):
+    """Sigmoid outputs of the model for inputs of shape (N, 19, T), computed at the given precision."""
+    model.eval()
+    probs = []
+    with torch.no_grad():
+        for i in range(0, inputs.shape[0], batch_size):
+            batch = inputs[i:i + batch_size]
+            with inference_context(batch.device.type, precision):
+                output = model(batch)
+            probs.append(torch.sigmoid(output.float()).reshape(-1).cpu().numpy())
+    return np.concatenate(probs)
+
+
+def compare_precision(model, inputs, precision='bf16', threshold=0.5):
+    """Reports how far probabilities computed at `precision` drift from the fp32 reference."""
+    reference = predict_probabilities(model, inputs, 'fp32')
+    reduced = predict_probabilities(model, inputs, precision)
+    drift = np.abs(reduced - reference)
+    return {
+        'precision': precision,
+        'num_windows': int(len(reference)),
+        'max_abs_drift': float(drift.max()),
+        'mean_abs_drift': float(drift.mean()),
+        'p99_abs_drift': float(np.percentile(drift, 99)),
+        'decision_flips': int(np.sum((reference >= threshold) != (reduced >= threshold))),
+    }
+
+
+def load_validation_windows(data_folder):
+    """First 20 s window of every recording in a Challenge-style data folder, shaped (N, 19, 2000)."""
+    from helper_code import find_data_folders, find_recording_files
+    from preprocess import preprocess_for_inference
+
+    windows = []
+    for patient_id in find_data_folders(data_folder):
+        for recording_id in find_recording_files(data_folder, patient_id):
+            record_path = os.path.join(data_folder, patient_id, recording_id)
+            try:
+                _, window_short = preprocess_for_inference(record_path, 100, window_size=180)
+                windows.append(window_short.T)
+            except Exception as e:
+                print(f"Skipping {record_path}: {e}")
+    return torch.tensor(np.stack(windows), dtype=torch.float32)
+
+
+if __name__ == '__main__':
+    from model import CombinedModel, resnet_config, transformer_config
+
+    parser = argparse.ArgumentParser(description='Report bf16 vs fp32 probability drift for CombinedModel.')
+    parser.add_argument('model_path')
+    parser.add_argument('data_folder', nargs='?')
+    parser.add_argument('--samples', type=int, default=64, help='number of random windows when no data folder is given')
+    parser.add_argument('--precision', default='bf16', choices=[p for p in PRECISIONS if p != 'fp32'])
+    args = parser.parse_args()
+
+    model = CombinedModel(resnet_config, transformer_config)
+    model.load_state_dict(torch.load(args.model_path, map_location=torch.device('cpu')))
+
+    if args.data_folder:
+        inputs = load_validation_windows(args.data_folder)
+    else:
+        inputs = torch.rand(args.samples, 19, 2000) * 2 - 1
+
+    print(json.dumps(compare_precision(model, inputs, args.precision), indent=2))
@@ -1,26 +1,82 @@
-import os
 import numpy as np
 import wfdb
 from scipy import signal
-import h5py
+from metrics import time_stage
+from raw_reader import read_header, read_samples
+from config import PREPROCESS_DTYPE
 
-def read_eeg_for_inference(record_path):
-    """Loads EEG signal and returns it with sampling rate."""
+# Peak memory of preprocess_for_inference for a 19-channel 500 Hz recording, measured with tracemalloc
+# (tests/test_preprocess_memory.py). The float32 path reads only the first 40 minutes straight into float32, resamples
+# one channel at a time into the 100 Hz output buffer and does every later step in place on that buffer:
+#
+#   recording   float64 path   float32 path
+#   40 min          ~420 MB        ~150 MB
+#   2 h             ~770 MB        ~150 MB   (the float64 path decodes the whole record before truncating it)
+#
+# The float32 peak is the 40-minute float32 input (samples x channels x 4 bytes), the int16 samples it is decoded
+# from, the output buffer and one channel's FFT temporaries; it does not grow with the recording length.
+
+def read_eeg_for_inference(record_path, dtype=None, max_duration=None, pool=None, max_channels=None):
+    """Loads EEG signal and returns it with sampling rate.
+
+    With a dtype, samples are decoded straight into that dtype and only the first max_duration seconds are read, into
+    a buffer borrowed from pool if one is given. With max_channels, channels beyond the first max_channels (which
+    standardize drops) are not decoded.
+    """
     if not is_valid_recording(record_path + ".hea", min_duration=610):
         raise ValueError(f"Recording {record_path} does not meet the minimum duration requirement.")
-    record = wfdb.rdrecord(record_path)
-    return record.p_signal, record.fs
+    with time_stage("record_decode"):
+        if dtype is None and max_channels is None:
+            record = wfdb.rdrecord(record_path)
+            return record.p_signal, record.fs
+        header = read_header(record_path + ".hea")
+        channels = None
+        if max_channels is not None and header["num_signals"] > max_channels:
+            channels = list(range(max_channels))
+        if dtype is None:
+            record = wfdb.rdrecord(record_path, channels=channels)
+            return record.p_signal, record.fs
+        num_samples = header["num_samples"]
+        if max_duration is not None:
+            num_samples = min(num_samples, int(max_duration * header["fs"]))
+        return read_samples(record_path, 0, num_samples, channels, dtype=dtype, header=header, pool=pool), header["fs"]
 
 def preprocess_eeg_signal(eeg_signal, sampling_rate, target_fs=100):
     """Applies preprocessing steps to the EEG signal."""
     eeg_signal = limit_recording_duration(eeg_signal, sampling_rate, max_duration=40*60)
-    eeg_signal = signal.resample(eeg_signal, int(eeg_signal.shape[0] * (target_fs / sampling_rate)), axis=0)
+    with time_stage("resample"):
+        eeg_signal = signal.resample(eeg_signal, int(eeg_signal.shape[0] * (target_fs / sampling_rate)), axis=0)
     eeg_signal = remove_nan_values(eeg_signal, method="interpolate")
-    eeg_signal = apply_filtering(eeg_signal, target_fs)
+    with time_stage("filter"):
+        eeg_signal = apply_filtering(eeg_signal, target_fs)
     eeg_signal = normalize_eeg_voltages(eeg_signal)
     eeg_signal = standardize(eeg_signal, target_channels=19)
     return eeg_signal
 
+def preprocess_eeg_signal_float32(eeg_signal, sampling_rate, target_fs=100, target_channels=19, out=None):
+    """Same steps as preprocess_eeg_signal in float32, writing into one (samples, target_channels) output buffer.
+
+    Each channel is resampled straight into its column of `out`; NaN removal, filtering and normalization then run in
+    place on `out`, and missing channels stay zero, so no full-size intermediate is allocated.
+    """
+    eeg_signal = limit_recording_duration(eeg_signal, sampling_rate, max_duration=40*60)
+    num_samples = int(eeg_signal.shape[0] * (target_fs / sampling_rate))
+    num_channels = min(eeg_signal.shape[1], target_channels)
+    if out is None:
+        out = np.empty((num_samples, target_channels), dtype=np.float32)
+    elif out.shape != (num_samples, target_channels):
+        raise ValueError(f"Output buffer has shape {out.shape}, expected {(num_samples, target_channels)}.")
+    out[:, num_channels:] = 0.0
+    signals = out[:, :num_channels]
+    with time_stage("resample"):
+        for channel in range(num_channels):
+            signals[:, channel] = signal.resample(eeg_signal[:, channel], num_samples)
+    remove_nan_values(signals, method="interpolate", inplace=True)
+    with time_stage("filter"):
+        apply_filtering(signals, target_fs, inplace=True)
+    normalize_eeg_voltages(signals, inplace=True)
+    return out
+
 def is_valid_recording(header_path, min_duration=180):
     """Check if the recording meets the minimum duration requirement using the header file."""
     try:
@@ -38,7 +94,9 @@ def limit_recording_duration(eeg_signal, sampling_rate, max_duration=2400):
     max_samples = int(max_duration * sampling_rate)
     return eeg_signal[:max_samples, :] if eeg_signal.shape[0] > max_samples else eeg_signal
 
-def remove_nan_values(eeg_signal, method="zero"):
+def remove_nan_values(eeg_signal, method="zero", inplace=False):
+    if inplace:
+        return _remove_nan_values_inplace(eeg_signal, method)
     eeg_signal[np.isinf(eeg_signal)] = np.nan
     if method == "zero":
         return np.nan_to_num(eeg_signal, nan=0.0)
@@ -61,19 +119,47 @@ def remove_nan_values(eeg_signal, method="zero"):
     else:
         raise ValueError(f"Unsupported method: {method}")
 
-def apply_filtering(eeg_signal, fs, lowcut=0.5, highcut=40):
+def _remove_nan_values_inplace(eeg_signal, method):
+    """remove_nan_values working one channel at a time on eeg_signal itself."""
+    if method not in ("zero", "mean", "interpolate"):
+        raise ValueError(f"Unsupported method: {method}")
+    for channel in range(eeg_signal.shape[1]):
+        column = eeg_signal[:, channel]
+        nan_indices = ~np.isfinite(column)
+        if not nan_indices.any():
+            continue
+        if method == "zero" or np.all(nan_indices):
+            column[nan_indices] = 0.0
+        elif method == "mean":
+            column[nan_indices] = column[~nan_indices].mean()
+        else:
+            x = np.arange(column.shape[0])
+            column[nan_indices] = np.interp(x[nan_indices], x[~nan_indices], column[~nan_indices])
+    return eeg_signal
+
+def apply_filtering(eeg_signal, fs, lowcut=0.5, highcut=40, inplace=False):
     nyq = 0.5 * fs
     low = lowcut / nyq
     high = highcut / nyq
     b, a = signal.butter(5, [low, high], btype="band")
-    return signal.lfilter(b, a, eeg_signal, axis=0)
+    if not inplace:
+        return signal.lfilter(b, a, eeg_signal, axis=0)
+    for channel in range(eeg_signal.shape[1]):
+        eeg_signal[:, channel] = signal.lfilter(b, a, eeg_signal[:, channel])
+    return eeg_signal
 
-def normalize_eeg_voltages(eeg_signal, norm_range=(-1, 1)):
+def normalize_eeg_voltages(eeg_signal, norm_range=(-1, 1), inplace=False):
     min_val, max_val = norm_range
     signal_min = eeg_signal.min(axis=0, keepdims=True)
     signal_max = eeg_signal.max(axis=0, keepdims=True)
     denom = signal_max - signal_min
     denom[denom == 0] = 1
+    if inplace:
+        eeg_signal -= signal_min
+        eeg_signal /= denom
+        eeg_signal *= max_val - min_val
+        eeg_signal += min_val
+        return eeg_signal
     normalized_signal = (eeg_signal - signal_min) / denom
     return normalized_signal * (max_val - min_val) + min_val
 
@@ -81,8 +167,9 @@ def standardize(eeg_signal, target_channels=19):
     if eeg_signal.shape[1] > target_channels:
         return eeg_signal[:, :target_channels]
     elif eeg_signal.shape[1] < target_channels:
-        padding = np.zeros((eeg_signal.shape[0], target_channels - eeg_signal.shape[1]))
-        return np.hstack((eeg_signal, padding))
+        padded = np.zeros((eeg_signal.shape[0], target_channels), dtype=eeg_signal.dtype)
+        padded[:, :eeg_signal.shape[1]] = eeg_signal
+        return padded
     return eeg_signal
 
 def create_windows(eeg_signal, window_size, fs):
@@ -93,23 +180,66 @@ def create_windows(eeg_signal, window_size, fs):
     eeg_windows = eeg_signal.reshape(num_windows, num_time_samples, 19)
     return eeg_windows[0]
 
+def read_for_inference(record_path, dtype=None, pool=None):
+    """Reads and decodes the recording as preprocess_for_inference needs it, returning (raw_signal, sampling_rate).
+
+    Pass the result to preprocess_for_inference as raw= to read a recording ahead of processing it.
+    """
+    if dtype is None:
+        dtype = PREPROCESS_DTYPE
+    if dtype == "float32":
+        return read_eeg_for_inference(record_path, dtype=np.float32, max_duration=40*60, pool=pool, max_channels=19)
+    elif dtype == "float64":
+        return read_eeg_for_inference(record_path, max_channels=19)
+    raise ValueError(f"Unsupported preprocessing dtype '{dtype}'. Must be 'float32' or 'float64'.")
+
 # Example usage for inference
-def preprocess_for_inference(record_path, fs=100, window_size=180):
-    raw_signal, raw_fs = read_eeg_for_inference(record_path)
-    processed_signal = preprocess_eeg_signal(raw_signal, raw_fs, fs)
-    window_long = create_windows(processed_signal, window_size, fs)
-    window_short = create_windows(processed_signal, 20, fs)
-
-    # Save to disk as h5
-    cache_path = "temp/temp.h5"
-    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-    with h5py.File(cache_path, "w") as hf:
-        hf.create_dataset("windows", data=window_long, compression="gzip", compression_opts=4)
-    
-    # Read back from h5
-    with h5py.File(cache_path, "r") as hf:
-        compressed_win_long = hf["windows"][:]
-        
-    os.remove(cache_path)  # Clean up temporary file
+def preprocess_for_inference(record_path, fs=100, window_size=180, dtype=None, pool=None, raw=None):
+    """Returns the first window_size seconds and the first 20 seconds of the preprocessed recording.
+
+    With a pool (buffer_pool.BufferPool), every intermediate is borrowed from it and given back, and both returned
+    windows are pool buffers the caller releases once done with them. raw is the output of read_for_inference with the
+    same dtype and pool, if the recording was already read; its buffer then belongs to this call.
+    """
+    if dtype is None:
+        dtype = PREPROCESS_DTYPE
+    if raw is None:
+        raw = read_for_inference(record_path, dtype, pool)
+    raw_signal, raw_fs = raw
+    del raw
+    if dtype == "float32":
+        num_samples = int(raw_signal.shape[0] * (fs / raw_fs))
+        out = pool.acquire((num_samples, 19), np.float32) if pool is not None else None
+        try:
+            processed_signal = preprocess_eeg_signal_float32(raw_signal, raw_fs, fs, out=out)
+        except Exception:
+            if pool is not None:
+                pool.release(out)
+            raise
+        finally:
+            if pool is not None:
+                pool.release(raw_signal)
+    else:
+        processed_signal = preprocess_eeg_signal(raw_signal, raw_fs, fs)
+    del raw_signal
+    try:
+        window_long = create_windows(processed_signal, window_size, fs)
+        window_short = create_windows(processed_signal, 20, fs)
+
+        # Both windows are copied out of processed_signal, which is given back below; nothing touches the disk, so
+        # concurrent calls (request threads, upload jobs, batch workers) do not share any state.
+        if pool is not None:
+            window_short = _copy_to_pool(window_short, pool)
+            compressed_win_long = _copy_to_pool(window_long, pool)
+        else:
+            compressed_win_long = np.array(window_long)
+    finally:
+        if pool is not None and dtype == "float32":
+            pool.release(processed_signal)
 
     return compressed_win_long, window_short
+
+def _copy_to_pool(array, pool):
+    copy = pool.acquire(array.shape, array.dtype)
+    copy[...] = array
+    return copy
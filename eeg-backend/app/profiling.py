@@ -0,0 +1,190 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# On-demand profiling of live requests. An admin starts a session for the next N requests and/or T seconds; each
+# request handled while the session is active is profiled on its own and leaves one artifact in the session folder.
+# When no session is active the request hooks return after a single None check.
+
+MODES = ('cprofile', 'torch', 'sampling')
+
+current_session = None
+last_session = None
+_session_lock = threading.Lock()
+
+
+class ProfileSession:
+    def __init__(self, mode, folder, max_requests=None, seconds=None, interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported profiling mode '{mode}'. Must be one of {list(MODES)}.")
+        if max_requests is None and seconds is None:
+            raise ValueError("Give the number of requests and/or the number of seconds to profile.")
+        try:
+            max_requests = int(max_requests) if max_requests is not None else None
+            seconds = float(seconds) if seconds is not None else None
+            interval = float(interval)
+        except (TypeError, ValueError):
+            raise ValueError("requests, seconds and interval must be numbers.")
+        if (max_requests is not None and max_requests <= 0) or (seconds is not None and not seconds > 0) \
+                or not interval > 0:
+            raise ValueError("requests, seconds and interval must be positive.")
+        self.session_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self.mode = mode
+        self.folder = os.path.join(folder, self.session_id)
+        self.max_requests = max_requests
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.interval = interval
+        self.started = 0
+        self.artifacts = []
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._torch_lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def expired(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return True
+        return self.max_requests is not None and self.started >= self.max_requests
+
+    def claim(self):
+        """Reserves a slot for one more profiled request; returns its sequence number or None if the session is done."""
+        with self._lock:
+            if self.expired():
+                return None
+            self.started += 1
+            return self.started
+
+    def status(self):
+        return {
+            'session_id': self.session_id,
+            'mode': self.mode,
+            'active': self is current_session,
+            'requests_profiled': len(self.artifacts),
+            'requests_skipped': self.skipped,
+            'max_requests': self.max_requests,
+            'seconds_left': max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None,
+            'artifacts': [os.path.relpath(path, os.path.dirname(self.folder)) for path in self.artifacts],
+        }
+
+
+class _CProfileRecorder:
+    def __init__(self, session, path):
+        self.session = session
+        self.path = path + '.prof'
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+        return self.path
+
+
+class _TorchRecorder:
+    def __init__(self, session, path):
+        import torch.profiler
+        self.session = session
+        self.path = path + '.torch.json'
+        self.profile = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True)
+
+    def start(self):
+        # The torch profiler is process-wide, so only one request at a time can hold it.
+        if not self.session._torch_lock.acquire(blocking=False):
+            raise RuntimeError('torch profiler busy')
+        self.profile.__enter__()
+
+    def stop(self):
+        try:
+            self.profile.__exit__(None, None, None)
+            self.profile.export_chrome_trace(self.path)
+        finally:
+            self.session._torch_lock.release()
+        return self.path
+
+
+class _SamplingRecorder(threading.Thread):
+    """Samples the request thread's Python stack every interval and writes collapsed stacks (flamegraph.pl format)."""
+    def __init__(self, session, path):
+        super().__init__(daemon=True)
+        self.session = session
+        self.path = path + '.folded'
+        self.thread_id = threading.get_ident()
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.session.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        with open(self.path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+        return self.path
+
+
+_RECORDERS = {'cprofile': _CProfileRecorder, 'torch': _TorchRecorder, 'sampling': _SamplingRecorder}
+
+
+def start_session(mode, folder, max_requests=None, seconds=None, interval=0.005):
+    global current_session, last_session
+    session = ProfileSession(mode, folder, max_requests, seconds, interval)
+    with _session_lock:
+        current_session = session
+        last_session = session
+    return session
+
+
+def stop_session():
+    global current_session
+    with _session_lock:
+        session, current_session = current_session, None
+    return session
+
+
+def begin_request(label):
+    """Starts profiling the current request if a session wants it; returns a recorder to pass to end_request."""
+    global current_session
+    session = current_session
+    if session is None:
+        return None
+    number = session.claim()
+    if number is None:
+        with _session_lock:
+            if current_session is session:
+                current_session = None
+        return None
+    path = os.path.join(session.folder, f'{number:04d}-{label}')
+    recorder = _RECORDERS[session.mode](session, path)
+    try:
+        recorder.start()
+    except Exception as e:
+        # e.g. another profiler already active on this interpreter; leave this request unprofiled
+        print(f"Profiling skipped for request {number}: {e}")
+        session.skipped += 1
+        return None
+    return recorder
+
+
+def end_request(recorder):
+    if recorder is None:
+        return
+    try:
+        recorder.session.artifacts.append(recorder.stop())
+    except Exception as e:
+        print(f"Error saving profile {recorder.path}: {e}")
@@ -0,0 +1,237 @@
+import os
+import re
+from fractions import Fraction
+import numpy as np
+import wfdb
+
+# Sample layouts for the WFDB formats we can address directly: numpy dtype, bytes per sample, digital offset and the
+# digital value that marks an invalid sample. Packed formats (212, 310, 311) and difference format 8 fall back to wfdb.
+SAMPLE_FORMATS = {
+    '16': ('<i2', 2, 0, -32768),
+    '61': ('>i2', 2, 0, -32768),
+    '80': ('u1', 1, -128, -128),
+    '160': ('<u2', 2, -32768, -32768),
+    '24': (None, 3, 0, -8388608),
+    '32': ('<i4', 4, 0, -2147483648),
+}
+
+# Bytes per sample of every format, including the packed ones, to infer a missing sample count from the file size
+_FORMAT_BYTES = dict({fmt: Fraction(layout[1]) for fmt, layout in SAMPLE_FORMATS.items()},
+                     **{'8': Fraction(1), '212': Fraction(3, 2), '310': Fraction(4, 3), '311': Fraction(4, 3)})
+
+_FORMAT_PATTERN = re.compile(r'^(\d+)(?:x(\d+))?(?::\d+)?(?:\+(\d+))?$')
+_GAIN_PATTERN = re.compile(r'^([-+0-9.eE]+)(?:\((-?\d+)\))?(?:/(.*))?$')
+
+DEFAULT_GAIN = 200.0
+DEFAULT_UNITS = 'mV'
+
+
+def read_header(header_path):
+    """Parses a WFDB header into the fields needed to address samples in its signal file."""
+    if not header_path.endswith('.hea'):
+        header_path = header_path + '.hea'
+    with open(header_path, 'r') as f:
+        lines = [l.strip() for l in f if l.strip()]
+
+    record_line = lines[0].split()
+    num_signals = int(record_line[1])
+    fs = float(record_line[2].split('/')[0]) if len(record_line) > 2 else 250.0
+    num_samples = int(record_line[3]) if len(record_line) > 3 else None
+
+    signal_files, fmts, samples_per_frame, byte_offsets = [], [], [], []
+    gains, baselines, adc_zeros, initial_values, checksums, channels = [], [], [], [], [], []
+    units = []
+    comments = []
+    for l in lines[1:]:
+        if l.startswith('#'):
+            comments.append(l)
+            continue
+        arrs = l.split()
+        fmt_match = _FORMAT_PATTERN.match(arrs[1])
+        if fmt_match is None:
+            raise ValueError(f"Unsupported format field '{arrs[1]}' in {header_path}")
+        adc_zero = int(arrs[4]) if len(arrs) > 4 else 0
+        gain, baseline, unit = DEFAULT_GAIN, adc_zero, DEFAULT_UNITS
+        if len(arrs) > 2:
+            gain_match = _GAIN_PATTERN.match(arrs[2])
+            if gain_match is None:
+                raise ValueError(f"Unsupported gain field '{arrs[2]}' in {header_path}")
+            gain = float(gain_match.group(1)) or DEFAULT_GAIN
+            if gain_match.group(2) is not None:
+                baseline = int(gain_match.group(2))
+            unit = gain_match.group(3) or DEFAULT_UNITS
+        signal_files.append(arrs[0])
+        fmts.append(fmt_match.group(1))
+        samples_per_frame.append(int(fmt_match.group(2) or 1))
+        byte_offsets.append(int(fmt_match.group(3) or 0))
+        gains.append(gain)
+        baselines.append(baseline)
+        adc_zeros.append(adc_zero)
+        units.append(unit)
+        initial_values.append(int(arrs[5]) if len(arrs) > 5 else 0)
+        checksums.append(int(arrs[6]) if len(arrs) > 6 else 0)
+        channels.append(' '.join(arrs[8:]) if len(arrs) > 8 else f'ch{len(channels)}')
+
+    if len(channels) != num_signals:
+        raise ValueError(f"Header {header_path} declares {num_signals} signals but describes {len(channels)}")
+    if num_samples is None:
+        num_samples = _infer_num_samples(header_path, signal_files, fmts, samples_per_frame, byte_offsets)
+
+    return {
+        'header_path': header_path,
+        'record_name': record_line[0],
+        'num_signals': num_signals,
+        'fs': fs,
+        'num_samples': num_samples,
+        'signal_files': signal_files,
+        'fmts': fmts,
+        'samples_per_frame': samples_per_frame,
+        'byte_offsets': byte_offsets,
+        'gains': np.asarray(gains, dtype=np.float64),
+        'baselines': np.asarray(baselines, dtype=np.float64),
+        'adc_zeros': np.asarray(adc_zeros, dtype=np.int64),
+        'units': units,
+        'initial_values': np.asarray(initial_values, dtype=np.int64),
+        'checksums': np.asarray(checksums, dtype=np.int64),
+        'channels': channels,
+        'comments': comments,
+    }
+
+
+def _infer_num_samples(header_path, signal_files, fmts, samples_per_frame, byte_offsets):
+    """Sample count of a header that omits it, from the size of its single signal file as WFDB does; None if unknown."""
+    if len(set(signal_files)) != 1 or len(set(byte_offsets)) != 1 or any(fmt not in _FORMAT_BYTES for fmt in fmts):
+        return None
+    try:
+        size = os.path.getsize(os.path.join(os.path.dirname(header_path), signal_files[0]))
+    except OSError:
+        return None
+    frame_bytes = sum(_FORMAT_BYTES[fmt] * spf for fmt, spf in zip(fmts, samples_per_frame))
+    return int((size - byte_offsets[0]) / frame_bytes) if frame_bytes else None
+
+
+def is_directly_readable(header):
+    """True if all signals live interleaved in one signal file with a format we can seek into.
+
+    Multi-frequency records (more than one sample per frame for some signal) are left to wfdb.
+    """
+    return (len(set(header['signal_files'])) == 1
+            and len(set(header['fmts'])) == 1
+            and all(spf == 1 for spf in header['samples_per_frame'])
+            and len(set(header['byte_offsets'])) == 1
+            and header['fmts'][0] in SAMPLE_FORMATS
+            and header['num_samples'] is not None)
+
+
+def can_read_into(header, channels=None):
+    """True if read_digital can read the samples straight into a caller's buffer (out=)."""
+    dtype, _, digital_offset, _ = SAMPLE_FORMATS[header['fmts'][0]]
+    return channels is None and dtype is not None and not digital_offset and np.dtype(dtype).isnative
+
+
+def read_digital(header, start, stop, channels=None, out=None):
+    """Reads the raw ADC values of samples [start, stop) as an (n_samples, n_channels) array.
+
+    Only the bytes covering the requested sample range are read from the signal file. If can_read_into(header) holds,
+    out may be a C-contiguous (n_samples, n_signals) array of the format's dtype to read into.
+    """
+    num_signals = header['num_signals']
+    start = max(0, int(start))
+    stop = min(header['num_samples'], int(stop))
+    if stop <= start:
+        return np.empty((0, num_signals if channels is None else len(channels)), dtype=np.int32)
+
+    dtype, sample_bytes, digital_offset, _ = SAMPLE_FORMATS[header['fmts'][0]]
+    frame_bytes = sample_bytes * num_signals
+    signal_path = os.path.join(os.path.dirname(header['header_path']), header['signal_files'][0])
+    count = (stop - start) * num_signals
+
+    with open(signal_path, 'rb') as f:
+        f.seek(header['byte_offsets'][0] + start * frame_bytes)
+        if out is not None:
+            if not can_read_into(header, channels) or out.shape != (stop - start, num_signals) or out.dtype != dtype:
+                raise ValueError(f"Cannot read samples of {signal_path} into a {out.dtype} array of shape {out.shape}")
+            if f.readinto(memoryview(out).cast('B')) != out.nbytes:
+                raise ValueError(f"Signal file {signal_path} is shorter than its header declares")
+            return out
+        if dtype is None:
+            raw = np.fromfile(f, dtype=np.uint8, count=count * 3).reshape(-1, 3).astype(np.int32)
+            data = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+            data[data >= 1 << 23] -= 1 << 24
+        else:
+            data = np.fromfile(f, dtype=dtype, count=count)
+
+    if data.size != count:
+        raise ValueError(f"Signal file {signal_path} is shorter than its header declares")
+    data = data.reshape(-1, num_signals)
+    if channels is not None:
+        data = data[:, channels]
+    if digital_offset:
+        data = data.astype(np.int32) + digital_offset
+    return data
+
+
+def digital_to_physical(digital, header, channels=None, dtype=np.float32, out=None):
+    """Rescales raw ADC values with the header gains and baselines; invalid samples become NaN."""
+    gains = header['gains'] if channels is None else header['gains'][channels]
+    baselines = header['baselines'] if channels is None else header['baselines'][channels]
+    invalid_value = SAMPLE_FORMATS[header['fmts'][0]][3]
+
+    physical = np.empty(digital.shape, dtype=dtype) if out is None else out
+    np.subtract(digital, baselines, out=physical, casting='unsafe')
+    np.divide(physical, gains, out=physical, casting='unsafe')
+    physical[digital == invalid_value] = np.nan
+    return physical
+
+
+def read_samples(record_path, start, stop, channels=None, dtype=np.float32, header=None, pool=None):
+    """Reads physical samples [start, stop) of a WFDB record as (n_samples, n_channels), like wfdb's p_signal.
+
+    Falls back to wfdb.rdrecord with a sample range for formats that cannot be addressed directly. With a pool
+    (buffer_pool.BufferPool), the result and the raw samples are borrowed from it and the caller releases the result.
+    """
+    if header is None:
+        header = read_header(record_path)
+    if not is_directly_readable(header):
+        start = max(0, int(start))
+        stop = int(stop) if header['num_samples'] is None else min(header['num_samples'], int(stop))
+        if stop <= start:
+            num_channels = header['num_signals'] if channels is None else len(channels)
+            empty = np.empty((0, num_channels), dtype=dtype)
+            return empty if pool is None else pool.acquire(empty.shape, dtype)
+        record = wfdb.rdrecord(record_path, sampfrom=start, sampto=stop, channels=channels)
+        if pool is None:
+            return record.p_signal.astype(dtype, copy=False)
+        physical = pool.acquire(record.p_signal.shape, dtype)
+        physical[...] = record.p_signal
+        return physical
+    if pool is None:
+        digital = read_digital(header, start, stop, channels)
+        return digital_to_physical(digital, header, channels, dtype)
+
+    start = max(0, int(start))
+    stop = max(start, min(header['num_samples'], int(stop)))
+    num_channels = header['num_signals'] if channels is None else len(channels)
+    if can_read_into(header, channels) and stop > start:
+        with pool.borrow((stop - start, num_channels), SAMPLE_FORMATS[header['fmts'][0]][0]) as digital:
+            read_digital(header, start, stop, channels, out=digital)
+            physical = pool.acquire(digital.shape, dtype)
+            return digital_to_physical(digital, header, channels, dtype, out=physical)
+    digital = read_digital(header, start, stop, channels)
+    return digital_to_physical(digital, header, channels, dtype, out=pool.acquire(digital.shape, dtype))
+
+
+def read_window(record_path, start, stop, margin=0, channels=None, dtype=np.float32, header=None):
+    """Reads samples [start - margin, stop + margin), clipped to the record.
+
+    Returns the samples and the position of `start` within them, so callers can filter over the margin and crop back
+    to the requested window afterwards.
+    """
+    if header is None:
+        header = read_header(record_path)
+    read_start = max(0, int(start) - int(margin))
+    read_stop = int(stop) + int(margin)
+    if header['num_samples'] is not None:
+        read_stop = min(header['num_samples'], read_stop)
+    samples = read_samples(record_path, read_start, read_stop, channels, dtype, header)
+    return samples, int(start) - read_start
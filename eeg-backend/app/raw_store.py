@@ -0,0 +1,201 @@
+import contextlib
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import wfdb
+from wfdb.io._signal import INVALID_SAMPLE_VALUE
+from config import RAW_STORE_FOLDER, RAW_STORE_OPEN_RECORDS
+from raw_reader import SAMPLE_FORMATS, read_header, is_directly_readable, digital_to_physical
+from metrics import CACHE_HITS, CACHE_MISSES
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent ingests still write separate temporary files, just redundantly
+    fcntl = None
+
+# Memory-mapped access to raw ADC samples. I-CARE recordings (format 16+24 in a MATLAB v4 file) already store int16
+# frames back to back, so they are mapped in place. Records in other formats are ingested once into the same layout, a
+# format-16 WFDB record with the gains and baselines in its header, under RAW_STORE_FOLDER. Readers get float32 only
+# for the slices they read; the int16 pages are a quarter of float64 p_signal and shared between processes through the
+# page cache.
+
+_INT16_MIN = -32768
+_INT16_MAX = 32767
+
+_open_records = OrderedDict()
+_open_records_lock = threading.Lock()
+
+
+def is_mappable(header):
+    """True if the record's signal file can be mapped as an (n_samples, n_signals) array without conversion."""
+    if not is_directly_readable(header):
+        return False
+    dtype, _, digital_offset, _ = SAMPLE_FORMATS[header['fmts'][0]]
+    return dtype is not None and not digital_offset
+
+
+class MappedRecord:
+    """Read-only view of a record's raw samples; read() rescales only the requested slice."""
+
+    def __init__(self, header):
+        self.header = header
+        dtype = SAMPLE_FORMATS[header['fmts'][0]][0]
+        signal_path = os.path.join(os.path.dirname(header['header_path']), header['signal_files'][0])
+        self.digital = np.memmap(signal_path, dtype=dtype, mode='r', offset=header['byte_offsets'][0],
+                                 shape=(header['num_samples'], header['num_signals']))
+
+    @property
+    def fs(self):
+        return self.header['fs']
+
+    @property
+    def num_samples(self):
+        return self.header['num_samples']
+
+    @property
+    def channels(self):
+        return self.header['channels']
+
+    def read(self, start, stop, channels=None, dtype=np.float32, out=None):
+        """Physical samples [start, stop) as (n_samples, n_channels), like raw_reader.read_samples."""
+        start = max(0, int(start))
+        stop = max(start, min(self.num_samples, int(stop)))
+        digital = self.digital[start:stop]
+        if channels is not None:
+            digital = digital[:, channels]
+        return digital_to_physical(digital, self.header, channels, dtype, out=out)
+
+
+def store_path(record_path, store_folder=None):
+    """Where the ingested copy of record_path lives: one folder per source folder, named by its path hash."""
+    if store_folder is None:
+        store_folder = RAW_STORE_FOLDER
+    source_folder, record_name = os.path.split(os.path.realpath(record_path))
+    key = hashlib.sha1(source_folder.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(store_folder, key, record_name)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _source_mtime(record_path, header):
+    folder = os.path.dirname(header['header_path'])
+    return max([_mtime(header['header_path']) or 0] +
+               [_mtime(os.path.join(folder, name)) or 0 for name in set(header['signal_files'])])
+
+
+@contextlib.contextmanager
+def _target_lock(target):
+    """Serializes ingests of one target across threads and processes (e.g. DataLoader workers)."""
+    if fcntl is None:
+        yield
+        return
+    with open(target + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, write):
+    """Calls write(file) on a unique temporary file next to path, then moves it into place."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def ingest(record_path, store_folder=None):
+    """Writes an int16 copy of a record that cannot be mapped in place and returns its record path.
+
+    The copy is rewritten only when the source is newer. Raises ValueError if the ADC values do not fit in int16.
+    """
+    header = read_header(record_path)
+    target = store_path(record_path, store_folder)
+    if (_mtime(target + '.hea') or 0) >= _source_mtime(record_path, header):
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with _target_lock(target):
+        # Another process may have written the copy while this one waited for the lock
+        if (_mtime(target + '.hea') or 0) >= _source_mtime(record_path, header):
+            return target
+        _write_copy(record_path, header, target)
+    return target
+
+
+def _write_copy(record_path, header, target):
+    record = wfdb.rdrecord(record_path.removesuffix('.hea'), physical=False)
+    digital = np.asarray(record.d_signal)
+    invalid = np.zeros(digital.shape, dtype=bool)
+    for i, fmt in enumerate(record.fmt):
+        invalid[:, i] = digital[:, i] == INVALID_SAMPLE_VALUE[fmt]
+    valid = digital[~invalid]
+    if valid.size and (valid.min() <= _INT16_MIN or valid.max() > _INT16_MAX):
+        raise ValueError(f"ADC values of {record_path} do not fit in int16")
+    samples = digital.astype('<i2')
+    samples[invalid] = _INT16_MIN
+
+    name = os.path.basename(target)
+    _write_atomic(target + '.dat', samples.tofile)
+    checksums = samples.sum(axis=0, dtype=np.int16)
+    lines = [f'{name} {header["num_signals"]} {header["fs"]} {samples.shape[0]}']
+    for i, channel in enumerate(header['channels']):
+        initial_value = int(samples[0, i]) if samples.shape[0] else 0
+        lines.append(f'{name}.dat 16 {float(header["gains"][i])!r}({int(header["baselines"][i])})/{header["units"][i]} '
+                     f'16 0 {initial_value} {int(checksums[i])} 0 {channel}')
+    # Written last: the header's mtime marks the copy as complete
+    _write_atomic(target + '.hea', lambda f: f.write(('\n'.join(lines) + '\n').encode('utf-8')))
+
+
+def open_record(record_path, store_folder=None):
+    """Returns a MappedRecord for record_path, ingesting it first if needed; open records are cached per process."""
+    record_path = record_path.removesuffix('.hea')
+    key = os.path.realpath(record_path)
+    with _open_records_lock:
+        cached = _open_records.get(key)
+    if cached is not None and cached[1] == _source_mtime(record_path, cached[0]):
+        with _open_records_lock:
+            if key in _open_records:
+                _open_records.move_to_end(key)
+        CACHE_HITS.inc(cache='raw_store')
+        return cached[2]
+    CACHE_MISSES.inc(cache='raw_store')
+
+    source_header = read_header(record_path)
+    header = source_header
+    if not is_mappable(header):
+        header = read_header(ingest(record_path, store_folder))
+    record = MappedRecord(header)
+    with _open_records_lock:
+        _open_records[key] = (source_header, _source_mtime(record_path, source_header), record)
+        while len(_open_records) > RAW_STORE_OPEN_RECORDS:
+            _open_records.popitem(last=False)
+    return record
+
+
+if __name__ == '__main__':
+    # Ingest every record of a data folder that cannot be mapped in place: python raw_store.py data_folder
+    if len(sys.argv) != 2:
+        raise SystemExit('Usage: python raw_store.py data_folder')
+    for folder, _, files in os.walk(sys.argv[1]):
+        for file_name in sorted(files):
+            if not file_name.endswith('.hea'):
+                continue
+            record_path = os.path.join(folder, file_name[:-len('.hea')])
+            if not is_mappable(read_header(record_path)):
+                print(f'{record_path} -> {ingest(record_path)}')
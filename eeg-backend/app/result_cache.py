@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from config import RESULT_CACHE_SIZE
+from catalog import open_catalog
+from raw_reader import read_header
+from metrics import CACHE_HITS, CACHE_MISSES
+
+# Per-patient /predict results, keyed by the model version and a hash of everything the models read for the patient,
+# so a re-uploaded cohort only recomputes patients whose metadata or recordings changed.
+
+MODEL_FILES = ('ml_models.sav', 'dl_model.pth')
+HASH_BLOCK_BYTES = 1 << 20
+
+_model_versions = {}
+
+
+def _hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+
+
+def patient_fingerprint(data_folder, patient_id):
+    """SHA-256 over the patient's metadata text and the header and signal files of each EEG recording."""
+    catalog = open_catalog(data_folder)
+    digest = hashlib.sha256()
+    digest.update(patient_id.encode('utf-8') + b'\0')
+    patient_folder = os.path.join(data_folder, patient_id)
+    # Hashed from disk rather than the catalog, which only sees in-place edits on a deep refresh
+    metadata_path = os.path.join(patient_folder, patient_id + '.txt')
+    if os.path.isfile(metadata_path):
+        _hash_file(digest, metadata_path)
+    digest.update(b'\0')
+    for recording_id in catalog.recording_names(patient_id, suffix='EEG'):
+        header_path = os.path.join(patient_folder, recording_id + '.hea')
+        digest.update(recording_id.encode('utf-8') + b'\0')
+        _hash_file(digest, header_path)
+        for signal_file in sorted(set(read_header(header_path)['signal_files'])):
+            signal_path = os.path.join(patient_folder, signal_file)
+            digest.update(signal_file.encode('utf-8') + b'\0')
+            if os.path.isfile(signal_path):
+                _hash_file(digest, signal_path)
+    return digest.hexdigest()
+
+
+def model_signature(model_folder):
+    """(name, size, mtime) of each model file; changes when a model is replaced on disk."""
+    signature = []
+    for name in MODEL_FILES:
+        try:
+            stat = os.stat(os.path.join(model_folder, name))
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+def model_version(model_folder):
+    """Content hash of the model files, recomputed only when their signature changes."""
+    signature = model_signature(model_folder)
+    cached = _model_versions.get(model_folder)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256()
+    for name, size, _ in signature:
+        digest.update(name.encode('utf-8') + b'\0')
+        if size is not None:
+            _hash_file(digest, os.path.join(model_folder, name))
+    version = digest.hexdigest()[:16]
+    _model_versions[model_folder] = (signature, version)
+    return version
+
+
+class ResultCache:
+    """LRU map from (model version, patient fingerprint) to a patient's result, holding at most max_entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                CACHE_MISSES.inc(cache='predict_result')
+                return None
+            self._entries.move_to_end(key)
+        CACHE_HITS.inc(cache='predict_result')
+        return dict(result)
+
+    def put(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# Resumable, parallel batch version of run_model.py. Run it as follows:
+#
+#   python run_batch.py models data outputs [--workers 4] [--table outputs.csv] [--allow-failures] [--force]
+#
+# Per-patient outputs are written exactly as run_model.py writes them, plus a <patient>.json manifest holding the model
+# version and a hash of the patient's inputs. On a rerun, patients whose manifest matches the current models and inputs
+# are skipped, so an interrupted cohort resumes where it stopped. --table also writes one consolidated CSV (or Parquet,
+# by extension) of every patient's outputs.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from helper_code import find_data_folders, save_challenge_outputs
+from result_cache import patient_fingerprint, model_version
+from catalog import open_catalog
+
+_worker_state = {}
+
+
+def _init_worker(model_folder, data_folder, output_folder, version, allow_failures, force, verbose, threads=None):
+    _worker_state.update(model_folder=model_folder, data_folder=data_folder, output_folder=output_folder,
+                         version=version, allow_failures=allow_failures, force=force, verbose=verbose, models=None,
+                         threads=threads)
+    # Each worker gets its share of the cores: OpenMP/BLAS pools sized by the environment for libraries loaded from
+    # here on, threadpoolctl for those already loaded on import, and torch once the models are loaded.
+    if threads is not None:
+        for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            os.environ.setdefault(name, str(threads))
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def process_patient(patient_id):
+    """Runs the models for one patient unless its outputs are current; returns the patient's manifest."""
+    state = _worker_state
+    patient_folder = os.path.join(state['output_folder'], patient_id)
+    output_file = os.path.join(patient_folder, patient_id + '.txt')
+    manifest_file = os.path.join(patient_folder, patient_id + '.json')
+    start = time.perf_counter()
+
+    input_hash = patient_fingerprint(state['data_folder'], patient_id)
+    manifest = _load_manifest(manifest_file)
+    if (not state['force'] and manifest is not None and manifest.get('status') == 'ok'
+            and manifest.get('model_version') == state['version'] and manifest.get('input_hash') == input_hash
+            and os.path.isfile(output_file)):
+        return dict(manifest, skipped=True, seconds=time.perf_counter() - start)
+
+    # Models are loaded on the first patient that needs them, so a fully resumed run never loads them.
+    if state['models'] is None:
+        from team_code import load_challenge_models
+        state['models'] = load_challenge_models(state['model_folder'], state['verbose'] >= 2)
+        if state['threads'] is not None:
+            import torch
+            torch.set_num_threads(state['threads'])
+    from team_code import run_challenge_models
+
+    status = 'ok'
+    error = None
+    try:
+        outcome_binary, outcome_probability, cpc = run_challenge_models(
+            state['models'], state['data_folder'], patient_id, state['verbose'] >= 3)
+    except Exception as e:
+        if not state['allow_failures']:
+            raise
+        outcome_binary, outcome_probability, cpc = float('nan'), float('nan'), float('nan')
+        status = 'failed'
+        error = f'{type(e).__name__}: {e}'
+
+    os.makedirs(patient_folder, exist_ok=True)
+    _write_atomic(output_file, save_challenge_outputs(None, patient_id, outcome_binary, outcome_probability, cpc))
+    manifest = {
+        'patient_id': patient_id,
+        'status': status,
+        'error': error,
+        'model_version': state['version'],
+        'input_hash': input_hash,
+        'outcome': float(outcome_binary),
+        'outcome_probability': float(outcome_probability),
+        'cpc': float(cpc),
+    }
+    # Written last: a patient only counts as done once both files are on disk.
+    _write_atomic(manifest_file, json.dumps(manifest))
+    return dict(manifest, skipped=False, seconds=time.perf_counter() - start)
+
+
+def write_table(path, results):
+    """Writes the patients' outputs to one CSV, or Parquet when path ends in .parquet."""
+    import pandas as pd
+    columns = ['patient_id', 'outcome', 'outcome_probability', 'cpc', 'status', 'error', 'model_version', 'input_hash']
+    table = pd.DataFrame([{column: result.get(column) for column in columns} for result in results], columns=columns)
+    if path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:d}:{minutes:02d}:{seconds:02d}'
+
+
+def run_batch(model_folder, data_folder, output_folder, workers=1, table=None, allow_failures=False, force=False,
+              verbose=1):
+    """Runs the models over every patient in data_folder; returns the per-patient manifests and a summary."""
+    patient_ids = find_data_folders(data_folder)
+    num_patients = len(patient_ids)
+    if num_patients == 0:
+        raise Exception('No data were provided.')
+    os.makedirs(output_folder, exist_ok=True)
+
+    # A deep refresh catches files edited in place, which leave the patient folder's mtime alone. Workers start after
+    # this and inherit (or reload) the refreshed catalog.
+    open_catalog(data_folder).refresh(deep=True)
+    version = model_version(model_folder)
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else None
+    init_args = (model_folder, data_folder, output_folder, version, allow_failures, force, verbose, threads)
+    if verbose >= 1:
+        print(f'Running {num_patients} patients with {workers} worker(s)'
+              + (f' of {threads} thread(s) each' if threads is not None else '') + f', model version {version}...')
+
+    results = {}
+    computed_seconds = 0.0
+    start = time.perf_counter()
+
+    def report(result):
+        nonlocal computed_seconds
+        results[result['patient_id']] = result
+        if not result['skipped']:
+            computed_seconds += result['seconds']
+        if verbose >= 1:
+            done = len(results)
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed if elapsed > 0 else 0.0
+            eta = (num_patients - done) / rate if rate > 0 else 0.0
+            label = 'skipped' if result['skipped'] else result['status']
+            print(f'    [{done}/{num_patients}] {result["patient_id"]} {label} ({result["seconds"]:.1f} s) | '
+                  f'{rate:.2f} patients/s, ETA {_format_seconds(eta)}')
+
+    if workers <= 1:
+        _init_worker(*init_args)
+        for patient_id in patient_ids:
+            report(process_patient(patient_id))
+    else:
+        # Spawned rather than forked: a fork of a process that has already run torch (or any OpenMP pool) can hang in
+        # the child, e.g. when run_batch is called from the server or after a sequential run.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=init_args) as executor:
+            futures = [executor.submit(process_patient, patient_id) for patient_id in patient_ids]
+            for future in as_completed(futures):
+                report(future.result())
+
+    wall_seconds = time.perf_counter() - start
+    ordered = [results[patient_id] for patient_id in patient_ids]
+    computed = sum(1 for result in ordered if not result['skipped'])
+    summary = {
+        'patients': num_patients,
+        'computed': computed,
+        'skipped': num_patients - computed,
+        'failed': sum(1 for result in ordered if result['status'] == 'failed'),
+        'workers': workers,
+        'wall_seconds': wall_seconds,
+        'patients_per_second': num_patients / wall_seconds if wall_seconds > 0 else None,
+        'computed_per_second': computed / wall_seconds if wall_seconds > 0 else None,
+        'mean_patient_seconds': computed_seconds / computed if computed else None,
+    }
+
+    if table is not None:
+        write_table(table, ordered)
+    if verbose >= 1:
+        print(f"Done: {summary['computed']} computed, {summary['skipped']} skipped, {summary['failed']} failed "
+              f"in {_format_seconds(wall_seconds)} ({summary['patients_per_second']:.2f} patients/s overall, "
+              f"{summary['computed_per_second']:.2f} computed patients/s).")
+        if computed:
+            print(f"Mean time per computed patient: {summary['mean_patient_seconds']:.2f} s")
+        if table is not None:
+            print(f'Wrote {table}')
+    return ordered, summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Challenge models over a cohort, resuming where a previous run stopped.')
+    parser.add_argument('model_folder')
+    parser.add_argument('data_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--table', help='consolidated outputs file (.csv, or .parquet)')
+    parser.add_argument('--allow-failures', action='store_true', help='record NaN outputs for patients that fail')
+    parser.add_argument('--force', action='store_true', help='recompute patients whose outputs are current')
+    parser.add_argument('--verbose', type=int, default=1)
+    args = parser.parse_args()
+
+    _, summary = run_batch(args.model_folder, args.data_folder, args.output_folder, workers=args.workers,
+                           table=args.table, allow_failures=args.allow_failures, force=args.force,
+                           verbose=args.verbose)
+    sys.exit(1 if summary['failed'] else 0)
@@ -1,19 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, send_from_directory
 import wfdb
 import os
 import traceback
+import hmac
 from flask_cors import CORS
 from inference_utils import load_model, run_inference
 import tempfile
 import zipfile
+import random
+import threading
+import time
 from helper_code import find_data_folders
-from team_code import load_challenge_models, run_challenge_models
+from team_code import load_challenge_models, run_challenge_models, scoring_info
+from raw_reader import read_header, read_samples
+from catalog import forget_catalog
+from config import DEBUG, PORT, MODEL_FOLDER, TRACE_FOLDER, TRACE_SAMPLE_RATE, ADMIN_TOKEN, PROFILE_FOLDER, MODEL_CHECK_SECONDS
+from metrics import REGISTRY, CONTENT_TYPE, time_stage, PATIENTS, FAILURES
+from tracing import start_trace, span
+import profiling
+from live import LiveSessions, parse_samples, event_stream
+from result_cache import RESULT_CACHE, patient_fingerprint, model_signature, model_version
+from upload_store import get_store
+from chunked_upload import ChunkedUploads, chunked_upload_folder
 
 app = Flask(__name__)
 
 CORS(app)
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 model_path = "./eeg_model.pth"
 try:
@@ -24,31 +36,85 @@ except Exception as e:
 
 # Initialize models flag
 _models_loaded = False
-models = None
-MODEL_FOLDER = './model'
+# (models, version), replaced as a whole so a request never pairs one load's models with another's version
+loaded_models = (None, None)
+_models_signature = None
+_models_checked = 0.0
+_models_lock = threading.Lock()
 
 # Model loading functions
 def load_models():
-    global models, _models_loaded
-    if not _models_loaded:
-        try:
-            models = load_challenge_models(MODEL_FOLDER, verbose=1)
-            _models_loaded = True
-        except Exception as e:
-            print(f"Error loading models: {e}")
-            traceback.print_exc()
-            # Initialize with default models to avoid crashing
-            models = {
-                'imputer': None,
-                'scaler': None,
-                'outcome_model': None,
-                'cpc_model': None,
-                'dl_model': None
-            }
+    if _models_loaded:
+        return
+    with _models_lock:
+        if not _models_loaded:
+            _load_models_locked()
+
+def _load_models_locked():
+    """Loads the models from MODEL_FOLDER and publishes them; the caller holds _models_lock."""
+    global loaded_models, _models_loaded, _models_signature
+    try:
+        signature = model_signature(MODEL_FOLDER)
+        loaded_models = (load_challenge_models(MODEL_FOLDER, verbose=1), model_version(MODEL_FOLDER))
+        _models_signature = signature
+        _models_loaded = True
+    except Exception as e:
+        print(f"Error loading models: {e}")
+        traceback.print_exc()
+        # Initialize with default models to avoid crashing
+        _models_loaded = False
+        loaded_models = ({
+            'imputer': None,
+            'scaler': None,
+            'outcome_model': None,
+            'cpc_model': None,
+            'dl_model': None
+        }, None)
+
+live_sessions = LiveSessions(lambda: loaded_models[0]['dl_model'] if loaded_models[0] is not None else None)
+
+# Bytes read per step from a streamed live chunk body
+LIVE_READ_BYTES = 1 << 16
+
+def reload_models_if_changed():
+    """Hot-swaps the models when their files change on disk; cached results of the old models are dropped."""
+    global _models_checked
+    if not _models_loaded or time.monotonic() - _models_checked < MODEL_CHECK_SECONDS:
+        return
+    # The check and the swap happen under one lock: concurrent requests neither reload twice nor see a half-done
+    # swap, and keep using the models they already hold until loaded_models is replaced.
+    with _models_lock:
+        if not _models_loaded or time.monotonic() - _models_checked < MODEL_CHECK_SECONDS:
+            return
+        _models_checked = time.monotonic()
+        if model_signature(MODEL_FOLDER) == _models_signature:
+            return
+        print(f"Model files in {MODEL_FOLDER} changed, reloading models")
+        _load_models_locked()
+        RESULT_CACHE.clear()
 
 @app.before_request
 def initialize_models():
     load_models()
+    reload_models_if_changed()
+
+@app.before_request
+def start_request_profile():
+    if profiling.current_session is None or request.path.startswith("/admin/"):
+        return
+    g.profile_recorder = profiling.begin_request(request.endpoint or "request")
+
+@app.teardown_request
+def stop_request_profile(exc):
+    recorder = g.pop("profile_recorder", None)
+    if recorder is not None:
+        profiling.end_request(recorder)
+
+def is_admin_request():
+    # No token, no admin access: behind a local reverse proxy every caller looks like 127.0.0.1
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
 
 def find_root_folder(base_path):
     if find_data_folders(base_path):
@@ -73,49 +139,124 @@ def predict():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    
+
+    # Tracing: always with ?debug=1 (trace returned inline), otherwise for a sampled fraction of calls (file only)
+    debug = request.values.get('debug', '').lower() in ('1', 'true', 'yes')
+    if not debug and not (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE):
+        payload, status = process_zip_upload(file)
+        return jsonify(payload), status
+
+    with start_trace('predict', filename=file.filename) as trace:
+        payload, status = process_zip_upload(file)
+    trace_path = trace.save(TRACE_FOLDER)
+    if debug:
+        payload['trace'] = {'trace_id': trace.trace_id, 'file': trace_path, 'spans': trace.to_tree()}
+    return jsonify(payload), status
+
+def process_zip_upload(file):
+    """Extracts an uploaded cohort ZIP and runs the models on every patient in it; returns (payload, status)."""
     with tempfile.TemporaryDirectory() as temp_dir:
-        # Save uploaded zip
-        zip_path = os.path.join(temp_dir, 'upload.zip')
-        file.save(zip_path)
-        
-        # Extract all contents
-        data_folder = os.path.join(temp_dir, 'extracted')
-        os.makedirs(data_folder, exist_ok=True)
         try:
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(data_folder)
-        except zipfile.BadZipFile:
-            return jsonify({'error': 'Invalid ZIP file format'}), 400
-
-        # Find the actual data root folder
-        data_root = find_root_folder(data_folder)
-        if not find_data_folders(data_root):
-            return jsonify({'error': 'No valid patient data found in ZIP structure'}), 400
-
-        # Process each patient
-        results = []
-        for pid in find_data_folders(data_root):
+            # Save uploaded zip
+            zip_path = os.path.join(temp_dir, 'upload.zip')
+            with span('save_upload'):
+                file.save(zip_path)
+
+            # Extract all contents
+            data_folder = os.path.join(temp_dir, 'extracted')
+            os.makedirs(data_folder, exist_ok=True)
             try:
-                outcome, prob, cpc = run_challenge_models(
-                    models, data_root, pid, verbose=1  # Set verbose to 1 for debugging output
-                )
-                results.append({
-                    'patient_id': pid,
-                    'outcome': int(outcome),
-                    'outcome_probability': float(prob),
-                    'cpc': float(cpc)
-                })
-            except Exception as e:
-                print(f"Error processing patient {pid}: {e}")
-                traceback.print_exc()
-                results.append({
-                    'patient_id': pid,
-                    'error': str(e),
-                    'traceback': traceback.format_exc()
-                })
-
-        return jsonify({'patients': results})
+                with time_stage('zip_extraction'), zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                    zip_ref.extractall(data_folder)
+            except zipfile.BadZipFile:
+                return {'error': 'Invalid ZIP file format'}, 400
+
+            # Find the actual data root folder
+            data_root = find_root_folder(data_folder)
+            if not find_data_folders(data_root):
+                return {'error': 'No valid patient data found in ZIP structure'}, 400
+
+            # Process each patient
+            results = []
+            current_models, version = loaded_models
+            for pid in find_data_folders(data_root):
+                results.append(score_patient(data_root, pid, current_models, version))
+            return {'patients': results}, 200
+        finally:
+            # Also on the early returns, so catalogs of deleted uploads do not pile up
+            forget_catalog(temp_dir)
+
+def score_patient(data_root, pid, current_models=None, version=None):
+    """Runs the models on one patient, or answers from the result cache if nothing changed; returns its result."""
+    if current_models is None:
+        current_models, version = loaded_models
+    PATIENTS.inc()
+    try:
+        with span('patient', patient_id=pid):
+            cache_key = (version, patient_fingerprint(data_root, pid)) if version is not None else None
+            result = RESULT_CACHE.get(cache_key) if cache_key is not None else None
+            if result is not None:
+                result['cached'] = True
+                return result
+            outcome, prob, cpc = run_challenge_models(
+                current_models, data_root, pid, verbose=1  # Set verbose to 1 for debugging output
+            )
+            result = {
+                'patient_id': pid,
+                'outcome': int(outcome),
+                'outcome_probability': float(prob),
+                'cpc': float(cpc),
+                'windows_used': scoring_info.windows_used,
+                'windows_total': scoring_info.windows_total
+            }
+            if cache_key is not None:
+                RESULT_CACHE.put(cache_key, result)
+            return result
+    except Exception as e:
+        print(f"Error processing patient {pid}: {e}")
+        traceback.print_exc()
+        FAILURES.inc(stage='patient')
+        return {
+            'patient_id': pid,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }
+
+chunked_uploads = ChunkedUploads(chunked_upload_folder(), score_patient)
+
+@app.route("/predict/uploads", methods=["POST"])
+def create_chunked_upload():
+    """Starts a resumable cohort ZIP upload: {filename, size, chunk_size}. Patients are scored while it arrives."""
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = chunked_uploads.create(data.get("filename", "upload.zip"), int(data["size"]), data.get("chunk_size"))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid upload request: {e}"}), 400
+    return jsonify(upload.status()), 201
+
+@app.route("/predict/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def put_upload_chunk(upload_id, index):
+    upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Unknown upload"}), 404
+    if upload.state["status"] != "receiving" and index not in upload.state["received"]:
+        return jsonify({"error": f"Upload is {upload.state['status']}"}), 409
+    try:
+        upload.write_chunk(index, request.get_data(), request.headers.get("X-Chunk-SHA256"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    status = upload.status()
+    return jsonify({key: status[key] for key in ("upload_id", "received_chunks", "num_chunks", "status")})
+
+@app.route("/predict/uploads/<upload_id>", methods=["GET", "DELETE"])
+def chunked_upload_status(upload_id):
+    if request.method == "DELETE":
+        upload = chunked_uploads.delete(upload_id)
+    else:
+        upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Unknown upload"}), 404
+    return jsonify(upload.status())
 
 @app.route("/upload", methods=["POST"])
 def upload_file():
@@ -126,19 +267,36 @@ def upload_file():
     if len(files) < 2:
         return jsonify({"error": "Please upload both .hea and .dat files"}), 400
 
-    file_paths = {}
-    for file in files:
-        file_ext = file.filename.split(".")[-1]
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(file_path)
-        file_paths[file_ext] = file_path
+    with get_store().open_session() as session:
+        try:
+            file_paths = {}
+            for file in files:
+                file_ext = file.filename.split(".")[-1]
+                file_paths[file_ext] = session.add(file.filename, file.stream)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if "hea" not in file_paths or "mat" not in file_paths:
+            return jsonify({"error": "Both .hea and .mat files are required"}), 400
 
-    if "hea" not in file_paths or "mat" not in file_paths:
-        return jsonify({"error": "Both .hea and .mat files are required"}), 400
+        return read_uploaded_record(file_paths)
 
+def read_uploaded_record(file_paths):
+    """Returns the uploaded record (or the requested segment of it) as the /upload JSON response."""
     try:
         record_name = file_paths["hea"].replace(".hea", "")
-        record = wfdb.rdrecord(record_name)
+
+        # Preview of a segment: only the requested samples are read from the signal file.
+        if "start" in request.form or "duration" in request.form:
+            header = read_header(record_name)
+            fs = header["fs"]
+            start = max(0, int(float(request.form.get("start", 0)) * fs))
+            stop = start + int(float(request.form.get("duration", 10)) * fs)
+            signal = read_samples(record_name, start, stop, header=header).tolist()
+            return jsonify({"fs": fs, "start": start, "eeg_data": signal})
+
+        with time_stage("record_decode"):
+            record = wfdb.rdrecord(record_name)
         signal = record.p_signal.tolist()
         fs = record.fs  # Sampling frequency
 
@@ -147,6 +305,119 @@ def upload_file():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+def admin_profile():
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            session = profiling.start_session(
+                data.get("mode", "cprofile"), PROFILE_FOLDER,
+                max_requests=data.get("requests"), seconds=data.get("seconds"),
+                interval=data.get("interval", 0.005))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(session.status())
+
+    if request.method == "DELETE":
+        session = profiling.stop_session()
+        if session is None:
+            return jsonify({"error": "No profiling session active"}), 404
+        return jsonify(session.status())
+
+    session = profiling.current_session or profiling.last_session
+    if session is None:
+        return jsonify({"error": "No profiling session has been started"}), 404
+    return jsonify(session.status())
+
+@app.route("/admin/profile/artifacts/<path:name>", methods=["GET"])
+def admin_profile_artifact(name):
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+    return send_from_directory(os.path.abspath(PROFILE_FOLDER), name, as_attachment=True)
+
+@app.route("/live/sessions", methods=["POST"])
+def create_live_session():
+    data = request.get_json(silent=True) or {}
+    try:
+        sampling_rate = float(data["sampling_rate"])
+        num_channels = int(data["num_channels"]) if "num_channels" in data else len(data["channels"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "sampling_rate and num_channels (or channels) are required"}), 400
+    if sampling_rate <= 0 or num_channels <= 0:
+        return jsonify({"error": "sampling_rate and num_channels must be positive"}), 400
+    try:
+        session = live_sessions.create(sampling_rate, num_channels, data.get("patient_id"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(session.status()), 201
+
+@app.route("/live/sessions/<session_id>", methods=["GET", "DELETE"])
+def live_session(session_id):
+    if request.method == "DELETE":
+        session = live_sessions.close(session_id)
+    else:
+        session = live_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown live session"}), 404
+    return jsonify(session.status())
+
+@app.route("/live/sessions/<session_id>/chunks", methods=["POST"])
+def live_chunk(session_id):
+    """Feeds samples to a live session. Raw float32 bodies may be streamed (chunked transfer encoding) for as
+    long as the recording runs; they are processed as they arrive."""
+    session = live_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown live session"}), 404
+
+    submitted = 0
+    try:
+        if request.mimetype == "application/json":
+            submitted += session.feed(parse_samples(request.get_data(), request.mimetype, session.num_channels),
+                                      live_sessions.scorer)
+        else:
+            frame_bytes = 4 * session.num_channels
+            pending = b""
+            while True:
+                data = request.stream.read(LIVE_READ_BYTES)
+                if not data:
+                    break
+                pending += data
+                whole = len(pending) - len(pending) % frame_bytes
+                if whole:
+                    submitted += session.feed(parse_samples(pending[:whole], request.mimetype, session.num_channels),
+                                              live_sessions.scorer)
+                    pending = pending[whole:]
+            if pending:
+                raise ValueError(f"Body ends with a partial frame of {len(pending)} bytes")
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    status = session.status()
+    status["windows_submitted_by_chunk"] = submitted
+    return jsonify(status)
+
+@app.route("/live/sessions/<session_id>/events", methods=["GET"])
+def live_events(session_id):
+    session = live_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown live session"}), 404
+    # ?after= wins over the Last-Event-ID header that EventSource sends when it reconnects
+    try:
+        after = int(request.args.get("after", request.headers.get("Last-Event-ID", 0)))
+    except ValueError:
+        return jsonify({"error": "after and Last-Event-ID must be event numbers"}), 400
+    return Response(event_stream(session, after), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/infer", methods=["POST"])
 def infer():
     try:
@@ -161,4 +432,4 @@ def infer():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=DEBUG, port=PORT)
\ No newline at end of file
@@ -0,0 +1,159 @@
+from fractions import Fraction
+import numpy as np
+from scipy import signal
+
+# Streaming counterpart of preprocess.preprocess_eeg_signal for live EEG arriving in chunks of any length.
+#
+# Differences from the offline pipeline, which sees the whole recording at once:
+#   - resampling uses the polyphase FIR filter of scipy.signal.resample_poly instead of FFT resampling, with a
+#     latency of 10 * max(up, down) upsampled samples (20 ms for 500 -> 100 Hz);
+#   - NaN/inf samples are replaced by the channel's last valid value (0 before any) instead of interpolated;
+#   - min/max normalization uses the running min/max of the filtered signal seen so far.
+# The band-pass filter is the same Butterworth filter with its state carried across chunks, so the filtered signals
+# differ only by the resampler. Measured on synthetic 19-channel records at 250, 256 and 500 Hz (tests/test_streaming.py):
+#   - filtered output (normalize=False) is within 0.5% of each channel's standard deviation of the offline pipeline,
+#     except in the first second and the last two, where FFT resampling wraps the recording around (up to 40% / 1.5%);
+#   - normalized with the recording-wide min/max, outputs after the first second agree to within 0.006;
+#   - with running min/max, outputs differ by a rescaling until the running extremes reach the recording's (~0.02
+#     after ten minutes on the synthetic records).
+
+OUTPUT_BLOCK = 4096  # output samples computed per step, bounds the temporaries for long chunks
+MAX_RATE_FACTOR = 1024  # largest up or down factor accepted; the filter has 20 * max(up, down) + 1 taps
+
+
+class StreamingResampler:
+    """Polyphase FIR resampler (the filter scipy.signal.resample_poly designs) that carries input history across chunks.
+
+    Concatenating the outputs of process() for consecutive chunks and flush() gives resample_poly's output for the
+    concatenated input. When the rates are equal (up == down == 1) chunks pass through unchanged, as in resample_poly.
+    """
+
+    def __init__(self, sampling_rate, target_fs, num_channels):
+        source_fs = Fraction(sampling_rate).limit_denominator(1000)
+        if source_fs <= 0:
+            raise ValueError(f"Unsupported sampling rate {sampling_rate}")
+        ratio = Fraction(target_fs) / source_fs
+        self.up, self.down = ratio.numerator, ratio.denominator
+        if max(self.up, self.down) > MAX_RATE_FACTOR:
+            # e.g. 250.001 Hz would need up/down = 100000/250001 and a filter of millions of taps
+            raise ValueError(f"Unsupported sampling rate {sampling_rate}: resampling it to {target_fs} Hz needs "
+                             f"factors {self.up}/{self.down}; round it to a whole number of Hz")
+        self.passthrough = self.up == self.down == 1
+        max_rate = max(self.up, self.down)
+        self.half_len = 0 if self.passthrough else 10 * max_rate
+        if self.passthrough:
+            self.taps = np.ones(1)
+        else:
+            # firwin rejects the cutoff 1.0 of the equal-rate case
+            taps = signal.firwin(2 * self.half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * self.up
+            self.taps = np.zeros(-(-len(taps) // self.up) * self.up)
+            self.taps[:len(taps)] = taps
+        self.taps_per_phase = len(self.taps) // self.up
+        self.num_channels = num_channels
+        self.history = np.zeros((0, num_channels))
+        self.history_start = 0  # input index of history[0]
+        self.samples_in = 0
+        self.samples_out = 0
+
+    @property
+    def latency(self):
+        """Input samples that must arrive after a sample before the output covering it can be emitted."""
+        return -(-self.half_len // self.up)
+
+    def process(self, chunk):
+        if self.passthrough:
+            self.samples_in += len(chunk)
+            self.samples_out = self.samples_in
+            return np.array(chunk, dtype=np.float64)
+        self.history = np.concatenate((self.history, np.asarray(chunk, dtype=np.float64)))
+        self.samples_in += len(chunk)
+        # Output m needs input (m * down + half_len) // up, so everything before that index must have arrived.
+        ready = -(-(self.samples_in * self.up - self.half_len) // self.down)
+        return self._emit(max(self.samples_out, ready))
+
+    def flush(self):
+        """Emits the outputs that depend on samples past the end of the input, treating those as zeros."""
+        return self._emit(-(-self.samples_in * self.up // self.down))
+
+    def _emit(self, stop):
+        blocks = []
+        phases = np.arange(self.taps_per_phase)
+        for start in range(self.samples_out, stop, OUTPUT_BLOCK):
+            positions = np.arange(start, min(start + OUTPUT_BLOCK, stop)) * self.down + self.half_len
+            newest = positions // self.up
+            indices = newest[:, None] - phases[None, :]
+            taps = self.taps[(positions % self.up)[:, None] + self.up * phases[None, :]]
+            valid = (indices >= self.history_start) & (indices < self.samples_in)
+            taps = np.where(valid, taps, 0.0)
+            samples = self.history[np.clip(indices - self.history_start, 0, max(len(self.history) - 1, 0))]
+            blocks.append(np.einsum('mt,mtc->mc', taps, samples))
+        self.samples_out = max(self.samples_out, stop)
+        # Keep only the input still needed by the next output.
+        keep_from = (self.samples_out * self.down + self.half_len) // self.up - (self.taps_per_phase - 1)
+        drop = min(max(0, keep_from - self.history_start), len(self.history))
+        self.history = self.history[drop:]
+        self.history_start += drop
+        if not blocks:
+            return np.zeros((0, self.num_channels))
+        return np.concatenate(blocks)
+
+
+class StreamingPreprocessor:
+    """Stateful preprocessing of live EEG: chunks in at the native rate, normalized target_fs samples out.
+
+    Memory is bounded by the resampler history and the filter state, independent of how long the stream runs.
+    """
+
+    def __init__(self, sampling_rate, num_channels, target_fs=100, target_channels=19, lowcut=0.5, highcut=40,
+                 normalize=True):
+        self.sampling_rate = sampling_rate
+        self.normalize = normalize
+        self.target_fs = target_fs
+        self.target_channels = target_channels
+        self.num_channels = min(num_channels, target_channels)
+        self.resampler = StreamingResampler(sampling_rate, target_fs, self.num_channels)
+        nyq = 0.5 * target_fs
+        self.b, self.a = signal.butter(5, [lowcut / nyq, highcut / nyq], btype="band")
+        self.zi = np.zeros((max(len(self.a), len(self.b)) - 1, self.num_channels))
+        self.last_valid = np.zeros(self.num_channels)
+        self.signal_min = np.full(self.num_channels, np.inf)
+        self.signal_max = np.full(self.num_channels, -np.inf)
+
+    def process(self, chunk):
+        """Takes (n_samples, n_channels) samples at sampling_rate; returns the (m, target_channels) samples now ready."""
+        chunk = np.array(chunk[:, :self.num_channels], dtype=np.float64)
+        self._hold_invalid(chunk)
+        return self._finish(self.resampler.process(chunk))
+
+    def flush(self):
+        """Emits the samples held back by the resampler at the end of the stream."""
+        return self._finish(self.resampler.flush())
+
+    def _hold_invalid(self, chunk):
+        invalid = ~np.isfinite(chunk)
+        if invalid.any():
+            for channel in np.flatnonzero(invalid.any(axis=0)):
+                column = chunk[:, channel]
+                valid = ~invalid[:, channel]
+                # Index of the last valid sample at or before each position; -1 where there is none yet.
+                last = np.maximum.accumulate(np.where(valid, np.arange(len(column)), -1))
+                column[:] = np.where(last >= 0, column[np.maximum(last, 0)], self.last_valid[channel])
+        if len(chunk):
+            self.last_valid = chunk[-1].copy()
+
+    def _finish(self, resampled):
+        if not len(resampled):
+            # lfilter returns an undefined final state for empty input, so leave the state alone.
+            return np.zeros((0, self.target_channels), dtype=np.float32)
+        filtered, self.zi = signal.lfilter(self.b, self.a, resampled, axis=0, zi=self.zi)
+        if len(filtered):
+            self.signal_min = np.minimum(self.signal_min, filtered.min(axis=0))
+            self.signal_max = np.maximum(self.signal_max, filtered.max(axis=0))
+        out = np.zeros((len(filtered), self.target_channels), dtype=np.float32)
+        if not self.normalize:
+            out[:, :self.num_channels] = filtered
+            return out
+        denom = self.signal_max - self.signal_min
+        denom[denom == 0] = 1
+        out[:, :self.num_channels] = (filtered - self.signal_min) / denom * 2 - 1
+        return out
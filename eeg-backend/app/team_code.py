@@ -11,16 +11,35 @@
 
 from helper_code import *
 import numpy as np, os, sys
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import mne
 from sklearn.impute import SimpleImputer
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
 import joblib
-from preprocess import preprocess_for_inference
-from scipy.stats import kurtosis
+from preprocess import preprocess_for_inference, read_for_inference
+from scipy.stats import kurtosis, t as student_t
 from antropy import perm_entropy, petrosian_fd
 import pandas as pd
 import torch
 from model import CombinedModel, resnet_config, transformer_config
+from precision import inference_context
+from metrics import REGISTRY, time_stage, RECORDINGS, FAILURES
+from tracing import span
+from buffer_pool import POOL
+from config import PARALLEL_BRANCHES, BRANCH_THREADS, PREFETCH_RECORDINGS, CASCADE_THRESHOLD
+from config import ADAPTIVE_TOLERANCE, ADAPTIVE_BATCH, ADAPTIVE_MIN_WINDOWS, ADAPTIVE_CONFIDENCE
+
+CASCADE_RECORDINGS = REGISTRY.counter(
+    'brainwave_cascade_recordings_total', 'Recordings scored in cascade mode, by whether the DL model ran.',
+    labelnames=('path',))
+ADAPTIVE_WINDOWS = REGISTRY.counter(
+    'brainwave_adaptive_windows_total', 'Recording windows of adaptively scored patients, by whether they were scored.',
+    labelnames=('state',))
+
+# Windows scored by the last run_challenge_models call on this thread: windows_used and windows_total.
+scoring_info = threading.local()
 
 ################################################################################
 #
@@ -123,26 +142,101 @@ def load_challenge_models(model_folder, verbose):
 # Run your trained models. This function is *required*. You should edit this function to add your code, but do *not* change the
 # arguments of this function.
 def run_challenge_models(models, data_folder, patient_id, verbose):
+    dl_model = models['dl_model']
+
+    # Extract features. In the parallel mode the DL forward passes run on the branch pool while the features and the
+    # forests below are computed here, and are only joined for the fusion. In cascade mode they are deferred until the
+    # forests have scored each recording; models['cascade_threshold'], if present, overrides CASCADE_THRESHOLD.
+    cascade_threshold = models.get('cascade_threshold', CASCADE_THRESHOLD)
+    cascade = cascade_threshold is not None and dl_model is not None
+    executor = get_branch_executor() if PARALLEL_BRANCHES and dl_model is not None and not cascade else None
+    cascade_threshold = cascade_threshold if cascade else None
+
+    # In adaptive mode (models['adaptive_tolerance'] overrides ADAPTIVE_TOLERANCE) the recordings are scored in batches
+    # until the patient's mean probability is stable; see score_adaptively.
+    adaptive_tolerance = models.get('adaptive_tolerance', ADAPTIVE_TOLERANCE)
+    if adaptive_tolerance is not None:
+        _, recording_ids = load_patient_data(data_folder, patient_id)
+        if recording_ids:
+            return score_adaptively(models, data_folder, patient_id, recording_ids, adaptive_tolerance, executor,
+                                    cascade_threshold, verbose)
+
+    features, dl_outcome_probs = get_features(data_folder, patient_id, dl_model, executor=executor, defer_dl=cascade)
+    scoring_info.windows_used = scoring_info.windows_total = len(dl_outcome_probs)
+    scores = _score_batch(models, features, dl_outcome_probs, cascade_threshold)
+    return _decide_patient(scores, verbose)
+
+def score_adaptively(models, data_folder, patient_id, recording_ids, tolerance, executor=None, cascade_threshold=None,
+                     verbose=0):
+    """Scores a patient's recordings in batches, most recent first, and stops once the decision is stable.
+
+    After each batch of ADAPTIVE_BATCH recordings, and once at least ADAPTIVE_MIN_WINDOWS were scored, scoring stops if
+    the ADAPTIVE_CONFIDENCE Student t interval of the mean fused probability has a half-width of at most tolerance, or
+    clears 0.5 by at least tolerance. A tolerance of 0 scores every recording. Every recording is scored independently
+    and the scores are put back in recording order, so a run that uses all of them returns exactly what the
+    non-adaptive mode returns.
+    """
+    ordered_ids = list(reversed(recording_ids))
+    batch_size = max(1, ADAPTIVE_BATCH)
+    scores = None
+    used = 0
+    while used < len(ordered_ids):
+        batch = ordered_ids[used:used + batch_size]
+        used += len(batch)
+        features, dl_outcome_probs = get_features(data_folder, patient_id, models['dl_model'], executor=executor,
+                                                  defer_dl=cascade_threshold is not None, recording_ids=batch)
+        batch_scores = _score_batch(models, features, dl_outcome_probs, cascade_threshold)
+        scores = batch_scores if scores is None else {
+            key: np.concatenate([scores[key], batch_scores[key]]) for key in scores}
+
+        final_prob = scores['final_prob']
+        n = len(final_prob)
+        if tolerance <= 0 or n < max(2, ADAPTIVE_MIN_WINDOWS) or used == len(ordered_ids):
+            continue
+        mean = float(np.mean(final_prob))
+        quantile = student_t.ppf(0.5 + ADAPTIVE_CONFIDENCE / 2, n - 1)
+        half_width = quantile * float(np.std(final_prob, ddof=1)) / np.sqrt(n)
+        if verbose:
+            print(f'Adaptive scoring: {used}/{len(ordered_ids)} recordings, mean {mean:.4f} +/- {half_width:.4f}')
+        if half_width <= tolerance or abs(mean - 0.5) - half_width >= tolerance:
+            break
+
+    # Back to recording order, so the means below add up in the same order as in the non-adaptive mode
+    scores = {key: value[::-1] for key, value in scores.items()}
+
+    scoring_info.windows_used = used
+    scoring_info.windows_total = len(ordered_ids)
+    ADAPTIVE_WINDOWS.inc(used, state='scored')
+    ADAPTIVE_WINDOWS.inc(len(ordered_ids) - used, state='skipped')
+    if verbose:
+        print(f'Adaptive scoring used {used} of {len(ordered_ids)} recordings')
+    return _decide_patient(scores, verbose)
+
+def _score_batch(models, features, dl_outcome_probs, cascade_threshold):
+    """Runs the forests on a batch of recordings and joins the DL branch; pending forward passes are discarded on error."""
+    try:
+        return _fuse_recordings(models, features, dl_outcome_probs, cascade_threshold)
+    finally:
+        for prob in dl_outcome_probs:
+            if isinstance(prob, DeferredForward):
+                prob.discard()
+
+def _fuse_recordings(models, features, dl_outcome_probs, cascade_threshold):
+    """Runs the forests on the recordings' features and fuses them with the DL outcome probabilities, per recording."""
     imputer = models['imputer']
     outcome_model = models['outcome_model']
     cpc_model = models['cpc_model']
     scaler = models['scaler']
-    dl_model = models['dl_model']
 
-    # Extract features
-    features, dl_outcome_probs = get_features(data_folder, patient_id, dl_model)
-    
-    # Convert dl_outcome_probs from array of arrays to simple array
-    dl_outcome_probs = np.array([float(prob[0]) for prob in dl_outcome_probs])
-    
-    # Impute and scale
-    features = imputer.transform(features)
-    features = scaler.transform(features)
+    with time_stage('ml_predict'):
+        # Impute and scale
+        features = imputer.transform(features)
+        features = scaler.transform(features)
 
-    # ML predictions
-    outcome = outcome_model.predict(features)
-    outcome_probability = outcome_model.predict_proba(features)
-    cpc = cpc_model.predict(features)
+        # ML predictions
+        outcome = outcome_model.predict(features)
+        outcome_probability = outcome_model.predict_proba(features)
+        cpc = cpc_model.predict(features)
 
     # Adjust CPC
     cpc = np.clip(cpc + 1, 1, 5)
@@ -150,6 +244,20 @@ def run_challenge_models(models, data_folder, patient_id, verbose):
     # Select positive class probabilities
     ml_positive_probs = outcome_probability[:, 1]
 
+    # Join the DL branch and convert dl_outcome_probs from array of arrays to simple array. In cascade mode, recordings
+    # the forests are confident about skip the DL model and take the ML probability, which the fusion below then returns
+    # unchanged.
+    if cascade_threshold is not None:
+        for i, prob in enumerate(dl_outcome_probs):
+            if isinstance(prob, DeferredForward) and abs(ml_positive_probs[i] - 0.5) >= cascade_threshold:
+                prob.discard()
+                dl_outcome_probs[i] = np.array([ml_positive_probs[i]])
+                CASCADE_RECORDINGS.inc(path='ml_only')
+            elif isinstance(prob, DeferredForward):
+                CASCADE_RECORDINGS.inc(path='dl')
+    dl_outcome_probs = [prob.result() if isinstance(prob, (Future, DeferredForward)) else prob for prob in dl_outcome_probs]
+    dl_outcome_probs = np.array([float(prob[0]) for prob in dl_outcome_probs])
+
     # Confidence
     confidence_ml = abs(ml_positive_probs - 0.5)
     confidence_dl = abs(dl_outcome_probs - 0.5)
@@ -160,7 +268,19 @@ def run_challenge_models(models, data_folder, patient_id, verbose):
 
     # Final combined probability (element-wise operation)
     final_prob = weight_ml * ml_positive_probs + weight_dl * dl_outcome_probs
-    
+
+    return {'ml_positive_probs': ml_positive_probs, 'dl_outcome_probs': dl_outcome_probs, 'confidence_ml': confidence_ml,
+            'confidence_dl': confidence_dl, 'final_prob': final_prob, 'cpc': cpc}
+
+def _decide_patient(scores, verbose):
+    """Combines the per-recording scores into the patient's outcome, outcome probability and CPC."""
+    ml_positive_probs = scores['ml_positive_probs']
+    dl_outcome_probs = scores['dl_outcome_probs']
+    confidence_ml = scores['confidence_ml']
+    confidence_dl = scores['confidence_dl']
+    final_prob = scores['final_prob']
+    cpc = scores['cpc']
+
     # Get scalar values from arrays
     final_prob_scalar = float(np.mean(final_prob))
     
@@ -211,10 +331,12 @@ def get_dl_outcome_prob(eeg_data_window, dl_model):
     dl_model.eval()
     with torch.no_grad():
         try:
-            dl_data = torch.tensor(eeg_data_window, dtype=torch.float32)
-            dl_data = dl_data.unsqueeze(0)  # Add batch dimension
-            dl_output = dl_model(dl_data)
-            dl_outcome_prob = torch.sigmoid(dl_output).numpy()
+            with POOL.borrow((1,) + eeg_data_window.shape, np.float32) as batch:
+                batch[0] = eeg_data_window  # Add batch dimension
+                dl_data = torch.from_numpy(batch)
+                with time_stage('dl_forward'), inference_context():
+                    dl_output = dl_model(dl_data)
+            dl_outcome_prob = torch.sigmoid(dl_output.float()).numpy()
             
             # Ensure we return a single scalar value
             if isinstance(dl_outcome_prob, np.ndarray) and dl_outcome_prob.size > 0:
@@ -222,8 +344,76 @@ def get_dl_outcome_prob(eeg_data_window, dl_model):
             return np.array([0.5])  # Default fallback value
         except Exception as e:
             print(f"Error in DL prediction: {e}")
+            FAILURES.inc(stage='dl_forward')
             return np.array([0.5])
 
+_branch_executor = None
+_branch_executor_lock = threading.Lock()
+
+def get_branch_executor():
+    """The process-wide thread pool the DL branch runs on; torch and sklearn release the GIL in their kernels."""
+    global _branch_executor
+    with _branch_executor_lock:
+        if _branch_executor is None:
+            _branch_executor = ThreadPoolExecutor(max_workers=BRANCH_THREADS, thread_name_prefix='branch')
+        return _branch_executor
+
+def prefetch_recordings(record_paths, depth=PREFETCH_RECORDINGS):
+    """Yields (record_path, raw) in order, where raw is a Future of read_for_inference(record_path, pool=POOL).
+
+    Each call has its own reader thread, so patients scored concurrently (request threads, upload jobs) do not queue
+    behind each other's reads. At most depth recordings beyond the current one are read ahead, which bounds the decoded
+    samples held in memory. Recordings read ahead but never consumed are given back to the pool.
+    """
+    if depth <= 0:
+        for record_path in record_paths:
+            yield record_path, None
+        return
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+    pending = []
+    next_index = 0
+    try:
+        for record_path in record_paths:
+            while next_index < len(record_paths) and len(pending) <= depth:
+                pending.append(executor.submit(contextvars.copy_context().run, read_for_inference,
+                                               record_paths[next_index], pool=POOL))
+                next_index += 1
+            yield record_path, pending.pop(0)
+    finally:
+        for future in pending:
+            future.add_done_callback(_release_prefetched)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _release_prefetched(future):
+    # Only float32 reads come from the pool; the float64 pipeline reads into a plain array
+    if not future.cancelled() and future.exception() is None and future.result()[0].dtype == np.float32:
+        POOL.release(future.result()[0])
+
+class DeferredForward:
+    """A DL forward pass that only runs if its result is asked for; the pooled window is given back either way."""
+    def __init__(self, eeg_data_window, dl_model):
+        self.eeg_data_window = eeg_data_window
+        self.dl_model = dl_model
+        self.value = None
+
+    def result(self):
+        if self.eeg_data_window is not None:
+            window, self.eeg_data_window = self.eeg_data_window, None
+            self.value = _dl_outcome_prob_task(window, self.dl_model)
+        return self.value
+
+    def discard(self):
+        if self.eeg_data_window is not None:
+            POOL.release(self.eeg_data_window)
+            self.eeg_data_window = None
+
+def _dl_outcome_prob_task(eeg_data_window, dl_model):
+    """Runs get_dl_outcome_prob on the branch pool and gives the pooled window back afterwards."""
+    try:
+        return get_dl_outcome_prob(eeg_data_window.T, dl_model)
+    finally:
+        POOL.release(eeg_data_window)
+
 def load_patient_data(data_folder, patient_id):
     patient_metadata = load_challenge_data(data_folder, patient_id)
     recording_ids = find_recording_files(data_folder, patient_id)
@@ -233,19 +423,39 @@ def extract_patient_features(patient_metadata):
     patient_features, patient_features_names = get_patient_features(patient_metadata)
     return patient_features, patient_features_names
 
-def process_single_recording(record_path, sampling_frequency, patient_features, dl_model=None):
-    """Process a single EEG recording"""
+def process_single_recording(record_path, sampling_frequency, patient_features, dl_model=None, executor=None, raw=None,
+                             defer_dl=False):
+    """Process a single EEG recording
+
+    With an executor, the DL forward pass is submitted to it and the returned outcome probability is a Future; with
+    defer_dl it is a DeferredForward that runs only when asked. raw is a Future of the recording's read_for_inference
+    output when it was read ahead (see prefetch_recordings).
+    """
     try:
-        eeg_data, eeg_data_window = preprocess_for_inference(record_path, sampling_frequency, window_size=180)
-        
-        # Get DL model outcome probability
-        if dl_model is not None:
-            dl_outcome_prob = get_dl_outcome_prob(eeg_data_window.T, dl_model)
-        else:
-            dl_outcome_prob = np.array([0.5])  # Default probability if no model
-        
-        # Get EEG features
-        eeg_features, eeg_feature_names = get_eeg_features(eeg_data)
+        if raw is not None:
+            raw = raw.result()
+        eeg_data, eeg_data_window = preprocess_for_inference(record_path, sampling_frequency, window_size=180, pool=POOL,
+                                                             raw=raw)
+        try:
+            # Get DL model outcome probability
+            if dl_model is not None and defer_dl:
+                dl_outcome_prob = DeferredForward(eeg_data_window, dl_model)
+                eeg_data_window = None  # released by the DeferredForward
+            elif dl_model is not None and executor is not None:
+                window, eeg_data_window = eeg_data_window, None  # released by the task
+                dl_outcome_prob = executor.submit(contextvars.copy_context().run, _dl_outcome_prob_task, window, dl_model)
+            elif dl_model is not None:
+                dl_outcome_prob = get_dl_outcome_prob(eeg_data_window.T, dl_model)
+            else:
+                dl_outcome_prob = np.array([0.5])  # Default probability if no model
+
+            # Get EEG features
+            with time_stage('feature_extraction'):
+                eeg_features, eeg_feature_names = get_eeg_features(eeg_data)
+        finally:
+            POOL.release(eeg_data)
+            if eeg_data_window is not None:
+                POOL.release(eeg_data_window)
         
         # Combine features
         combined_features = eeg_features + patient_features
@@ -254,16 +464,23 @@ def process_single_recording(record_path, sampling_frequency, patient_features,
     
     except Exception as e:
         print(f"Error in processing recording {record_path}: {e}")
+        FAILURES.inc(stage='recording')
         # Return default features in case of error
         eeg_feature_names = ["mean", "std", "var", "rms", "kurtosis", "power", "psd", "pfd", "pe"]
         eeg_features = [0.0] * len(eeg_feature_names)
         combined_features = eeg_features + patient_features
         return combined_features, eeg_feature_names, np.array([0.5])
 
-def get_features(data_folder, patient_id, dl_model=None):
-    """Extract features from patient data and EEG recordings"""
+def get_features(data_folder, patient_id, dl_model=None, executor=None, defer_dl=False, recording_ids=None):
+    """Extract features from patient data and EEG recordings
+
+    With an executor or defer_dl, the DL outcome probabilities are returned as Futures or DeferredForwards (see
+    process_single_recording). recording_ids restricts extraction to those recordings.
+    """
     # Load data
-    patient_metadata, recording_ids = load_patient_data(data_folder, patient_id)
+    patient_metadata, all_recording_ids = load_patient_data(data_folder, patient_id)
+    if recording_ids is None:
+        recording_ids = all_recording_ids
     patient_features, patient_features_names = extract_patient_features(patient_metadata)
 
     dl_outcome_probs = []
@@ -284,14 +501,16 @@ def get_features(data_folder, patient_id, dl_model=None):
             full_feature_names = default_eeg_feature_names + patient_features_names
             dl_outcome_probs.append(np.array([0.5]))
     
-    for recording_id in recording_ids:
+    record_paths = [os.path.join(data_folder, patient_id, recording_id) for recording_id in recording_ids]
+    for recording_id, (record_path, raw) in zip(recording_ids, prefetch_recordings(record_paths)):
         print(f'Extracting features from {recording_id}...')
-        record_path = os.path.join(data_folder, patient_id, recording_id)
+        RECORDINGS.inc()
 
         try:
-            combined_features, eeg_feature_names, dl_outcome_prob = process_single_recording(
-                record_path, sampling_frequency, patient_features, dl_model
-            )
+            with span('recording', recording_id=recording_id):
+                combined_features, eeg_feature_names, dl_outcome_prob = process_single_recording(
+                    record_path, sampling_frequency, patient_features, dl_model, executor, raw, defer_dl
+                )
             
             dl_outcome_probs.append(dl_outcome_prob)
             
@@ -369,8 +588,9 @@ def get_eeg_features(eeg_windows):
     power = np.mean(eeg_windows ** 2, axis=(1, 2))
     psd_approx = vars_
 
-    pfd_vals = np.array([petrosian_fd(window.reshape(-1)) for window in eeg_windows])
-    pe_vals = np.array([perm_entropy(window.reshape(-1), normalize=True) for window in eeg_windows])
+    with span('antropy'):
+        pfd_vals = np.array([petrosian_fd(window.reshape(-1)) for window in eeg_windows])
+        pe_vals = np.array([perm_entropy(window.reshape(-1), normalize=True) for window in eeg_windows])
 
     # No need for a loop if just 1 window
     feature_list = [
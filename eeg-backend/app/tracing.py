@@ -0,0 +1,142 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+# Per-request tracing. A trace is only active inside start_trace(); everywhere else span() returns a shared no-op, so
+# instrumented code pays one context-variable lookup when tracing is off.
+
+_current_trace = contextvars.ContextVar('brainwave_trace', default=None)
+_current_span = contextvars.ContextVar('brainwave_span', default=None)
+
+
+class Trace:
+    """Spans recorded for one request, exportable as Chrome trace events (chrome://tracing, Perfetto)."""
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []
+
+    def to_chrome(self):
+        events = []
+        for span in self.spans:
+            args = dict(span['attrs'])
+            args.update(trace_id=self.trace_id, span_id=span['span_id'], parent_span_id=span['parent_span_id'])
+            events.append({
+                'name': span['name'],
+                'cat': 'brainwave',
+                'ph': 'X',
+                'ts': round((span['start'] - self.start) * 1e6, 3),
+                'dur': round(span['duration'] * 1e6, 3),
+                'pid': os.getpid(),
+                'tid': span['thread'],
+                'args': args,
+            })
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'trace_id': self.trace_id, 'name': self.name, 'start_unix': self.wall_start},
+        }
+
+    def to_tree(self):
+        """Spans nested under their parents, with times in milliseconds, for returning inline in a response."""
+        nodes = {}
+        roots = []
+        for span in sorted(self.spans, key=lambda s: s['start']):
+            nodes[span['span_id']] = {
+                'name': span['name'],
+                'start_ms': round((span['start'] - self.start) * 1e3, 3),
+                'duration_ms': round(span['duration'] * 1e3, 3),
+                'attrs': span['attrs'],
+                'children': [],
+            }
+        for span in sorted(self.spans, key=lambda s: s['start']):
+            parent = nodes.get(span['parent_span_id'])
+            (parent['children'] if parent is not None else roots).append(nodes[span['span_id']])
+        return roots
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.wall_start))}-{self.trace_id}.json")
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome(), f)
+        return path
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'attrs', 'span_id', 'parent_span_id', 'start', 'token')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = _current_span.get()
+        self.token = _current_span.set(self.span_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self.token)
+        attrs = self.attrs
+        if exc_type is not None:
+            attrs = dict(attrs, error=f'{exc_type.__name__}: {exc}')
+        self.trace.spans.append({
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'start': self.start,
+            'duration': duration,
+            'thread': threading.get_ident(),
+            'attrs': attrs,
+        })
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def is_active():
+    return _current_trace.get() is not None
+
+
+def span(name, **attrs):
+    """Records a span in the active trace; a no-op when no trace is active."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, attrs)
+
+
+class start_trace:
+    """Activates a new trace for the enclosed block (and the threads it hands a copied context to)."""
+    def __init__(self, name, **attrs):
+        self.trace = Trace(name)
+        self.root = _Span(self.trace, name, attrs)
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        self.root.__enter__()
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self.root.__exit__(exc_type, exc, tb)
+        _current_trace.reset(self.token)
+        return False
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from werkzeug.utils import secure_filename
+from config import UPLOAD_FOLDER, UPLOAD_TTL_SECONDS, UPLOAD_QUOTA_BYTES
+from metrics import REGISTRY, CACHE_HITS, CACHE_MISSES
+
+# Uploaded files stored by content: objects/<sha[:2]>/<sha256>. Each request works in its own session folder of hard
+# links named after the client's filenames, so concurrent uploads of the same filename never collide, and identical
+# uploads are stored once. Objects referenced by an open session are never evicted; unreferenced ones are removed
+# once unused for longer than the TTL, or oldest first while the store is over its disk quota. The index is SQLite,
+# shared by every worker process on the node.
+
+UPLOAD_STORE_BYTES = REGISTRY.gauge('brainwave_upload_store_bytes', 'Bytes of uploaded files held in the upload store.')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (sha TEXT PRIMARY KEY, size INTEGER, last_used REAL);
+CREATE TABLE IF NOT EXISTS refs (session_id TEXT, sha TEXT, created REAL);
+CREATE INDEX IF NOT EXISTS refs_sha ON refs (sha);
+"""
+
+COPY_BLOCK_BYTES = 1 << 20
+
+
+class UploadSession:
+    """Files of one request, linked under their client filenames in a private folder; close() releases them."""
+
+    def __init__(self, store):
+        self.store = store
+        self.session_id = uuid.uuid4().hex
+        self.folder = os.path.join(store.folder, 'sessions', self.session_id)
+        os.makedirs(self.folder)
+
+    def add(self, filename, stream):
+        """Stores the stream's bytes and returns the path of the session's copy named after filename.
+
+        Names are not sanitized into something else: a header refers to its signal files by name, so a renamed file
+        would silently break the record. Names secure_filename would change are rejected instead.
+        """
+        name = filename or ''
+        if not name or secure_filename(name) != name:
+            raise ValueError(f"Invalid upload filename '{filename}'")
+        object_path = self.store.put(stream, self.session_id)
+        path = os.path.join(self.folder, name)
+        try:
+            os.link(object_path, path)
+        except OSError:
+            shutil.copyfile(object_path, path)
+        return path
+
+    def close(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.store.release(self.session_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class UploadStore:
+    def __init__(self, folder, ttl=UPLOAD_TTL_SECONDS, quota_bytes=UPLOAD_QUOTA_BYTES):
+        self.folder = os.path.abspath(folder)
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        for sub in ('objects', 'sessions', 'tmp'):
+            os.makedirs(os.path.join(self.folder, sub), exist_ok=True)
+        self.db_path = os.path.join(self.folder, 'index.sqlite')
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        conn.close()
+
+    def _connect(self):
+        # Autocommit mode; writers take the database lock explicitly with BEGIN IMMEDIATE.
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def object_path(self, sha):
+        return os.path.join(self.folder, 'objects', sha[:2], sha)
+
+    def put(self, stream, session_id):
+        """Writes a stream into the store, referenced by session_id, and returns the object's path."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.folder, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in iter(lambda: stream.read(COPY_BLOCK_BYTES), b''):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            sha = digest.hexdigest()
+            path = self.object_path(sha)
+            conn = self._connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('INSERT INTO refs VALUES (?, ?, ?)', (session_id, sha, time.time()))
+                if conn.execute('SELECT 1 FROM objects WHERE sha = ?', (sha,)).fetchone() and os.path.exists(path):
+                    CACHE_HITS.inc(cache='upload_store')
+                else:
+                    CACHE_MISSES.inc(cache='upload_store')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                conn.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?)', (sha, size, time.time()))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.close()
+            return path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def open_session(self):
+        return UploadSession(self)
+
+    def release(self, session_id):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM refs WHERE session_id = ?', (session_id,))
+        finally:
+            conn.close()
+        self.evict()
+
+    def evict(self):
+        """Removes unreferenced objects past the TTL, then the least recently used ones while over quota."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # References of sessions that never closed (e.g. a killed worker) expire with the TTL too.
+            conn.execute('DELETE FROM refs WHERE created < ?', (now - self.ttl,))
+            candidates = conn.execute(
+                'SELECT sha, size, last_used FROM objects WHERE sha NOT IN (SELECT sha FROM refs) '
+                'ORDER BY last_used').fetchall()
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+            for sha, size, last_used in candidates:
+                if last_used >= now - self.ttl and total <= self.quota_bytes:
+                    break
+                # Unlink while holding the write lock so a concurrent put() cannot dedupe against this file.
+                conn.execute('DELETE FROM objects WHERE sha = ?', (sha,))
+                try:
+                    os.remove(self.object_path(sha))
+                except FileNotFoundError:
+                    pass
+                total -= size
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        UPLOAD_STORE_BYTES.set(total)
+        self._remove_stale_sessions(now)
+
+    def _remove_stale_sessions(self, now):
+        sessions_folder = os.path.join(self.folder, 'sessions')
+        with os.scandir(sessions_folder) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.stat().st_mtime < now - self.ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    def usage(self):
+        conn = self._connect()
+        try:
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+        finally:
+            conn.close()
+        return {'objects': count, 'bytes': total, 'quota_bytes': self.quota_bytes, 'ttl_seconds': self.ttl}
+
+
+_store = None
+
+
+def get_store():
+    """The process-wide store under UPLOAD_FOLDER, created on first use."""
+    global _store
+    if _store is None:
+        _store = UploadStore(UPLOAD_FOLDER)
+    return _store
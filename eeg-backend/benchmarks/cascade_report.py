@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Compute savings and decision changes of the confidence cascade (CASCADE_THRESHOLD in app/config.py) on a validation
+# cohort. Every patient is scored once with both models on every recording and once per threshold in cascade mode:
+#
+#   python benchmarks/cascade_report.py --data validation_folder --model model_folder --thresholds 0.1 0.2 0.3
+#
+# Without --data/--model a synthetic cohort and synthetic models are used. For each threshold the report gives the share
+# of recordings that skipped the DL model, the wall time against the full run, how many patient decisions and how much
+# of the fused probability changed, and the accuracy of both runs when the cohort has outcome labels.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCHMARK_DIR, '..', 'app'))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic
+
+
+def score_cohort(models, data_folder, patient_ids, threshold):
+    """Runs every patient with the given cascade threshold (None for both models); returns outputs and counters."""
+    import team_code
+
+    models = dict(models, cascade_threshold=threshold)
+    dl_before = team_code.CASCADE_RECORDINGS.value(path='dl')
+    skipped_before = team_code.CASCADE_RECORDINGS.value(path='ml_only')
+    recordings_before = team_code.RECORDINGS.value()
+    outputs = {}
+    start = time.perf_counter()
+    for patient_id in patient_ids:
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs[patient_id] = team_code.run_challenge_models(models, data_folder, patient_id, 0)
+    seconds = time.perf_counter() - start
+    recordings = team_code.RECORDINGS.value() - recordings_before
+    skipped = team_code.CASCADE_RECORDINGS.value(path='ml_only') - skipped_before
+    dl_runs = team_code.CASCADE_RECORDINGS.value(path='dl') - dl_before if threshold is not None else recordings
+    return outputs, {'seconds': seconds, 'recordings': recordings, 'dl_forwards': dl_runs, 'dl_skipped': skipped}
+
+
+def labels_for(data_folder, patient_ids):
+    from helper_code import load_challenge_data, get_outcome
+    labels = {}
+    for patient_id in patient_ids:
+        try:
+            labels[patient_id] = get_outcome(load_challenge_data(data_folder, patient_id))
+        except ValueError:
+            return None
+    return labels
+
+
+def accuracy(outputs, labels):
+    if labels is None:
+        return None
+    return float(np.mean([int(outputs[pid][0]) == labels[pid] for pid in outputs]))
+
+
+def compare(full, cascade):
+    changed = [pid for pid in full if int(full[pid][0]) != int(cascade[pid][0])]
+    prob_diff = np.array([abs(full[pid][1] - cascade[pid][1]) for pid in full])
+    return {
+        'decisions_changed': len(changed),
+        'changed_patients': changed,
+        'max_probability_change': float(prob_diff.max()),
+        'mean_probability_change': float(prob_diff.mean()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the compute savings and decision changes of the cascade mode.')
+    parser.add_argument('--data', help='validation cohort folder (default: a synthetic cohort)')
+    parser.add_argument('--model', help='model folder (default: synthetic models)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.1, 0.2, 0.3])
+    parser.add_argument('--patients', type=int, default=8, help='patients in the synthetic cohort')
+    parser.add_argument('--recordings', type=int, default=2, help='recordings per synthetic patient')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_folder = args.data
+        if data_folder is None:
+            data_folder = os.path.join(work_dir, 'cohort')
+            synthetic.write_cohort(data_folder, num_patients=args.patients, num_recordings=args.recordings, duration=700)
+        model_folder = args.model
+        if model_folder is None:
+            model_folder = synthetic.write_model_folder(os.path.join(work_dir, 'model'),
+                                                        os.path.join(APP_DIR, 'model', 'dl_model.pth'))
+        data_folder = os.path.abspath(data_folder)
+        model_folder = os.path.abspath(model_folder)
+        os.chdir(APP_DIR)  # preprocessing writes its temporary files relative to the app folder
+
+        from helper_code import find_data_folders
+        from team_code import load_challenge_models
+        models = load_challenge_models(model_folder, verbose=0)
+        patient_ids = find_data_folders(data_folder)
+        labels = labels_for(data_folder, patient_ids)
+
+        score_cohort(models, data_folder, patient_ids[:1], None)  # warm-up
+        full, full_stats = score_cohort(models, data_folder, patient_ids, None)
+        report = {'patients': len(patient_ids), 'full': dict(full_stats, accuracy=accuracy(full, labels)), 'cascade': {}}
+        for threshold in args.thresholds:
+            outputs, stats = score_cohort(models, data_folder, patient_ids, threshold)
+            report['cascade'][str(threshold)] = dict(
+                stats, accuracy=accuracy(outputs, labels), speedup=full_stats['seconds'] / stats['seconds'],
+                **compare(full, outputs))
+
+    print(f"{len(patient_ids)} patients, {full_stats['recordings']} recordings; "
+          f"both models: {full_stats['seconds']:.2f} s, accuracy {report['full']['accuracy']}")
+    print(f"{'threshold':>9s} {'DL skipped':>11s} {'seconds':>8s} {'speedup':>8s} {'changed':>8s} {'max dp':>7s} {'accuracy':>9s}")
+    for threshold, row in report['cascade'].items():
+        skipped = row['dl_skipped'] / row['recordings'] if row['recordings'] else 0.0
+        acc = f"{row['accuracy']:.3f}" if row['accuracy'] is not None else '-'
+        print(f"{threshold:>9s} {skipped:11.1%} {row['seconds']:8.2f} {row['speedup']:8.2f} "
+              f"{row['decisions_changed']:8d} {row['max_probability_change']:7.3f} {acc:>9s}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# Load test for the Flask service. Starts app/server.py locally with synthetic models, replays a mix of synthetic
+# cohort ZIPs (/predict) and .hea/.mat pairs (/upload) against it and reports latency percentiles, throughput, error
+# rate and the server's peak RSS for every phase:
+#
+#   python benchmarks/load_test.py --concurrency 4 --duration 60 --mix predict=1 upload=3 [--rate 2] [--output load.json]
+#
+# Each endpoint in the mix is first driven on its own, then all together. Without --rate the test is closed-loop (every
+# worker sends its next request as soon as the previous one returns); with --rate requests arrive as a Poisson process
+# at that many requests per second and are served by at most --concurrency workers.
+
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCHMARK_DIR, '..', 'app'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic
+
+
+def read_rss(pid):
+    """Resident set size of a process in bytes, from /proc (Linux only); None where unavailable."""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssMonitor(threading.Thread):
+    """Samples a process's RSS in the background and keeps the peak seen since the last reset."""
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def reset(self):
+        self.peak = read_rss(self.pid) or 0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = read_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def build_workload(work_dir, fs, duration):
+    """Synthetic request payloads: cohort ZIPs of one and two patients, and single-record upload pairs."""
+    payloads = {'predict': [], 'upload': []}
+    for num_patients in (1, 2):
+        cohort_folder = os.path.join(work_dir, f'cohort_{num_patients}')
+        synthetic.write_cohort(cohort_folder, num_patients=num_patients, fs=fs, duration=duration, seed=num_patients)
+        payloads['predict'].append(synthetic.zip_cohort(cohort_folder))
+    for i in range(2):
+        record_path = synthetic.write_record(os.path.join(work_dir, 'uploads'), f'{8000 + i:04d}_001_012_EEG',
+                                             fs=fs, duration=duration, seed=i)
+        with open(record_path + '.hea', 'rb') as f:
+            header = f.read()
+        with open(record_path + '.mat', 'rb') as f:
+            signal = f.read()
+        payloads['upload'].append((os.path.basename(record_path), header, signal))
+    return payloads
+
+
+def send_request(session, base_url, endpoint, payloads):
+    if endpoint == 'predict':
+        zip_bytes = random.choice(payloads['predict'])
+        response = session.post(f'{base_url}/predict', files={'file': ('cohort.zip', zip_bytes)})
+    else:
+        record_name, header, signal = random.choice(payloads['upload'])
+        response = session.post(f'{base_url}/upload', files=[
+            ('files', (record_name + '.hea', header)),
+            ('files', (record_name + '.mat', signal)),
+        ])
+    return response.status_code < 400
+
+
+def run_phase(base_url, mix, payloads, concurrency, duration, rate, monitor):
+    """Drives the server for duration seconds and returns per-endpoint latencies and error counts."""
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    samples = {e: [] for e in endpoints}
+    errors = {e: 0 for e in endpoints}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    arrivals = queue.Queue()
+
+    def worker():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            # Open-loop latencies count from the scheduled arrival, so time spent queued behind busy workers is
+            # included rather than omitted
+            if rate:
+                try:
+                    endpoint, start = arrivals.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            else:
+                endpoint = random.choices(endpoints, weights)[0]
+                start = time.perf_counter()
+            try:
+                ok = send_request(session, base_url, endpoint, payloads)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[endpoint].append(elapsed)
+                if not ok:
+                    errors[endpoint] += 1
+
+    monitor.reset()
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if rate:
+        arrival = time.perf_counter()
+        while time.monotonic() < deadline:
+            arrivals.put((random.choices(endpoints, weights)[0], arrival))
+            arrival += random.expovariate(rate)
+            time.sleep(max(0.0, arrival - time.perf_counter()))
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    report = {}
+    for endpoint in endpoints:
+        latencies = np.array(samples[endpoint]) if samples[endpoint] else np.array([np.nan])
+        count = len(samples[endpoint])
+        report[endpoint] = {
+            'requests': count,
+            'throughput_rps': count / elapsed,
+            'error_rate': errors[endpoint] / count if count else 0.0,
+            'p50_s': float(np.percentile(latencies, 50)),
+            'p95_s': float(np.percentile(latencies, 95)),
+            'p99_s': float(np.percentile(latencies, 99)),
+        }
+    report['peak_rss_bytes'] = monitor.peak
+    report['backlog'] = arrivals.qsize()  # open-loop arrivals that were never served
+    return report
+
+
+def start_server(port, model_folder):
+    # The result cache would answer every repeated /predict payload without running the models
+    env = dict(os.environ, BRAINWAVE_PORT=str(port), BRAINWAVE_DEBUG='0', BRAINWAVE_MODEL_FOLDER=model_folder,
+               BRAINWAVE_RESULT_CACHE_SIZE='0')
+    process = subprocess.Popen([sys.executable, 'server.py'], cwd=APP_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server.py exited with code {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError('server.py did not start listening within 120 s')
+
+
+def parse_mix(values):
+    mix = {}
+    for value in values:
+        endpoint, weight = value.split('=')
+        if endpoint not in ('predict', 'upload'):
+            raise ValueError(f"Unknown endpoint '{endpoint}' in --mix; use predict and/or upload")
+        mix[endpoint] = float(weight)
+    return mix
+
+
+def print_report(phases):
+    print(f"{'phase':12s} {'endpoint':10s} {'reqs':>6s} {'rps':>7s} {'err%':>6s} {'p50':>7s} {'p95':>7s} {'p99':>7s} {'peakRSS MB':>11s}")
+    for phase, report in phases.items():
+        for endpoint, stats in report.items():
+            if not isinstance(stats, dict):
+                continue
+            print(f"{phase:12s} {endpoint:10s} {stats['requests']:6d} {stats['throughput_rps']:7.2f} "
+                  f"{100 * stats['error_rate']:6.1f} {stats['p50_s']:7.3f} {stats['p95_s']:7.3f} {stats['p99_s']:7.3f} "
+                  f"{report['peak_rss_bytes'] / 2**20:11.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the Flask service with synthetic uploads.')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help='open-loop arrival rate in requests/s (0: closed loop)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per phase')
+    parser.add_argument('--mix', nargs='+', default=['predict=1', 'upload=3'], help='endpoint=weight pairs')
+    parser.add_argument('--record-duration', type=float, default=620, help='synthetic recording length in seconds')
+    parser.add_argument('--fs', type=int, default=500)
+    parser.add_argument('--port', type=int, default=5051)
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        payloads = build_workload(work_dir, args.fs, args.record_duration)
+        model_folder = synthetic.write_model_folder(os.path.join(work_dir, 'model'),
+                                                    os.path.join(APP_DIR, 'model', 'dl_model.pth'))
+        server = start_server(args.port, model_folder)
+        monitor = RssMonitor(server.pid)
+        monitor.start()
+        base_url = f'http://127.0.0.1:{args.port}'
+        try:
+            phases = {}
+            for endpoint in mix:
+                phases[endpoint] = run_phase(base_url, {endpoint: 1}, payloads, args.concurrency, args.duration,
+                                             args.rate, monitor)
+            if len(mix) > 1:
+                phases['mixed'] = run_phase(base_url, mix, payloads, args.concurrency, args.duration, args.rate, monitor)
+        finally:
+            monitor.stop()
+            server.terminate()
+            server.wait()
+
+    print_report(phases)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'phases': phases}, f, indent=2)
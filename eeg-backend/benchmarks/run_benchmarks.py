@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# Benchmarks for the inference pipeline on synthetic data. Run it from anywhere:
+#
+#   python benchmarks/run_benchmarks.py --output results.json [--compare previous.json]
+#
+# Every stage is timed `--repeat` times; the JSON holds min/median/mean seconds per stage plus enough metadata (commit,
+# library versions, CPU count) to compare runs across commits.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCHMARK_DIR, '..', 'app'))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic
+
+
+def time_call(fn, repeat):
+    """Calls fn repeat times and returns timing statistics in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min': float(np.min(timings)),
+        'median': float(np.median(timings)),
+        'mean': float(np.mean(timings)),
+        'repeat': repeat,
+    }
+
+
+def bench_preprocessing(record_path, repeat):
+    import preprocess
+
+    results = {}
+    results['read_eeg_for_inference'] = time_call(lambda: preprocess.read_eeg_for_inference(record_path), repeat)
+    raw_signal, raw_fs = preprocess.read_eeg_for_inference(record_path)
+    target_fs = 100
+
+    # The steps of preprocess.preprocess_eeg_signal, timed one at a time on the output of the previous step.
+    steps = [
+        ('limit_recording_duration', lambda x: preprocess.limit_recording_duration(x, raw_fs, max_duration=40*60)),
+        ('resample', lambda x: preprocess.signal.resample(x, int(x.shape[0] * (target_fs / raw_fs)), axis=0)),
+        ('remove_nan_values', lambda x: preprocess.remove_nan_values(x, method="interpolate")),
+        ('apply_filtering', lambda x: preprocess.apply_filtering(x, target_fs)),
+        ('normalize_eeg_voltages', lambda x: preprocess.normalize_eeg_voltages(x)),
+        ('standardize', lambda x: preprocess.standardize(x, target_channels=19)),
+    ]
+    eeg_signal = raw_signal
+    for name, step in steps:
+        source = eeg_signal
+        results[f'preprocess.{name}'] = time_call(lambda: step(source.copy()), repeat)
+        eeg_signal = step(source.copy())
+
+    results['preprocess_eeg_signal'] = time_call(
+        lambda: preprocess.preprocess_eeg_signal(raw_signal.copy(), raw_fs, target_fs), repeat)
+    results['preprocess_for_inference'] = time_call(
+        lambda: preprocess.preprocess_for_inference(record_path, target_fs, window_size=180), repeat)
+    return results
+
+
+def bench_record_loader(record_path, repeat):
+    import helper_code
+
+    return {
+        'load_recording_data': time_call(lambda: helper_code.load_recording_data(record_path), repeat),
+        'load_recording_data.check_values': time_call(
+            lambda: helper_code.load_recording_data(record_path, check_values=True), repeat),
+    }
+
+
+def bench_features(record_path, repeat):
+    import preprocess
+    from team_code import get_eeg_features
+
+    eeg_data, _ = preprocess.preprocess_for_inference(record_path, 100, window_size=180)
+    return {'get_eeg_features': time_call(lambda: get_eeg_features(eeg_data), repeat)}
+
+
+def bench_dl_model(dl_model_path, batch_sizes, repeat):
+    import torch
+    from model import CombinedModel, resnet_config, transformer_config
+    from precision import inference_context
+
+    model = CombinedModel(resnet_config, transformer_config)
+    model.load_state_dict(torch.load(dl_model_path, map_location=torch.device('cpu')))
+    model.eval()
+
+    results = {}
+    for precision in ('fp32', 'bf16'):
+        for batch_size in batch_sizes:
+            inputs = torch.rand(batch_size, 19, 2000) * 2 - 1
+
+            def forward():
+                with torch.no_grad(), inference_context('cpu', precision):
+                    model(inputs)
+
+            forward()  # warm-up
+            results[f'combined_model.{precision}.batch_{batch_size}'] = time_call(forward, repeat)
+    return results
+
+
+def bench_ml_models(models, repeat):
+    features = np.random.default_rng(0).standard_normal((1, 17))
+    features = models['scaler'].transform(models['imputer'].transform(features))
+    return {
+        'random_forest.outcome_predict_proba': time_call(lambda: models['outcome_model'].predict_proba(features), repeat),
+        'random_forest.cpc_predict': time_call(lambda: models['cpc_model'].predict(features), repeat),
+    }
+
+
+def bench_predict_endpoint(cohort_zip, model_folder, repeat):
+    import io
+    os.chdir(APP_DIR)  # server.py resolves its model and upload paths relative to the app folder
+    import server
+
+    server.MODEL_FOLDER = model_folder
+    server._models_loaded = False
+    client = server.app.test_client()
+
+    def predict(cached=False):
+        if not cached:
+            server.RESULT_CACHE.clear()
+        response = client.post('/predict', data={'file': (io.BytesIO(cohort_zip), 'cohort.zip')},
+                               content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f'/predict returned {response.status_code}: {response.get_data(as_text=True)}')
+
+    predict()  # warm-up, also loads the models
+    return {
+        'endpoint./predict': time_call(predict, repeat),
+        'endpoint./predict.cached': time_call(lambda: predict(cached=True), repeat),
+    }
+
+
+def run_metadata():
+    import torch, scipy, sklearn
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARK_DIR, text=True).strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'torch': torch.__version__,
+        'sklearn': sklearn.__version__,
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+    }
+
+
+def compare_results(current, previous):
+    """Prints median timings of both runs and their ratio for every stage present in both."""
+    print(f"{'stage':55s} {'previous':>10s} {'current':>10s} {'ratio':>7s}")
+    for name, stats in current['results'].items():
+        if name in previous['results']:
+            before = previous['results'][name]['median']
+            print(f"{name:55s} {before:10.4f} {stats['median']:10.4f} {stats['median'] / before:7.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the EEG inference pipeline on synthetic data.')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=620, help='synthetic recording length in seconds')
+    parser.add_argument('--fs', type=int, default=500, help='synthetic recording sampling frequency')
+    parser.add_argument('--patients', type=int, default=2, help='patients in the /predict cohort')
+    parser.add_argument('--loader-hours', type=float, default=2, help='length of the record for the loader benchmark')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)  # the /predict benchmark changes into the app folder
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    from team_code import load_challenge_models
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        record_path = synthetic.write_record(os.path.join(work_dir, 'record'), '9999_001_012_EEG',
+                                             fs=args.fs, duration=args.duration)
+        model_folder = synthetic.write_model_folder(os.path.join(work_dir, 'model'),
+                                                    os.path.join(APP_DIR, 'model', 'dl_model.pth'))
+        long_record_path = synthetic.write_record(os.path.join(work_dir, 'record'), '9999_002_014_EEG',
+                                                  fs=args.fs, duration=args.loader_hours * 3600)
+        cohort_folder = os.path.join(work_dir, 'cohort')
+        synthetic.write_cohort(cohort_folder, num_patients=args.patients, fs=args.fs, duration=args.duration)
+        cohort_zip = synthetic.zip_cohort(cohort_folder)
+        models = load_challenge_models(model_folder, verbose=0)
+
+        results.update(bench_preprocessing(record_path, args.repeat))
+        results.update(bench_record_loader(long_record_path, args.repeat))
+        results.update(bench_features(record_path, args.repeat))
+        results.update(bench_dl_model(os.path.join(model_folder, 'dl_model.pth'), args.batch_sizes, args.repeat))
+        results.update(bench_ml_models(models, args.repeat))
+        results.update(bench_predict_endpoint(cohort_zip, model_folder, max(1, args.repeat // 2)))
+
+    report = {'meta': run_metadata(), 'config': vars(args), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {len(results)} benchmark results to {args.output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(report, json.load(f))
@@ -0,0 +1,144 @@
+"""Synthetic I-CARE style records and cohorts, so benchmarks and load tests run without PhysioNet data.
+
+Records are written the way the Challenge distributes them: a WFDB header plus a MATLAB v4 `.mat` signal file whose
+`val` matrix holds 16-bit ADC values (format 16 with a 24-byte byte offset).
+"""
+
+import io
+import os
+import zipfile
+import numpy as np
+
+EEG_CHANNELS = ['Fp1', 'Fp2', 'F3', 'F4', 'C3', 'C4', 'P3', 'P4', 'O1', 'O2',
+                'F7', 'F8', 'T3', 'T4', 'T5', 'T6', 'Fz', 'Cz', 'Pz']
+
+
+def synthetic_signal(num_samples, num_channels, fs, rng):
+    """Alpha/delta rhythms with per-channel phase plus white noise, in microvolts; shape (num_samples, num_channels)."""
+    t = np.arange(num_samples) / fs
+    signal = np.empty((num_samples, num_channels), dtype=np.float64)
+    for i in range(num_channels):
+        phase = rng.uniform(0, 2 * np.pi)
+        signal[:, i] = (20 * np.sin(2 * np.pi * 10 * t + phase)
+                        + 35 * np.sin(2 * np.pi * 2 * t + phase / 2)
+                        + 8 * rng.standard_normal(num_samples))
+    return signal
+
+
+def write_mat_v4(path, digital):
+    """Writes an (num_channels, num_samples) int16 matrix named `val` as a MATLAB v4 file (24-byte header)."""
+    num_channels, num_samples = digital.shape
+    header = np.array([30, num_channels, num_samples, 0, 4], dtype='<i4')  # MOPT 30: little-endian int16 matrix
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(b'val\x00')
+        f.write(np.asarray(digital, dtype='<i2').T.tobytes())  # column-major, i.e. interleaved samples
+
+
+def write_record(folder, record_name, num_channels=19, fs=500, duration=620, seed=0, channels=None):
+    """Writes <record_name>.hea/.mat into folder and returns the record path (without extension)."""
+    rng = np.random.default_rng(seed)
+    num_samples = int(fs * duration)
+    channels = channels or (EEG_CHANNELS * (num_channels // len(EEG_CHANNELS) + 1))[:num_channels]
+
+    physical = synthetic_signal(num_samples, num_channels, fs, rng)
+    gains = rng.uniform(50, 300, num_channels)
+    baselines = rng.integers(-2000, 2000, num_channels)
+    digital = np.clip(np.round(physical * gains + baselines), -32767, 32767).astype(np.int16).T
+
+    os.makedirs(folder, exist_ok=True)
+    write_mat_v4(os.path.join(folder, record_name + '.mat'), digital)
+
+    lines = [f'{record_name} {num_channels} {fs} {num_samples}']
+    for i, channel in enumerate(channels):
+        checksum = int(np.sum(digital[i], dtype=np.int16))
+        lines.append(f'{record_name}.mat 16+24 {float(gains[i])!r}({baselines[i]})/uV 16 0 {digital[i, 0]} {checksum} 0 {channel}')
+    end_seconds = int(duration)
+    lines.append('#Utility frequency: 50')
+    lines.append('#Start time: 0:00:00')
+    lines.append(f'#End time: {end_seconds // 3600}:{end_seconds // 60 % 60:02d}:{end_seconds % 60:02d}')
+    with open(os.path.join(folder, record_name + '.hea'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return os.path.join(folder, record_name)
+
+
+def write_patient(root_folder, patient_id, num_recordings=1, outcome=None, seed=0, **record_kwargs):
+    """Writes a patient folder with metadata, RECORDS and num_recordings EEG recordings."""
+    rng = np.random.default_rng(seed)
+    if outcome is None:
+        outcome = 'Good' if rng.uniform() < 0.5 else 'Poor'
+    cpc = int(rng.integers(1, 3)) if outcome == 'Good' else int(rng.integers(3, 6))
+    folder = os.path.join(root_folder, patient_id)
+    os.makedirs(folder, exist_ok=True)
+
+    metadata = [
+        f'Patient: {patient_id}',
+        'Hospital: A',
+        f'Age: {int(rng.integers(20, 90))}',
+        f"Sex: {'Male' if rng.uniform() < 0.5 else 'Female'}",
+        f'ROSC: {int(rng.integers(5, 60))}',
+        f'OHCA: {rng.uniform() < 0.7}',
+        f'Shockable Rhythm: {rng.uniform() < 0.4}',
+        f'TTM: {33 if rng.uniform() < 0.5 else 36}',
+        f'Outcome: {outcome}',
+        f'CPC: {cpc}',
+    ]
+    with open(os.path.join(folder, patient_id + '.txt'), 'w') as f:
+        f.write('\n'.join(metadata) + '\n')
+
+    record_names = []
+    for i in range(num_recordings):
+        record_name = f'{patient_id}_{i + 1:03d}_{12 + i:03d}_EEG'
+        write_record(folder, record_name, seed=seed * 1000 + i, **record_kwargs)
+        record_names.append(record_name)
+    with open(os.path.join(folder, 'RECORDS'), 'w') as f:
+        f.write('\n'.join(record_names) + '\n')
+    return folder
+
+
+def write_cohort(root_folder, num_patients=2, num_recordings=1, seed=0, **record_kwargs):
+    """Writes num_patients patient folders (alternating outcomes) and returns their ids."""
+    patient_ids = []
+    for i in range(num_patients):
+        patient_id = f'{9000 + i:04d}'
+        outcome = 'Good' if i % 2 == 0 else 'Poor'
+        write_patient(root_folder, patient_id, num_recordings, outcome, seed=seed + i, **record_kwargs)
+        patient_ids.append(patient_id)
+    return patient_ids
+
+
+def zip_cohort(root_folder, zip_path=None):
+    """Zips a cohort folder the way clinicians upload it to /predict; returns the path or, without one, the bytes."""
+    buffer = io.BytesIO() if zip_path is None else zip_path
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for folder, _, files in os.walk(root_folder):
+            for file_name in sorted(files):
+                path = os.path.join(folder, file_name)
+                zf.write(path, os.path.relpath(path, root_folder))
+    return buffer.getvalue() if zip_path is None else zip_path
+
+
+def write_model_folder(model_folder, dl_model_path, num_features=17, seed=0):
+    """Writes a model folder load_challenge_models accepts: random-fit ML models next to a copy of the DL weights."""
+    import shutil
+    import joblib
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+    rng = np.random.default_rng(seed)
+    features = rng.standard_normal((200, num_features))
+    outcomes = rng.integers(0, 2, 200)
+    cpcs = rng.integers(0, 5, 200)
+
+    imputer = SimpleImputer().fit(features)
+    scaler = StandardScaler().fit(imputer.transform(features))
+    features = scaler.transform(imputer.transform(features))
+    outcome_model = RandomForestClassifier(n_estimators=123, max_leaf_nodes=456, random_state=789).fit(features, outcomes)
+    cpc_model = RandomForestRegressor(n_estimators=123, max_leaf_nodes=456, random_state=789).fit(features, cpcs)
+
+    os.makedirs(model_folder, exist_ok=True)
+    joblib.dump({'imputer': imputer, 'scaler': scaler, 'outcome_model': outcome_model, 'cpc_model': cpc_model},
+                os.path.join(model_folder, 'ml_models.sav'))
+    shutil.copyfile(dl_model_path, os.path.join(model_folder, 'dl_model.pth'))
+    return model_folder
@@ -0,0 +1,60 @@
+import io
+import os
+import sys
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, '..', 'app')
+sys.path.insert(0, app_dir)
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+import team_code
+from helper_code import find_data_folders
+
+DL_MODEL_PATH = os.path.join(app_dir, 'model', 'dl_model.pth')
+
+
+def write_fixture(folder, num_patients=2, num_recordings=6):
+    data_folder = os.path.join(folder, 'cohort')
+    synthetic.write_cohort(data_folder, num_patients=num_patients, num_recordings=num_recordings, duration=700)
+    model_folder = synthetic.write_model_folder(os.path.join(folder, 'model'), DL_MODEL_PATH)
+    return data_folder, model_folder
+
+
+def test_zero_tolerance_scores_every_recording():
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder, model_folder = write_fixture(folder)
+        models = team_code.load_challenge_models(model_folder, verbose=0)
+        batch_size = team_code.ADAPTIVE_BATCH
+        team_code.ADAPTIVE_BATCH = 4  # two batches for six recordings
+        try:
+            for patient_id in find_data_folders(data_folder):
+                expected = team_code.run_challenge_models(models, data_folder, patient_id, 0)
+                adaptive = team_code.run_challenge_models(dict(models, adaptive_tolerance=0.0), data_folder,
+                                                          patient_id, 0)
+                assert adaptive == expected
+                assert team_code.scoring_info.windows_used == team_code.scoring_info.windows_total == 6
+        finally:
+            team_code.ADAPTIVE_BATCH = batch_size
+
+
+def test_predict_reports_windows():
+    import server
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder, model_folder = write_fixture(folder, num_patients=1, num_recordings=2)
+        server.MODEL_FOLDER = model_folder
+        server._models_loaded = False
+        client = server.app.test_client()
+        upload = (io.BytesIO(synthetic.zip_cohort(data_folder)), 'cohort.zip')
+        response = client.post('/predict', data={'file': upload}, content_type='multipart/form-data')
+        assert response.status_code == 200
+        (result,) = response.get_json()['patients']
+        assert 'error' not in result
+        assert result['windows_used'] == result['windows_total'] == 2
+
+
+if __name__ == '__main__':
+    test_zero_tolerance_scores_every_recording()
+    test_predict_reports_windows()
+    print("OK")
@@ -0,0 +1,89 @@
+import os
+import sys
+from concurrent.futures import Future
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+
+from buffer_pool import BufferPool, POOL
+
+
+def test_released_buffers_are_reused():
+    pool = BufferPool(max_idle_bytes=1 << 30)
+    first = pool.acquire((1000, 19))
+    assert first.shape == (1000, 19) and first.dtype == np.float32
+    pool.release(first)
+    assert pool.in_use_bytes == 0 and pool.idle_bytes > 0
+
+    # Similar lengths round up to the same capacity and get the same buffer back
+    second = pool.acquire((990, 19))
+    assert second.shape == (990, 19) and np.shares_memory(first, second)
+    assert pool.idle_bytes == 0
+    # A different dtype or channel count does not
+    other = pool.acquire((990, 19), np.float64)
+    narrow = pool.acquire((990, 18))
+    assert not np.shares_memory(second, other) and not np.shares_memory(second, narrow)
+    for array in (second, other, narrow):
+        pool.release(array)
+    assert pool.in_use_bytes == 0
+
+
+def test_views_are_released_through_their_base():
+    pool = BufferPool(max_idle_bytes=1 << 30)
+    array = pool.acquire((1000, 19))
+    pool.release(array[100:200, :3].T)
+    assert pool.in_use_bytes == 0
+    with pool.borrow((1000, 19)) as borrowed:
+        assert np.shares_memory(borrowed, array)
+    assert pool.in_use_bytes == 0
+
+
+def test_foreign_arrays_are_rejected():
+    pool = BufferPool(max_idle_bytes=1 << 30)
+    for array in (np.zeros((1000, 19), dtype=np.float32), np.zeros((1000, 19))[:10], POOL.acquire((10, 19))):
+        try:
+            pool.release(array)
+        except ValueError:
+            continue
+        raise AssertionError('released an array the pool did not hand out')
+    POOL.release(array)
+    assert pool.idle_bytes == 0
+
+
+def test_idle_bytes_are_capped():
+    buffer_bytes = 1024 * 19 * 4
+    pool = BufferPool(max_idle_bytes=2 * buffer_bytes)
+    arrays = [pool.acquire((1024, 19)) for _ in range(3)]
+    assert pool.in_use_bytes == 3 * buffer_bytes
+    for array in arrays:
+        pool.release(array)
+    # The oldest idle buffer is dropped once the idle ones exceed the cap
+    assert pool.idle_bytes == 2 * buffer_bytes
+    assert not any(np.shares_memory(arrays[0], pool.acquire((1024, 19))) for _ in range(2))
+    assert pool.high_water_bytes == 3 * buffer_bytes
+    pool.clear()
+    assert pool.idle_bytes == 0
+
+
+def test_unconsumed_float64_prefetch_is_not_released():
+    from team_code import _release_prefetched
+    # The float64 pipeline reads into plain arrays, which must not be handed to the pool
+    future = Future()
+    future.set_result((np.zeros((1000, 19)), 500.0))
+    _release_prefetched(future)
+
+    future = Future()
+    future.set_result((POOL.acquire((1000, 19)), 500.0))
+    in_use = POOL.in_use_bytes
+    _release_prefetched(future)
+    assert POOL.in_use_bytes < in_use
+
+
+if __name__ == '__main__':
+    test_released_buffers_are_reused()
+    test_views_are_released_through_their_base()
+    test_foreign_arrays_are_rejected()
+    test_idle_bytes_are_capped()
+    test_unconsumed_float64_prefetch_is_not_released()
+    print("OK")
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from catalog import Catalog
+
+
+def rewrite_in_place(path, old, new):
+    """Edits a file without touching its folder's mtime, like an editor saving over it."""
+    folder_stat = os.stat(os.path.dirname(path))
+    with open(path, 'r') as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.replace(old, new))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    os.utime(os.path.dirname(path), ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+
+
+def test_refresh_tracks_added_and_removed_patients():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, 'cohort')
+        synthetic.write_cohort(root, num_patients=2, duration=60)
+        catalog = Catalog(root, os.path.join(folder, 'catalog.sqlite'))
+        assert catalog.refresh() == 2
+        assert catalog.patient_ids() == ['9000', '9001']
+        assert catalog.refresh() == 0
+
+        synthetic.write_patient(root, '9002', 2, 'Poor', duration=60)
+        shutil.rmtree(os.path.join(root, '9000'))
+        assert catalog.refresh() == 1
+        assert catalog.patient_ids() == ['9001', '9002']
+        assert len(catalog.recording_names('9002')) == 2
+
+        reloaded = Catalog(root, os.path.join(folder, 'catalog.sqlite'))
+        assert reloaded.patient_ids() == ['9001', '9002']
+        assert reloaded.refresh() == 0
+
+
+def test_deep_refresh_sees_files_rewritten_in_place():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, 'cohort')
+        synthetic.write_cohort(root, num_patients=1, duration=60)
+        catalog = Catalog(root)
+        catalog.refresh()
+        assert catalog.outcome('9000') == 'Good'
+
+        # A shallow refresh only stats the patient folders, whose mtimes an in-place edit leaves alone
+        rewrite_in_place(os.path.join(root, '9000', '9000.txt'), 'Outcome: Good', 'Outcome: Poor')
+        assert catalog.refresh() == 0
+        assert catalog.outcome('9000') == 'Good'
+        assert catalog.refresh(deep=True) == 1
+        assert catalog.outcome('9000') == 'Poor'
+
+        record_name = catalog.recording_names('9000')[0]
+        num_samples = catalog.recording('9000', record_name)['num_samples']
+        header_path = os.path.join(root, '9000', record_name + '.hea')
+        with open(header_path, 'r') as f:
+            record_line = f.readline().strip()
+        rewrite_in_place(header_path, record_line, record_line.rsplit(' ', 1)[0] + f' {num_samples // 2}')
+        assert catalog.refresh(deep=True) == 1
+        assert catalog.recording('9000', record_name)['num_samples'] == num_samples // 2
+
+
+if __name__ == '__main__':
+    test_refresh_tracks_added_and_removed_patients()
+    test_deep_refresh_sees_files_rewritten_in_place()
+    print("OK")
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from chunked_upload import ChunkedUploads
+
+
+class FakeScorer:
+    """Stands in for server.score_patient: records which patients were scored, optionally blocking until released."""
+
+    def __init__(self, block=False):
+        self.calls = []
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, data_root, patient_id):
+        self.release.wait(timeout=30)
+        records = sorted(name for name in os.listdir(os.path.join(data_root, patient_id)) if name.endswith('.hea'))
+        self.calls.append(patient_id)
+        return {'patient_id': patient_id, 'recordings': len(records)}
+
+
+def cohort_zip(folder, num_patients=2):
+    root = os.path.join(folder, 'cohort')
+    synthetic.write_cohort(root, num_patients=num_patients, num_recordings=2, duration=30)
+    return synthetic.zip_cohort(root)
+
+
+def chunks_of(data, chunk_size):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def send(upload, index, chunk):
+    upload.write_chunk(index, chunk, hashlib.sha256(chunk).hexdigest())
+
+
+def wait_for(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.05)
+
+
+def test_chunks_in_any_order():
+    with tempfile.TemporaryDirectory() as folder:
+        data = cohort_zip(folder)
+        scorer = FakeScorer()
+        uploads = ChunkedUploads(os.path.join(folder, 'uploads'), scorer)
+        chunk_size = len(data) // 7 + 1
+        upload = uploads.create('cohort.zip', len(data), chunk_size)
+        chunks = chunks_of(data, chunk_size)
+
+        try:
+            upload.write_chunk(0, chunks[0], hashlib.sha256(b'something else').hexdigest())
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('accepted a chunk with the wrong checksum')
+        assert upload.status()['received_chunks'] == 0
+
+        for index in reversed(range(1, len(chunks))):
+            send(upload, index, chunks[index])
+        send(upload, 3, chunks[3])  # a re-sent chunk is accepted and ignored
+        assert upload.status()['missing_chunks'] == [0]
+        send(upload, 0, chunks[0])
+
+        wait_for(lambda: upload.status()['status'] == 'done')
+        status = upload.status()
+        assert status['patients'] == [{'patient_id': '9000', 'recordings': 2}, {'patient_id': '9001', 'recordings': 2}]
+        assert sorted(scorer.calls) == ['9000', '9001']
+        assert not os.path.exists(upload.zip_path)
+
+
+def test_patients_are_scored_before_the_upload_ends():
+    with tempfile.TemporaryDirectory() as folder:
+        data = cohort_zip(folder)
+        scorer = FakeScorer()
+        uploads = ChunkedUploads(os.path.join(folder, 'uploads'), scorer)
+        chunk_size = len(data) // 20 + 1
+        upload = uploads.create('cohort.zip', len(data), chunk_size)
+        chunks = chunks_of(data, chunk_size)
+        for index, chunk in enumerate(chunks[:-1]):
+            send(upload, index, chunk)
+
+        # The archive moved on to the second patient, so the first is scored while the upload is still receiving
+        wait_for(lambda: len(scorer.calls) == 1)
+        assert upload.status()['status'] == 'receiving'
+        send(upload, len(chunks) - 1, chunks[-1])
+        wait_for(lambda: upload.status()['status'] == 'done')
+        assert sorted(scorer.calls) == ['9000', '9001']
+
+
+def test_upload_resumes_after_a_restart():
+    with tempfile.TemporaryDirectory() as folder:
+        data = cohort_zip(folder)
+        upload_folder = os.path.join(folder, 'uploads')
+        chunk_size = len(data) // 5 + 1
+        chunks = chunks_of(data, chunk_size)
+        upload = ChunkedUploads(upload_folder, FakeScorer(), ttl=0.5).create('cohort.zip', len(data), chunk_size)
+        for index in (0, 1, 3):
+            send(upload, index, chunks[index])
+        job = upload.job
+        job.join(timeout=30)  # idle for longer than the TTL, like a server that went away
+        assert not job.is_alive()
+
+        restarted = ChunkedUploads(upload_folder, FakeScorer())
+        resumed = restarted.get(upload.upload_id)
+        assert resumed is not upload
+        assert resumed.status()['missing_chunks'] == [2, 4]
+        for index in (2, 4):
+            send(resumed, index, chunks[index])
+        wait_for(lambda: resumed.status()['status'] == 'done')
+        assert [result['patient_id'] for result in resumed.status()['patients']] == ['9000', '9001']
+
+
+def test_reap_spares_busy_and_polled_uploads():
+    with tempfile.TemporaryDirectory() as folder:
+        data = cohort_zip(folder, num_patients=1)
+        scorer = FakeScorer(block=True)
+        uploads = ChunkedUploads(os.path.join(folder, 'uploads'), scorer, ttl=0.5)
+
+        scoring = uploads.create('cohort.zip', len(data), len(data))
+        send(scoring, 0, data)
+        idle = uploads.create('idle.zip', 100, 10)
+        idle_job = idle.job
+        polled = uploads.create('polled.zip', 100, 10)
+        for _ in range(10):
+            time.sleep(0.1)
+            assert uploads.get(polled.upload_id) is polled
+        idle_job.join(timeout=30)
+        uploads.reap()
+        assert set(uploads.uploads) == {scoring.upload_id, polled.upload_id}
+        assert not os.path.exists(os.path.join(uploads.folder, idle.upload_id))
+
+        # Still scoring long after its last chunk; dropped only once the job is done and the TTL has passed again
+        scorer.release.set()
+        wait_for(lambda: scoring.status()['status'] == 'done')
+        scoring.job.join(timeout=30)
+        time.sleep(0.6)
+        uploads.reap()
+        assert scoring.upload_id not in uploads.uploads
+
+
+if __name__ == '__main__':
+    test_chunks_in_any_order()
+    test_patients_are_scored_before_the_upload_ends()
+    test_upload_resumes_after_a_restart()
+    test_reap_spares_busy_and_polled_uploads()
+    print("OK")
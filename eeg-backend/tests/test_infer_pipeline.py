@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from catalog import open_catalog, forget_catalog
+from inference_utils import InferencePipeline
+
+
+def rewrite_in_place(path, rewrite):
+    """Rewrites a file without touching its folder's mtime, and moves its own mtime forward by a second."""
+    folder_stat = os.stat(os.path.dirname(path))
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(rewrite(data))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    os.utime(os.path.dirname(path), ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+
+
+def test_pipeline_is_rebuilt_only_when_a_recording_changes():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, 'cohort')
+        synthetic.write_cohort(root, num_patients=2, num_recordings=2, duration=60)
+        pipeline = InferencePipeline(root, num_workers=0)
+        try:
+            loader = pipeline.refresh()
+            assert len(loader.dataset) == 2
+            assert pipeline.refresh() is loader
+
+            # A signal file rewritten in place
+            patient_folder = os.path.join(root, '9000')
+            signal_file = sorted(name for name in os.listdir(patient_folder) if name.endswith('.mat'))[0]
+            rewrite_in_place(os.path.join(patient_folder, signal_file), lambda data: data[:-2] + b'\x01\x02')
+            rebuilt = pipeline.refresh()
+            assert rebuilt is not loader
+            assert pipeline.refresh() is rebuilt
+
+            # Metadata edited in place: the rebuilt index reads the new outcome
+            assert open_catalog(root).outcome('9000') == 'Good'
+            rewrite_in_place(os.path.join(patient_folder, '9000.txt'),
+                             lambda data: data.replace(b'Outcome: Good', b'Outcome: Poor'))
+            loader = pipeline.refresh()
+            assert loader is not rebuilt and len(loader.dataset) == 2
+            assert open_catalog(root).outcome('9000') == 'Poor'
+        finally:
+            pipeline.close()
+            forget_catalog(root)
+
+
+if __name__ == '__main__':
+    test_pipeline_is_rebuilt_only_when_a_recording_changes()
+    print("OK")
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, '..', 'app')
+sys.path.insert(0, app_dir)
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from live import LiveSessions
+
+FS = 250
+
+
+def read_events(response, count):
+    """The first count events of a server-sent event stream."""
+    events = []
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        for line in text.splitlines():
+            if line.startswith('data: '):
+                events.append(json.loads(line[len('data: '):]))
+        if len(events) >= count:
+            break
+    response.close()
+    return events
+
+
+def test_live_session_endpoints():
+    import server
+    with tempfile.TemporaryDirectory() as folder:
+        server.MODEL_FOLDER = synthetic.write_model_folder(os.path.join(folder, 'model'),
+                                                           os.path.join(app_dir, 'model', 'dl_model.pth'))
+        server._models_loaded = False
+        client = server.app.test_client()
+
+        for body in ({'sampling_rate': 250.001, 'num_channels': 19}, {'sampling_rate': -1, 'num_channels': 19},
+                     {'num_channels': 19}):
+            assert client.post('/live/sessions', json=body).status_code == 400
+
+        response = client.post('/live/sessions', json={'sampling_rate': FS, 'num_channels': 19, 'patient_id': '9000'})
+        assert response.status_code == 201
+        session_id = response.get_json()['session_id']
+
+        # 45 s of EEG, as JSON and then as raw float32 frames: two complete 20 s windows
+        eeg = synthetic.synthetic_signal(45 * FS, 19, FS, np.random.default_rng(0))
+        response = client.post(f'/live/sessions/{session_id}/chunks', json={'samples': eeg[:25 * FS].tolist()})
+        assert response.status_code == 200
+        assert response.get_json()['windows_submitted_by_chunk'] == 1
+        response = client.post(f'/live/sessions/{session_id}/chunks', data=eeg[25 * FS:].astype('<f4').tobytes(),
+                               content_type='application/octet-stream')
+        assert response.get_json()['windows_submitted_by_chunk'] == 1
+        assert client.post(f'/live/sessions/{session_id}/chunks', data=b'\0' * 5,
+                           content_type='application/octet-stream').status_code == 400
+
+        events = read_events(client.get(f'/live/sessions/{session_id}/events'), 2)
+        assert [event['window'] for event in events] == [0, 1]
+        assert all(0.0 <= event['probability'] <= 1.0 and 'error' not in event for event in events)
+        # Reconnecting with Last-Event-ID resumes after the events already seen
+        client.post(f'/live/sessions/{session_id}/chunks', json={'samples': eeg[:20 * FS].tolist()})
+        (event,) = read_events(client.get(f'/live/sessions/{session_id}/events', headers={'Last-Event-ID': '2'}), 1)
+        assert event['window'] == 2
+
+        status = client.get(f'/live/sessions/{session_id}').get_json()
+        assert status['samples_received'] == 65 * FS and status['windows_scored'] == 3
+        assert client.delete(f'/live/sessions/{session_id}').get_json()['closed']
+        assert client.get(f'/live/sessions/{session_id}').status_code == 404
+
+
+def test_idle_sessions_expire_without_new_sessions():
+    sessions = LiveSessions(lambda: None, timeout=0.5)
+    active = sessions.create(FS, 4)
+    idle = sessions.create(FS, 4)
+    for _ in range(8):
+        time.sleep(0.1)
+        active.feed(np.zeros((FS // 10, 4)), sessions.scorer)
+    assert sessions.get(active.session_id) is active
+    assert sessions.get(idle.session_id) is None
+    assert idle.closed and idle.session_id not in sessions.sessions
+
+
+if __name__ == '__main__':
+    test_live_session_endpoints()
+    test_idle_sessions_expire_without_new_sessions()
+    print("OK")
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from buffer_pool import POOL
+from preprocess import read_for_inference
+from team_code import prefetch_recordings
+
+
+def reader_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('prefetch')]
+
+
+def test_concurrent_prefetches_have_their_own_reader():
+    with tempfile.TemporaryDirectory() as folder:
+        patients = [[synthetic.write_record(os.path.join(folder, patient), f'{patient}_001_{i:03d}_EEG', duration=620,
+                                            seed=i) for i in range(3)] for patient in ('9000', '9001')]
+        first, second = (prefetch_recordings(record_paths, depth=1) for record_paths in patients)
+        for (first_path, first_raw), (second_path, second_raw) in zip(first, second):
+            assert len(reader_threads()) == 2
+            for record_path, raw in ((first_path, first_raw), (second_path, second_raw)):
+                samples, fs = raw.result()
+                expected, expected_fs = read_for_inference(record_path)
+                assert fs == expected_fs and np.array_equal(samples, expected)
+                POOL.release(samples)
+        second.close()  # zip() stops at the first one, leaving the second at its last yield
+
+        # Both generators are done, so their readers shut down
+        deadline = time.monotonic() + 10
+        while reader_threads() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not reader_threads()
+        assert POOL.in_use_bytes == 0
+
+
+if __name__ == '__main__':
+    test_concurrent_prefetches_have_their_own_reader()
+    print("OK")
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import tracemalloc
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from preprocess import preprocess_for_inference
+
+# Float32 preprocessing of a 19-channel 500 Hz recording: 40 minutes of float32 input (~87 MB), the int16 samples it
+# is decoded from (~43 MB) and the 100 Hz output (~17 MB), plus per-channel temporaries.
+PEAK_BUDGET = 200 * 2**20
+
+
+def peak_memory(record_path, dtype):
+    tracemalloc.start()
+    try:
+        windows = preprocess_for_inference(record_path, 100, window_size=180, dtype=dtype)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return windows, peak
+
+
+def test_float32_peak_memory():
+    with tempfile.TemporaryDirectory() as folder:
+        for duration in (40 * 60, 60 * 60):
+            record_path = synthetic.write_record(folder, f'9000_001_{duration // 60:03d}_EEG', duration=duration)
+            (window_long, window_short), peak = peak_memory(record_path, 'float32')
+            print(f"{duration // 60} min: peak {peak / 2**20:.0f} MB")
+            assert window_long.dtype == np.float32 and window_short.dtype == np.float32
+            assert peak < PEAK_BUDGET
+
+
+def test_float32_matches_float64():
+    with tempfile.TemporaryDirectory() as folder:
+        record_path = synthetic.write_record(folder, '9000_001_011_EEG', num_channels=17, duration=11 * 60)
+        (long32, short32), _ = peak_memory(record_path, 'float32')
+        (long64, short64), _ = peak_memory(record_path, 'float64')
+        assert long32.shape == long64.shape and short32.shape == short64.shape
+        assert np.abs(long32 - long64).max() < 1e-5
+        assert np.abs(short32 - short64).max() < 1e-5
+
+
+if __name__ == '__main__':
+    test_float32_peak_memory()
+    test_float32_matches_float64()
+    print("OK")
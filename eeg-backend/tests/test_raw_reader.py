@@ -0,0 +1,101 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import wfdb
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+
+from raw_reader import read_header, read_samples, read_window, is_directly_readable
+
+NUM_SAMPLES = 3000
+
+
+def write_record(folder, record_name, fmt, byte_offset=0, drop_length=False):
+    """Writes a 4-channel WFDB record in fmt, optionally behind byte_offset bytes and without its sample count.
+
+    wfdb cannot write formats 61 and 160, so those are converted from a format 16 file.
+    """
+    rng = np.random.default_rng(int(fmt))
+    low, high = {'80': (-127, 127), '212': (-2047, 2047)}.get(fmt, (-30000, 30000))
+    digital = rng.integers(low, high, size=(NUM_SAMPLES, 4))
+    written_fmt = '16' if fmt in ('61', '160') else fmt
+    wfdb.wrsamp(record_name, fs=250, units=['uV'] * 4, sig_name=['Fp1', 'Fp2', 'Cz', 'O1'], d_signal=digital,
+                fmt=[written_fmt] * 4, adc_gain=[12.5, 40.0, 200.0, 3.0], baseline=[-7, 0, 11, 100], write_dir=folder)
+    record_path = os.path.join(folder, record_name)
+    if fmt != written_fmt:
+        samples = np.fromfile(record_path + '.dat', dtype='<i2')
+        converted = samples.astype('>i2') if fmt == '61' else (samples.astype(np.int32) + 32768).astype('<u2')
+        converted.tofile(record_path + '.dat')
+        with open(record_path + '.hea', 'r') as f:
+            lines = f.read().splitlines()
+        lines[1:5] = [line.replace('.dat 16 ', f'.dat {fmt} ', 1) for line in lines[1:5]]
+        with open(record_path + '.hea', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    if byte_offset or drop_length:
+        with open(record_path + '.dat', 'rb') as f:
+            data = f.read()
+        with open(record_path + '.dat', 'wb') as f:
+            f.write(b'\0' * byte_offset + data)
+        with open(record_path + '.hea', 'r') as f:
+            lines = f.read().splitlines()
+        record_line = lines[0].split()
+        lines[0] = ' '.join(record_line[:3] if drop_length else record_line)
+        lines[1:5] = [line.replace(f'.dat {fmt} ', f'.dat {fmt}+{byte_offset} ', 1) for line in lines[1:5]]
+        with open(record_path + '.hea', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return record_path
+
+
+def expected_samples(record_path, start, stop, channels=None):
+    return wfdb.rdrecord(record_path, sampfrom=start, sampto=stop, channels=channels).p_signal
+
+
+def test_read_samples_matches_wfdb():
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in ('16', '61', '80', '160', '24', '32', '212'):
+            for byte_offset in (0, 24):
+                record_path = write_record(folder, f'r{fmt}_{byte_offset}', fmt, byte_offset)
+                header = read_header(record_path)
+                assert header['num_samples'] == NUM_SAMPLES
+                for start, stop, channels in ((0, NUM_SAMPLES, None), (123, 1234, None), (500, 501, [3, 1])):
+                    samples = read_samples(record_path, start, stop, channels, dtype=np.float64)
+                    expected = expected_samples(record_path, start, stop, channels)
+                    assert samples.shape == expected.shape, (fmt, byte_offset)
+                    np.testing.assert_allclose(samples, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_read_window_clips_to_the_record():
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in ('16', '212'):
+            record_path = write_record(folder, f'w{fmt}', fmt)
+            samples, offset = read_window(record_path, 100, 400, margin=250, dtype=np.float64)
+            assert offset == 100
+            np.testing.assert_allclose(samples, expected_samples(record_path, 0, 650), rtol=1e-12)
+            samples, offset = read_window(record_path, NUM_SAMPLES - 100, NUM_SAMPLES + 500, margin=50)
+            assert offset == 50 and samples.shape == (150, 4)
+            assert read_samples(record_path, NUM_SAMPLES + 10, NUM_SAMPLES + 20).shape == (0, 4)
+
+
+def test_missing_sample_count_is_inferred():
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in ('16', '212'):
+            # wfdb itself needs the sample count, so the expected samples come from a copy that has it
+            reference_path = write_record(folder, f'l{fmt}', fmt, byte_offset=24)
+            record_path = write_record(folder, f'n{fmt}', fmt, byte_offset=24, drop_length=True)
+            header = read_header(record_path)
+            assert header['num_samples'] == NUM_SAMPLES
+            if fmt != '16':
+                continue  # wfdb.rdrecord, the fallback for packed formats, cannot read headers without the count
+            assert is_directly_readable(header)
+            samples, offset = read_window(record_path, 10, NUM_SAMPLES + 10, margin=5, dtype=np.float64)
+            assert offset == 5
+            np.testing.assert_allclose(samples, expected_samples(reference_path, 5, NUM_SAMPLES), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    test_read_samples_matches_wfdb()
+    test_read_window_clips_to_the_record()
+    test_missing_sample_count_is_inferred()
+    print("OK")
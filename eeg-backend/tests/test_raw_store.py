@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import wfdb
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from raw_store import open_record, store_path
+
+UNITS = ['uV', 'mV', 'uV', 'NU']
+
+
+def write_packed_record(folder, record_name):
+    """A format 212 record with mixed units and baselines, which has to be ingested before it can be mapped."""
+    digital = np.random.default_rng(0).integers(-2047, 2047, size=(5000, 4))
+    wfdb.wrsamp(record_name, fs=250, units=UNITS, sig_name=['Fp1', 'Fp2', 'SpO2', 'ECG'], d_signal=digital,
+                fmt=['212'] * 4, adc_gain=[12.5, 0.2, 200.0, 3.0], baseline=[-7, 0, 11, 100], write_dir=folder)
+    return os.path.join(folder, record_name)
+
+
+def test_mapped_and_ingested_records_match_wfdb():
+    with tempfile.TemporaryDirectory() as folder:
+        store_folder = os.path.join(folder, 'store')
+        challenge_path = synthetic.write_record(folder, '9000_001_004_EEG', num_channels=4, duration=30)
+        packed_path = write_packed_record(folder, 'packed')
+
+        for record_path, ingested in ((challenge_path, False), (packed_path, True)):
+            expected = wfdb.rdrecord(record_path)
+            record = open_record(record_path, store_folder)
+            assert os.path.exists(store_path(record_path, store_folder) + '.hea') == ingested
+            np.testing.assert_allclose(record.read(0, record.num_samples, dtype=np.float64), expected.p_signal,
+                                       rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(record.read(100, 250, channels=[3, 0], dtype=np.float64),
+                                       expected.p_signal[100:250, [3, 0]], rtol=1e-12, atol=1e-12)
+
+        # The ingested copy is a WFDB record in its own right, with the source's units
+        copy = wfdb.rdrecord(store_path(packed_path, store_folder))
+        source = wfdb.rdrecord(packed_path)
+        assert copy.units == source.units == UNITS
+        assert copy.sig_name == source.sig_name and copy.fmt == ['16'] * 4
+        np.testing.assert_allclose(copy.p_signal, source.p_signal, rtol=1e-12, atol=1e-12)
+
+
+if __name__ == '__main__':
+    test_mapped_and_ingested_records_match_wfdb()
+    print("OK")
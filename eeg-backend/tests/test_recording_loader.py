@@ -0,0 +1,146 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import scipy as sp, scipy.io
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from helper_code import load_recording_data, reduce_channels, expand_channels
+
+
+def reference_load_recording_data(record_name, check_values=False):
+    """The Challenge's original per-channel loader, which load_recording_data must reproduce bit for bit."""
+    header_file = record_name + '.hea'
+    with open(header_file, 'r') as f:
+        header = [l.strip() for l in f.readlines() if l.strip()]
+
+    num_samples = None
+    sampling_frequency = None
+    signal_files, gains, baselines, adc_zeros, channels, initial_values, checksums = [], [], [], [], [], [], []
+    for i, l in enumerate(header):
+        arrs = [arr.strip() for arr in l.split(' ')]
+        if i==0:
+            sampling_frequency = float(arrs[2])
+            num_samples = int(arrs[3])
+        elif not l.startswith('#') or len(l.strip()) == 0:
+            if '(' in arrs[2] and ')' in arrs[2]:
+                gain = float(arrs[2].split('/')[0].split('(')[0])
+                baseline = float(arrs[2].split('/')[0].split('(')[1].split(')')[0])
+            else:
+                gain = float(arrs[2].split('/')[0])
+                baseline = 0.0
+            signal_files.append(arrs[0])
+            gains.append(gain)
+            baselines.append(baseline)
+            adc_zeros.append(int(arrs[4]))
+            initial_values.append(int(arrs[5]))
+            checksums.append(int(arrs[6]))
+            channels.append(arrs[8])
+
+    signal_file = os.path.join(os.path.dirname(header_file), signal_files[0])
+    data = np.asarray(sp.io.loadmat(signal_file)['val'])
+    num_channels = len(channels)
+    if np.shape(data)!=(num_channels, num_samples):
+        raise ValueError('inconsistent dimensions')
+    if check_values:
+        for i in range(num_channels):
+            if data[i, 0]!=initial_values[i]:
+                raise ValueError('initial value')
+            if np.sum(data[i, :], dtype=np.int16)!=checksums[i]:
+                raise ValueError('checksum')
+
+    rescaled_data = np.zeros(np.shape(data), dtype=np.float32)
+    for i in range(num_channels):
+        rescaled_data[i, :] = (np.asarray(data[i, :], dtype=np.float64) - baselines[i] - adc_zeros[i]) / gains[i]
+    return rescaled_data, channels, sampling_frequency
+
+
+def assert_same(actual, expected):
+    data, channels, fs = actual
+    expected_data, expected_channels, expected_fs = expected
+    assert channels == expected_channels and fs == expected_fs
+    assert data.dtype == expected_data.dtype and data.shape == expected_data.shape
+    assert np.array_equal(data, expected_data)
+
+
+def rewrite_header(record_path, rewrite):
+    with open(record_path + '.hea', 'r') as f:
+        lines = f.read().splitlines()
+    with open(record_path + '.hea', 'w') as f:
+        f.write('\n'.join(rewrite(lines)) + '\n')
+
+
+def test_matches_reference_on_challenge_records():
+    with tempfile.TemporaryDirectory() as folder:
+        record_path = synthetic.write_record(folder, '9000_001_004_EEG', duration=4 * 60)
+        for check_values in (False, True):
+            assert_same(load_recording_data(record_path, check_values=check_values),
+                        reference_load_recording_data(record_path, check_values=check_values))
+
+        # A wrong checksum is reported by both
+        rewrite_header(record_path, lambda lines: [lines[0], lines[1].rsplit(' ', 3)[0] + ' 12345 0 Fp1'] + lines[2:])
+        for loader in (load_recording_data, reference_load_recording_data):
+            try:
+                loader(record_path, check_values=True)
+            except ValueError:
+                continue
+            raise AssertionError(f'{loader.__name__} accepted a wrong checksum')
+
+
+def test_matches_reference_through_loadmat():
+    with tempfile.TemporaryDirectory() as folder:
+        # A MATLAB v5 file without the 24-byte offset, and non-zero ADC zeros
+        record_path = synthetic.write_record(folder, '9000_001_005_EEG', num_channels=7, duration=90)
+        digital = sp.io.loadmat(record_path + '.mat')['val']
+        sp.io.savemat(record_path + '.mat', {'val': digital})
+
+        def rewrite(lines):
+            signal_lines = []
+            for i, line in enumerate(lines[1:8]):
+                arrs = line.split(' ')
+                arrs[1], arrs[4] = '16', str(10 * i - 30)
+                signal_lines.append(' '.join(arrs))
+            return [lines[0]] + signal_lines + lines[8:]
+        rewrite_header(record_path, rewrite)
+
+        for check_values in (False, True):
+            assert_same(load_recording_data(record_path, check_values=check_values),
+                        reference_load_recording_data(record_path, check_values=check_values))
+
+
+def test_matches_reference_on_empty_record():
+    with tempfile.TemporaryDirectory() as folder:
+        record_path = os.path.join(folder, '9000_001_000_EEG')
+        synthetic.write_mat_v4(record_path + '.mat', np.zeros((3, 0), dtype=np.int16))
+        with open(record_path + '.hea', 'w') as f:
+            f.write('9000_001_000_EEG 3 500 0\n' + ''.join(
+                f'9000_001_000_EEG.mat 16+24 17.0(5)/uV 16 0 0 0 0 {channel}\n' for channel in ('Fp1', 'Fp2', 'Cz')))
+        data, channels, fs = load_recording_data(record_path)
+        assert_same((data, channels, fs), reference_load_recording_data(record_path))
+        assert data.shape == (3, 0)
+
+
+def test_channel_subset_matches_reduce_channels():
+    with tempfile.TemporaryDirectory() as folder:
+        record_path = synthetic.write_record(folder, '9000_001_006_EEG', duration=60)
+        reference, reference_channels, fs = reference_load_recording_data(record_path)
+        requested = ['Cz', 'O2', 'T3', 'Fp1', 'Oz']  # Oz is not in the record
+        expected_data, expected_channels = reduce_channels(reference, reference_channels, requested)
+        data, channels, subset_fs = load_recording_data(record_path, channels=requested)
+        assert_same((data, channels, subset_fs), (expected_data, expected_channels, fs))
+        assert data.flags['C_CONTIGUOUS']
+
+        expanded = expand_channels(data, channels, requested)
+        assert np.array_equal(expanded[:4], expected_data) and np.isnan(expanded[4]).all()
+
+
+if __name__ == '__main__':
+    test_matches_reference_on_challenge_records()
+    test_matches_reference_through_loadmat()
+    test_matches_reference_on_empty_record()
+    test_channel_subset_matches_reduce_channels()
+    print("OK")
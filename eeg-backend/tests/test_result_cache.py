@@ -0,0 +1,116 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, '..', 'app')
+sys.path.insert(0, app_dir)
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from catalog import forget_catalog
+from result_cache import ResultCache, patient_fingerprint, model_version
+
+DL_MODEL_PATH = os.path.join(app_dir, 'model', 'dl_model.pth')
+
+
+def test_cache_is_lru_and_returns_copies():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', {'cpc': 1.0})
+    cache.put('b', {'cpc': 2.0})
+    result = cache.get('a')
+    result['cached'] = True
+    assert cache.get('a') == {'cpc': 1.0}
+    cache.put('c', {'cpc': 3.0})  # evicts b, the least recently used
+    assert cache.get('b') is None and len(cache) == 2
+    cache.clear()
+    assert cache.get('a') is None
+
+    disabled = ResultCache(max_entries=0)
+    disabled.put('a', {'cpc': 1.0})
+    assert disabled.get('a') is None
+
+
+def test_fingerprint_and_version_track_file_contents():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, 'cohort')
+        synthetic.write_cohort(root, num_patients=1, num_recordings=2, duration=60)
+        fingerprint = patient_fingerprint(root, '9000')
+        assert patient_fingerprint(root, '9000') == fingerprint
+
+        # Rewriting a signal file in place changes the fingerprint, even though the catalog does not see it
+        record_name = sorted(name for name in os.listdir(os.path.join(root, '9000')) if name.endswith('.mat'))[0]
+        with open(os.path.join(root, '9000', record_name), 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b'\x01\x02')
+        assert patient_fingerprint(root, '9000') != fingerprint
+        forget_catalog(root)
+
+        model_folder = synthetic.write_model_folder(os.path.join(folder, 'model'), DL_MODEL_PATH)
+        version = model_version(model_folder)
+        assert model_version(model_folder) == version
+        synthetic.write_model_folder(model_folder, DL_MODEL_PATH, seed=1)
+        assert model_version(model_folder) != version
+
+
+def test_predict_uses_the_cache_and_swaps_models():
+    import server
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder = os.path.join(folder, 'cohort')
+        synthetic.write_cohort(data_folder, num_patients=1, num_recordings=2, duration=700)
+        cohort = synthetic.zip_cohort(data_folder)
+        model_folder = synthetic.write_model_folder(os.path.join(folder, 'model'), DL_MODEL_PATH)
+        check_seconds = server.MODEL_CHECK_SECONDS
+        server.MODEL_FOLDER = model_folder
+        server.MODEL_CHECK_SECONDS = 0
+        server._models_loaded = False
+        server.RESULT_CACHE.clear()
+        client = server.app.test_client()
+
+        def predict():
+            response = client.post('/predict', data={'file': (io.BytesIO(cohort), 'cohort.zip')},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 200
+            (result,) = response.get_json()['patients']
+            assert 'error' not in result
+            return result
+
+        first = predict()
+        assert 'cached' not in first
+        second = predict()
+        assert second.pop('cached') and second == first
+        models, version = server.loaded_models
+
+        # New model files: concurrent requests reload them once, and the old models' results are not reused
+        loads = []
+        load_challenge_models = server.load_challenge_models
+
+        def counting_load(*args, **kwargs):
+            loads.append(args)
+            return load_challenge_models(*args, **kwargs)
+
+        server.load_challenge_models = counting_load
+        try:
+            synthetic.write_model_folder(model_folder, DL_MODEL_PATH, seed=1)
+            threads = [threading.Thread(target=server.reload_models_if_changed) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.load_challenge_models = load_challenge_models
+            server.MODEL_CHECK_SECONDS = check_seconds
+        assert len(loads) == 1
+        new_models, new_version = server.loaded_models
+        assert new_models is not models and new_version == model_version(model_folder) != version
+        assert len(server.RESULT_CACHE) == 0
+        assert 'cached' not in predict()
+
+
+if __name__ == '__main__':
+    test_cache_is_lru_and_returns_copies()
+    test_fingerprint_and_version_track_file_contents()
+    test_predict_uses_the_cache_and_swaps_models()
+    print("OK")
@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, '..', 'app')
+sys.path.insert(0, app_dir)
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+from run_batch import run_batch
+
+OUTPUT_COLUMNS = ('patient_id', 'status', 'outcome', 'outcome_probability', 'cpc')
+
+
+def test_workers_match_sequential_run():
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder = os.path.join(folder, 'cohort')
+        synthetic.write_cohort(data_folder, num_patients=4, num_recordings=2, duration=700)
+        model_folder = synthetic.write_model_folder(os.path.join(folder, 'model'),
+                                                    os.path.join(app_dir, 'model', 'dl_model.pth'))
+
+        outputs = {}
+        for workers in (1, 3):
+            results, summary = run_batch(model_folder, data_folder, os.path.join(folder, f'outputs_{workers}'),
+                                         workers=workers, verbose=0)
+            assert summary['computed'] == 4 and summary['failed'] == 0
+            outputs[workers] = [tuple(result[column] for column in OUTPUT_COLUMNS) for result in results]
+        assert outputs[3] == outputs[1]
+
+
+if __name__ == '__main__':
+    test_workers_match_sequential_run()
+    print("OK")
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import numpy as np
+from scipy import signal
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+sys.path.insert(0, os.path.join(current_dir, '..', 'benchmarks'))
+
+import synthetic
+import preprocess
+from streaming import StreamingResampler, StreamingPreprocessor
+
+
+def stream(processor, eeg_signal, max_chunk, seed=0):
+    """Feeds eeg_signal to processor in random-length chunks and returns everything it emitted."""
+    rng = np.random.default_rng(seed)
+    outputs = []
+    position = 0
+    while position < len(eeg_signal):
+        size = int(rng.integers(1, max_chunk))
+        outputs.append(processor.process(eeg_signal[position:position + size]))
+        position += size
+    outputs.append(processor.flush())
+    return np.concatenate(outputs)
+
+
+def test_resampler_matches_resample_poly():
+    rng = np.random.default_rng(0)
+    for fs in (500, 256, 250, 200, 100):
+        eeg_signal = rng.standard_normal((20000, 3))
+        resampler = StreamingResampler(fs, 100, 3)
+        resampled = stream(resampler, eeg_signal, max_chunk=2 * fs)
+        expected = signal.resample_poly(eeg_signal, resampler.up, resampler.down, axis=0)
+        assert resampled.shape == expected.shape
+        assert np.abs(resampled - expected).max() < 1e-9
+        assert len(resampler.history) <= resampler.taps_per_phase
+
+
+def test_matches_offline_pipeline():
+    with tempfile.TemporaryDirectory() as folder:
+        for fs in (500, 256, 100):
+            record_path = synthetic.write_record(folder, f'9000_001_{fs:03d}_EEG', duration=11 * 60, fs=fs)
+            eeg_signal, _ = preprocess.read_eeg_for_inference(record_path, dtype=np.float64)
+            num_samples = int(eeg_signal.shape[0] * 100 / fs)
+            offline = preprocess.apply_filtering(signal.resample(eeg_signal, num_samples, axis=0), 100)
+
+            filtered = stream(StreamingPreprocessor(fs, eeg_signal.shape[1], normalize=False), eeg_signal, 3 * fs)
+            filtered = filtered[:, :offline.shape[1]]
+            assert filtered.shape == offline.shape
+            relative_error = np.abs(filtered - offline)[100:-200] / offline[100:-200].std(axis=0)
+            print(f"{fs} Hz: filtered error {relative_error.max():.4f} of channel std")
+            assert relative_error.max() < 0.005
+
+            normalized = preprocess.normalize_eeg_voltages(filtered.astype(np.float64))
+            expected = preprocess.preprocess_eeg_signal_float32(eeg_signal.astype(np.float32), fs)
+            assert np.abs(normalized - expected)[100:].max() < 0.006
+
+
+def test_rejects_rates_needing_huge_filters():
+    for fs, factors in ((4096, (25, 1024)), (250.5, (200, 501)), (99.9, (1000, 999))):
+        resampler = StreamingResampler(fs, 100, 2)
+        assert (resampler.up, resampler.down) == factors
+    for fs in (250.001, 999.999, 0.09):
+        try:
+            StreamingResampler(fs, 100, 2)
+        except ValueError:
+            continue
+        raise AssertionError(f'accepted {fs} Hz')
+
+
+if __name__ == '__main__':
+    test_resampler_matches_resample_poly()
+    test_matches_offline_pipeline()
+    test_rejects_rates_needing_huge_filters()
+    print("OK")
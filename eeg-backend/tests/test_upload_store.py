@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, '..', 'app'))
+
+from upload_store import UploadStore
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def stored_objects(store):
+    return sorted(name for _, _, files in os.walk(os.path.join(store.folder, 'objects')) for name in files)
+
+
+def test_identical_uploads_are_stored_once():
+    with tempfile.TemporaryDirectory() as folder:
+        store = UploadStore(folder)
+        with store.open_session() as first, store.open_session() as second:
+            first_path = first.add('9000_001_004_EEG.hea', io.BytesIO(b'header'))
+            second_path = second.add('9000_001_004_EEG.hea', io.BytesIO(b'header'))
+            second.add('9000_001_004_EEG.mat', io.BytesIO(b'signal'))
+            # Same filename in two sessions: separate paths, one stored object
+            assert first_path != second_path
+            assert os.path.samefile(first_path, second_path)
+            assert stored_objects(store) == sorted([sha(b'header'), sha(b'signal')])
+        assert store.usage()['objects'] == 2
+        assert not os.listdir(os.path.join(folder, 'sessions'))
+
+
+def test_unsafe_filenames_are_rejected():
+    with tempfile.TemporaryDirectory() as folder:
+        store = UploadStore(folder)
+        with store.open_session() as session:
+            for filename in ('', '../9000.hea', 'sub/9000.hea', '9000 001.hea', '..'):
+                try:
+                    session.add(filename, io.BytesIO(b'x'))
+                except ValueError:
+                    continue
+                raise AssertionError(f'accepted {filename!r}')
+            assert not os.listdir(session.folder)
+
+
+def test_unreferenced_objects_expire_after_the_ttl():
+    with tempfile.TemporaryDirectory() as folder:
+        store = UploadStore(folder, ttl=1.0)
+        with store.open_session() as session:
+            session.add('released.hea', io.BytesIO(b'released'))
+        time.sleep(0.6)
+        held = store.open_session()
+        held.add('held.hea', io.BytesIO(b'held'))
+        store.evict()
+        assert stored_objects(store) == sorted([sha(b'released'), sha(b'held')])
+
+        # Past the TTL the released object goes, while the one an open session references stays...
+        time.sleep(0.6)
+        store.evict()
+        assert stored_objects(store) == [sha(b'held')]
+        # ...until that reference expires with the TTL too, as for a worker killed before closing its session
+        time.sleep(0.6)
+        store.evict()
+        assert stored_objects(store) == [] and store.usage()['objects'] == 0
+        assert not os.path.exists(held.folder)
+
+
+def test_least_recently_used_objects_go_first_over_quota():
+    with tempfile.TemporaryDirectory() as folder:
+        store = UploadStore(folder, quota_bytes=250)
+        for name in (b'a', b'b', b'c'):
+            with store.open_session() as session:
+                session.add('record.mat', io.BytesIO(name * 100))
+            time.sleep(0.01)
+        # Three 100-byte objects over a 250-byte quota: the oldest went when the third session closed
+        assert stored_objects(store) == sorted([sha(b'b' * 100), sha(b'c' * 100)])
+        assert store.usage()['bytes'] == 200
+
+        with store.open_session() as session:
+            session.add('record.mat', io.BytesIO(b'b' * 100))  # used again, so c is now the oldest
+            session.add('other.mat', io.BytesIO(b'd' * 100))
+            # Over quota, but nothing is evicted while the session references its objects
+            assert len(stored_objects(store)) == 3
+        assert stored_objects(store) == sorted([sha(b'b' * 100), sha(b'd' * 100)])
+
+
+if __name__ == '__main__':
+    test_identical_uploads_are_stored_once()
+    test_unsafe_filenames_are_rejected()
+    test_unreferenced_objects_expire_after_the_ttl()
+    test_least_recently_used_objects_go_first_over_quota()
+    print("OK")